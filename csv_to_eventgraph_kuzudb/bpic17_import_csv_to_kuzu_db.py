@@ -1,11 +1,47 @@
 import kuzu
-import csv
-import datetime
+import datetime, os
+import event_schema
+import prepare_utils
+import bpic17_prepare
+import bulk_import
 import infer_df_edges
 import queries_build_dfg
 
-#inputCSV = "prepared/BPIC17sample.csv"
-inputCSV = "prepared/BPIC17full.csv"
+#inputFile = "prepared/BPIC17sample.csv"
+inputFile = "prepared/BPIC17full.csv"
+#inputFile = "prepared/BPIC17full.parquet" # typed event table written by bpic17_prepare.py with output_format = 'parquet'
+
+# prepare the event table in-process with bpic17_prepare.py (with its configuration, e.g., sample) and hand it
+# to COPY Event as typed arrow table, without writing and reading inputFile
+prepare_in_process = False
+persist_prepared = False # with prepare_in_process, still write the prepared event table to inputFile (CSV or Parquet) and its manifest
+
+# build the log links, entity nodes, CORR relationships, entity relationships and derived entities with one COPY each
+# from tables computed from the Event table (relationships from the distinct foreign key pairs with pandas joins),
+# set to False to build them with the original Cypher queries (e.g., to verify the bulk construction)
+use_bulk_import = True
+
+# primary keys of the entity nodes: 'integer' gives each entity a dense INT64 key (uID and ID remain properties), so that CORR,
+# REL and DERIVED relationships and the DF inference work on integers, 'string' keeps uID as primary key (see
+# bulk_import.getEntityTableDDL); the Cypher queries of use_bulk_import = False create entities by uID, which then stays primary key
+entity_keys = 'integer'
+
+# infer the types of the columns of a CSV event table (INT64, DOUBLE, BOOLEAN, DATE, TIMESTAMP) from a sample of their values,
+# 'Unknown' is a missing value of typed columns; column_types sets the type of columns by name (e.g., {'CreditScore': 'DOUBLE'}),
+# the identifiers of entities and the foreign keys of relations stay STRING; set to False to import all CSV columns as STRING
+infer_types = True
+column_types = {}
+
+# vertical partitioning of the Event node table: keep only the attributes the queries match and order events by in the (hot)
+# Event node table (event_schema.hot_columns, the identifiers of entities and the properties the entities and relations are
+# built from) and store the other (cold) attributes by idx in the node table EventAttributes ('table') or in a Parquet file next
+# to the database ('parquet'), see event_schema.loadEventAttributes; None keeps all attributes in the Event node table
+event_partitioning = None
+
+# give each event an integer class code per classifier (Activity, Activity+Lifecycle, Resource) when importing it, stored with
+# the dictionary node table ClassCode (see event_schema.addClassCodes): the :Class nodes and :OBSERVED relationships are then
+# built from the codes, and queries can filter events by code, e.g., MATCH (e:Event {ActivityLifecycleClass: 3})
+class_codes = True
 
 # specification of the data transformation
 log_name = "BPIC17"
@@ -37,17 +73,10 @@ model_entities_derived = ['Case_AO',
 
 
 # Create an empty on-disk database and connect to it
-db = kuzu.Database("./db_bpic17_ekg_basic")
+database = "./db_bpic17_ekg_basic" if event_partitioning is None else "./db_bpic17_ekg_basic_partitioned"
+db = kuzu.Database(database)
 conn = kuzu.Connection(db)
 
-# load log header (attribute names) from import file
-def getLogHeader(fileName):
-    with open(fileName) as f:
-        reader = csv.reader(f)
-        logHeader = list(next(reader))
-        f.close()
-    return logHeader
-
 def runQuery(query: str) -> kuzu.QueryResult:
 
     start = datetime.datetime.now()
@@ -117,34 +146,67 @@ runQuery("DROP TABLE IF EXISTS DF")
 runQuery("DROP TABLE IF EXISTS REL")
 runQuery("DROP TABLE IF EXISTS HAS")
 runQuery("DROP TABLE IF EXISTS Event")
+runQuery(f"DROP TABLE IF EXISTS {event_schema.cold_table}")
+runQuery(f"DROP TABLE IF EXISTS {event_schema.class_table}")
+if os.path.exists(event_schema.getColdFile(database)):
+    os.remove(event_schema.getColdFile(database))
 runQuery("DROP TABLE IF EXISTS Entity")
 runQuery("DROP TABLE IF EXISTS Class")
 runQuery("DROP TABLE IF EXISTS Log")
 
-startBuildEKG = datetime.datetime.now()
+startPrepare = datetime.datetime.now()
+if prepare_in_process:
+    print("Preparing Events")
+    events = bpic17_prepare.PrepareBPI17Events(bpic17_prepare.inputpath, bpic17_prepare.sample, inputFile if persist_prepared else None)
+else:
+    # check that the prepared event table is the one recorded by bpic17_prepare.py, an unchanged
+    # prepare configuration then does not require running bpic17_prepare.py again before a rebuild
+    manifestFile = os.path.splitext(inputFile)[0]+'.manifest.json'
+    if not prepare_utils.checkManifest(manifestFile, [inputFile]):
+        print(f"Warning: {inputFile} does not match {manifestFile}, run bpic17_prepare.py to prepare it again")
+endPrepare = datetime.datetime.now()
 
-# build basic data definition string for importing event table
-header = getLogHeader(inputCSV)
-ddlString = ""
-for col in header:
-    if col in ['timestamp','start','end']:
-        ddlEntry = f'{col} TIMESTAMP, '
-    elif col in ['idx']:
-        ddlEntry = f'{col} INT32, '
-    else:
-        ddlEntry = f'{col} STRING, '
+startBuildEKG = datetime.datetime.now()
 
-    ddlString = ddlString + ddlEntry
-ddlString = ddlString + "PRIMARY KEY(idx)"
+# build data definition string for importing event table (from the arrow schema, the CSV header or the Parquet schema)
+infer_csv_types = infer_types and not prepare_in_process and not inputFile.endswith('.parquet')
+load_event_table = infer_csv_types or ((event_partitioning is not None or class_codes) and not prepare_in_process)
+if load_event_table:
+    # the event table with the types of its columns as arrow table, including the Log property
+    key_columns = {entity[1]: 'STRING' for entity in model_entities}
+    key_columns.update({relation[3]: 'STRING' for relation in model_relations})
+    events = event_schema.getEventTable([inputFile], [log_name], inferTypes=infer_csv_types,
+                                        types={**key_columns, **column_types} if infer_csv_types else {})
+if class_codes:
+    events, classCodes = event_schema.addClassCodes(events)
+if event_partitioning is not None:
+    # the cold attributes go to their own table or file, the Event node table gets the hot attributes only
+    events, coldEvents = event_schema.splitEventTable(events, event_schema.getHotColumns(model_entities, model_relations))
+    print("Storing cold event attributes "+str(coldEvents.column_names[1:]))
+    event_schema.storeColdEvents(conn, coldEvents, event_partitioning, event_schema.getColdFile(database))
+    coldEvents = None
+if prepare_in_process or load_event_table:
+    ddlString = event_schema.getEventDDLFromSchema(events.schema)
+else:
+    ddlString = event_schema.getEventDDL(inputFile)
 
 runQuery("CREATE NODE TABLE Event ("+ddlString+")")
 
 # importing events
 print("Importing Events")
-runQuery("COPY Event FROM '"+inputCSV+"' (header=true, quote='\"');")
+if prepare_in_process or load_event_table:
+    runQuery("COPY Event FROM events") # kuzu scans the arrow table of the variable 'events'
+    events = None # release the prepared table
+else:
+    runQuery(event_schema.getEventCopy(inputFile))
 
 # extend events with "Log" property, set to log_name
-runQuery("ALTER TABLE Event ADD Log STRING DEFAULT '"+log_name+"'")
+if not load_event_table:
+    runQuery("ALTER TABLE Event ADD Log STRING DEFAULT '"+log_name+"'")
+
+# dictionary of the class codes of the events
+if class_codes:
+    event_schema.storeClassCodes(conn, classCodes)
 
 response = runQuery("MATCH (e:Event) RETURN count(e)")
 while response.has_next():
@@ -153,17 +215,23 @@ while response.has_next():
 # link to log node
 runQuery("CREATE NODE TABLE Log (ID STRING, PRIMARY KEY(ID))")
 runQuery("CREATE REL TABLE HAS (FROM Log TO Event)")
-add_log(log_name)
+if use_bulk_import:
+    bulk_import.linkEventsToLog(conn, log_name)
+else:
+    add_log(log_name)
 
 # infer entity nodes (basic)
 print("Inferring Entities")
-runQuery("CREATE NODE TABLE Entity (ID STRING, EntityType STRING, uID STRING, PRIMARY KEY(uID))")
+runQuery("CREATE NODE TABLE Entity "+bulk_import.getEntityTableDDL(use_bulk_import and entity_keys == 'integer'))
 runQuery("CREATE REL TABLE CORR (FROM Event TO Entity)")
 
 for entity in model_entities: #per entity
     if entity[0] in include_entities:
-        create_entity(entity[0], entity[1], entity[2])
-        correlate_events_to_entity(entity[0], entity[1], entity[2])
+        if use_bulk_import:
+            bulk_import.createEntitiesAndCorrelate(conn, entity[0], entity[1], entity[2])
+        else:
+            create_entity(entity[0], entity[1], entity[2])
+            correlate_events_to_entity(entity[0], entity[1], entity[2])
         print(f'{entity[0]} entity nodes done')
 
 response = conn.execute("MATCH (e:Entity) RETURN count(e)")
@@ -175,16 +243,25 @@ print("Inferring Relations")
 runQuery("CREATE REL TABLE REL (FROM Entity TO Entity, Type STRING)")
 
 for relation in model_relations: #per relation
-    create_entity_relationships(relation[0], relation[1], relation[2], relation[3])
+    if use_bulk_import:
+        bulk_import.createEntityRelationships(conn, relation[0], relation[1], relation[2], relation[3])
+    else:
+        create_entity_relationships(relation[0], relation[1], relation[2], relation[3])
     print(f'{relation[0]} relationships created')
 
 # reify selected relations into entities
 for relation in model_relations: #per relation
     derived_entity = relation[0]
     if derived_entity in model_entities_derived and derived_entity in include_entities:
-        reify_entity_relations(derived_entity)
+        if use_bulk_import:
+            bulk_import.reifyEntityRelations(conn, derived_entity, relation[1], relation[2])
+        else:
+            reify_entity_relations(derived_entity)
         print(f'{derived_entity} relationships reified')
-        correlate_events_to_derived_entity(derived_entity)
+        if use_bulk_import:
+            bulk_import.correlateEventsToDerivedEntity(conn, derived_entity)
+        else:
+            correlate_events_to_derived_entity(derived_entity)
         print(f'{derived_entity} CORR relationships created')
 
 endBuildEKG = datetime.datetime.now()
@@ -201,19 +278,28 @@ startBuildDFG = datetime.datetime.now()
 
 queries_build_dfg.prepareDFGtables(conn)
 
+classifier = "Activity+Lifecycle"
+
 print("Aggregate Activities")
-queries_build_dfg.createEventClass_ActivityANDLifeCycle(conn)
+if class_codes:
+    queries_build_dfg.createEventClassFromCodes(conn, classifier)
+else:
+    queries_build_dfg.createEventClass_ActivityANDLifeCycle(conn)
 
 print("Aggregate DF edges")
-classifier = "Activity+Lifecycle"
 for entity in include_entities:
-    queries_build_dfg.aggregateDFrelations(conn, entity, classifier)
+    if class_codes:
+        queries_build_dfg.aggregateDFrelationsFromCodes(conn, entity, classifier)
+    else:
+        queries_build_dfg.aggregateDFrelations(conn, entity, classifier)
     #queries_build_dfg.aggregateDFrelationsFiltering(conn, entity, classifier, 500, 3)
 
 endBuildDFG = datetime.datetime.now()
 
 conn.close()
 
+if prepare_in_process:
+    print("Prepare Events: "+str(endPrepare-startPrepare))
 print("Build EKG: "+str(endBuildEKG-startBuildEKG))
 print("Infer DF: "+str(endInferDF-startInferDF))
 print("Build DFG: "+str(endBuildDFG-startBuildDFG))
@@ -1,14 +1,32 @@
 #loan application
 
 import pandas as pd
-import time, os, csv
+import time, os, csv, filecmp
+import prepare_utils
 
 #config
 
 sample = True
+use_cache = True # skip the preparation if input data, scripts and configuration did not change since the last run, see manifest file in the output directory
+output_format = 'csv' # 'csv' or 'parquet' (typed columns, requires pyarrow)
+compare_rowwise = False # also run the original row-wise preparation, compare timings and check that both outputs are identical
 inputpath = '.\\BPIC17\\'
 path_to_import_directory = '.\\prepared\\'
 
+# column types of the raw log, see prepare_utils.readLog
+# activity, lifecycle, resource and case/offer identifiers repeat over many events and are loaded as categories
+log_schema = {'Action': 'category',
+              'org:resource': 'category',
+              'event': 'category',
+              'EventOrigin': 'category',
+              'EventID': 'str',
+              'lifecycle:transition': 'category',
+              'time': ['datetime', '%Y/%m/%d %H:%M:%S.%f'],
+              'case': 'category',
+              'OfferID': 'category',
+              'LoanGoal': 'category',
+              'ApplicationType': 'category'}
+
 def LoadLog(localFile):
     datasetList = []
     headerCSV = []
@@ -26,12 +44,14 @@ def LoadLog(localFile):
     
     return headerCSV, log
 
-def CreateBPI17(inputpath, path_to_import_directory, fileName, sample):
-    csvLog = pd.read_csv(os.path.realpath(inputpath+'BPI_Challenge_2017.csv'), keep_default_na=True) #load full log from csv                  
-    csvLog.drop_duplicates(keep='first', inplace=True) #remove duplicates from the dataset
+def LoadBPI17(inputpath):
+    csvLog = prepare_utils.readLog(os.path.realpath(inputpath+'BPI_Challenge_2017.csv'), log_schema, keep_default_na=True) #load full log from csv
+    prepare_utils.printMemoryUsage('BPIC17', csvLog)
+    csvLog = prepare_utils.dropDuplicates(csvLog) #remove duplicates from the dataset
     csvLog = csvLog.reset_index(drop=True) #renew the index to close gaps of removed duplicates 
-    
-    
+    return csvLog
+
+def GetSampleIds(sample):
     if (sample == True): 
         sampleIds = ['Application_2045572635', 
              'Application_2014483796', 
@@ -55,7 +75,9 @@ def CreateBPI17(inputpath, path_to_import_directory, fileName, sample):
              'Application_1631297810']
     else:
         sampleIds = [] #csvLog.case.unique().tolist() # create a list of all cases in the dataset
-    
+    return sampleIds
+
+def RenameBPI17(csvLog):
     # rename CSV columns to standard value
     # case to ApplicationId (as case is a reserved keyword in kuzuDB)
     # Activity
@@ -64,6 +86,74 @@ def CreateBPI17(inputpath, path_to_import_directory, fileName, sample):
     # lifecycle for life-cycle transtiion
     csvLog = csvLog.rename(columns={'event': 'Activity','case':'ApplicationId','time':'timestamp','org:resource':'resource','lifecycle:transition':'lifecycle'})
     csvLog['EventIDraw'] = csvLog['EventID']
+    return csvLog
+
+def PrepareBPI17(inputpath, sample):
+    # columnar preparation: all steps operate on entire columns instead of iterating over rows
+    # returns the prepared event table, timestamps are kept as datetimes
+    csvLog = RenameBPI17(LoadBPI17(inputpath))
+    sampleIds = GetSampleIds(sample)
+
+    # fix missing entity identifier: "O_Create Offer" belongs to an offer but has no offer ID,
+    # it is always directly followed by "O_Created" [verified with Disco] which carries the offer ID
+    # shift the columns up by one row so that row i holds the values of its successor row i+1
+    nextActivity = csvLog['Activity'].shift(-1)
+    nextOfferID = csvLog['OfferID'].shift(-1)
+    createOffer = (csvLog['Activity'] == "O_Create Offer") & (nextActivity == 'O_Created')
+    csvLog.loc[createOffer, 'OfferID'] = nextOfferID[createOffer] #assign the offerID of the next event (O_Created) to this activity
+
+    # keep all records of the sample cases (or the entire dataset), renew the index as the row-wise rebuild did
+    if sampleIds != []:
+        csvLog = csvLog[csvLog['ApplicationId'].isin(sampleIds)]
+    logSamples = csvLog.reset_index(drop=True)
+    del csvLog # release the loaded log, otherwise sorting in place copies the columns shared with it
+
+    # timestamps are parsed while loading, categories of ApplicationId are sorted like the identifiers themselves
+    logSamples.sort_values(['ApplicationId','timestamp'], inplace=True)
+    return logSamples
+
+def WriteBPI17(logSamples, path_to_import_directory, fileName, output_format='csv'):
+    # write the prepared event table as CSV (timestamps rendered in place) or as typed Parquet file
+    if output_format == 'parquet':
+        prepare_utils.writeParquet(logSamples, path_to_import_directory+fileName, ['timestamp'])
+        return
+
+    logSamples['timestamp'] = prepare_utils.renderTimestamps(logSamples['timestamp'])
+    
+    logSamples.to_csv(path_to_import_directory+fileName, index=True, index_label="idx",na_rep="Unknown")
+
+def CreateBPI17(inputpath, path_to_import_directory, fileName, sample, output_format='csv'):
+    WriteBPI17(PrepareBPI17(inputpath, sample), path_to_import_directory, fileName, output_format)
+
+def GetCacheInputs(inputpath, sample, output_format):
+    # input files and configuration that identify a prepared event table in its manifest
+    inputFiles = [inputpath+'BPI_Challenge_2017.csv', __file__, prepare_utils.__file__]
+    return inputFiles, {'sample': sample, 'output_format': output_format}
+
+def PrepareBPI17Events(inputpath, sample, persistFile=None):
+    # in-process handoff to the import scripts: the prepared event table as typed arrow table,
+    # which kuzu loads with COPY Event FROM ... without writing and reading a file
+    # with persistFile (path of a .csv or .parquet file), the prepared table is also written to it and recorded in its manifest
+    logSamples = PrepareBPI17(inputpath, sample)
+    events = prepare_utils.toArrowTable(logSamples, ['timestamp'])
+    if persistFile is not None:
+        path_to_import_directory, fileName = os.path.split(persistFile)
+        path_to_import_directory = os.path.join(path_to_import_directory, '')
+        output_format = os.path.splitext(fileName)[1][1:]
+        inputFiles, config = GetCacheInputs(inputpath, sample, output_format)
+        prepare_utils.cachedPrepare(os.path.splitext(persistFile)[0]+'.manifest.json', inputFiles, config, [persistFile],
+                                    WriteBPI17, logSamples, path_to_import_directory, fileName, output_format)
+    return events
+
+def CreateBPI17_rowwise(inputpath, path_to_import_directory, fileName, sample):
+    # original row-by-row preparation, kept for validating and benchmarking CreateBPI17
+    # loads the log as before the dtype schemas (without prepare_utils.readLog and dropDuplicates), so that the comparison
+    # also checks the loading
+    csvLog = pd.read_csv(os.path.realpath(inputpath+'BPI_Challenge_2017.csv'), keep_default_na=True) #load full log from csv
+    csvLog.drop_duplicates(keep='first', inplace=True) #remove duplicates from the dataset
+    csvLog = csvLog.reset_index(drop=True) #renew the index to close gaps of removed duplicates
+    csvLog = RenameBPI17(csvLog)
+    sampleIds = GetSampleIds(sample)
 
     sampleList = [] #create a list (of lists) for the sample data containing a list of events for each of the selected cases
     # fix missing entity identifier for one record: check all records in the list of sample cases (or the entire dataset)
@@ -87,13 +177,31 @@ def CreateBPI17(inputpath, path_to_import_directory, fileName, sample):
     logSamples.to_csv(path_to_import_directory+fileName, index=True, index_label="idx",na_rep="Unknown")
 
 
-if(sample):
-    fileName = 'BPIC17sample.csv' 
-else:
-    fileName = 'BPIC17full.csv'
+if __name__ == '__main__': # the import scripts import this module to prepare the event table in-process
+    if(sample):
+        fileName = 'BPIC17sample.'+output_format
+    else:
+        fileName = 'BPIC17full.'+output_format
+    manifestFileName = fileName[0:fileName.rindex('.')]+'.manifest.json' # the import scripts check the prepared file against this manifest
     
 
-start = time.time()
-CreateBPI17(inputpath, path_to_import_directory, fileName, sample)
-end = time.time()
-print("Prepared data for import in: "+str((end - start))+" seconds.") 
+    start = time.time()
+    if use_cache and not compare_rowwise: # the comparison measures the actual preparation
+        inputFiles, config = GetCacheInputs(inputpath, sample, output_format)
+        prepare_utils.cachedPrepare(path_to_import_directory+manifestFileName, inputFiles, config, [path_to_import_directory+fileName],
+                                    CreateBPI17, inputpath, path_to_import_directory, fileName, sample, output_format)
+    else:
+        CreateBPI17(inputpath, path_to_import_directory, fileName, sample, output_format)
+    end = time.time()
+    print("Prepared data for import in: "+str((end - start))+" seconds.") 
+    prepare_utils.printReport('BPIC17', start)
+
+    if(compare_rowwise and output_format == 'csv'):
+        fileNameRowwise = fileName[0:-4]+'_rowwise.csv'
+        startRowwise = time.time()
+        CreateBPI17_rowwise(inputpath, path_to_import_directory, fileNameRowwise, sample)
+        endRowwise = time.time()
+        print("Prepared data (row-wise) in: "+str((endRowwise - startRowwise))+" seconds.")
+        print("Speedup of columnar preparation: "+str((endRowwise - startRowwise)/(end - start)))
+        identical = filecmp.cmp(path_to_import_directory+fileName, path_to_import_directory+fileNameRowwise, shallow=False)
+        print("Outputs identical: "+str(identical))
@@ -1,5 +1,12 @@
 import kuzu
-import datetime
+import datetime, os
+
+# the graph built with all event attributes in the Event node table and the graph built with event_partitioning
+# (bpic17_import_csv_to_kuzu_db_typed.py), the queries run against each graph that exists and the speedup is reported
+databases = ["./db_bpic17_ekg_typed", "./db_bpic17_ekg_typed_partitioned"]
+
+# average query times (ms) of the queries run against the current database, in the order of the queries
+timings = []
 
 def runQuery(conn: kuzu.Connection, query: str) -> kuzu.QueryResult:
 
@@ -22,13 +29,15 @@ def runQuery(conn: kuzu.Connection, query: str) -> kuzu.QueryResult:
     # convert to ms
     avg_ms = avg / datetime.timedelta(milliseconds=1)
     print(str(avg_ms)+" ms")
+    timings.append((" ".join(query.split()), avg_ms))
 
     return response
 
 
-def main() -> None:
-    # Create an empty on-disk database and connect to it
-    db = kuzu.Database("./db_bpic17_ekg_typed")
+def main(database) -> list:
+    # Connect to the database, returns the average times of the queries
+    timings.clear()
+    db = kuzu.Database(database)
     conn = kuzu.Connection(db)
 
     print("Running Q1")
@@ -314,4 +323,23 @@ def main() -> None:
     while response.has_next():
         print(response.get_next())
 
-main()
\ No newline at end of file
+    conn.close()
+    db.close()
+    return list(timings)
+
+def reportSpeedup(wideTimings, partitionedTimings):
+    # speedup of each query on the graph with the partitioned Event node table
+    print("Speedup of the partitioned Event node table (average ms wide / partitioned)")
+    for (query, wide_ms), (_, partitioned_ms) in zip(wideTimings, partitionedTimings):
+        print(f"{wide_ms:10.3f} ms {partitioned_ms:10.3f} ms {wide_ms/partitioned_ms:6.2f}x  {query[:100]}")
+    wide_total = sum(ms for query, ms in wideTimings)
+    partitioned_total = sum(ms for query, ms in partitionedTimings)
+    print(f"{wide_total:10.3f} ms {partitioned_total:10.3f} ms {wide_total/partitioned_total:6.2f}x  all queries")
+
+results = {}
+for database in databases:
+    if os.path.exists(database):
+        print("Running queries against "+database)
+        results[database] = main(database)
+if len(results) == 2:
+    reportSpeedup(results[databases[0]], results[databases[1]])
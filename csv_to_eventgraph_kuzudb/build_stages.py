@@ -0,0 +1,50 @@
+import kuzu
+import json
+from stage_scheduler import executeWrite
+
+# state of the stages of ekg_builder.build, persisted in the node table BuildStage of the database: for each stage whether
+# it completed, the hash of its inputs (its configuration and the input hashes of the stages it depends on), the number of
+# loaded nodes/relationships and its duration
+# a stage is recorded as incomplete when it starts and as complete when it finished, so that a build that failed or was
+# interrupted resumes with the stages that did not complete (and the stages depending on them)
+
+stage_table = "BuildStage"
+
+def getTables(conn: kuzu.Connection):
+    return conn.execute("CALL show_tables() RETURN name").get_as_df()['name'].to_list()
+
+def createStageTable(conn: kuzu.Connection):
+    executeWrite(conn, f"CREATE NODE TABLE IF NOT EXISTS {stage_table} (ID STRING, Complete BOOLEAN, InputHash STRING, Rows STRING, Seconds DOUBLE, PRIMARY KEY(ID))")
+
+def getStageRecords(conn: kuzu.Connection):
+    # recorded stages by their ID: dicts with Complete, InputHash, Rows (dict) and Seconds, no stages if the table does not exist
+    if stage_table not in getTables(conn):
+        return {}
+    records = conn.execute(f'''
+        MATCH (s:{stage_table}) RETURN s.ID AS ID, s.Complete AS Complete, s.InputHash AS InputHash, s.Rows AS Rows, s.Seconds AS Seconds
+        ''').get_as_df()
+    return {record['ID']: {**record, 'Rows': json.loads(record['Rows']) if isinstance(record['Rows'], str) else {}}
+            for record in records.to_dict('records')}
+
+def startStage(conn: kuzu.Connection, stageID, inputHash):
+    executeWrite(conn, f'''
+        MERGE (s:{stage_table} {{ID: $ID}})
+        SET s.Complete = false, s.InputHash = $InputHash, s.Rows = NULL, s.Seconds = NULL''', {"ID": stageID, "InputHash": inputHash})
+
+def completeStage(conn: kuzu.Connection, stageID, rows, seconds):
+    executeWrite(conn, f'''
+        MATCH (s:{stage_table} {{ID: $ID}})
+        SET s.Complete = true, s.Rows = $Rows, s.Seconds = $Seconds''', {"ID": stageID, "Rows": json.dumps(rows), "Seconds": seconds})
+
+def setStageHash(conn: kuzu.Connection, stageID, inputHash):
+    executeWrite(conn, f"MATCH (s:{stage_table} {{ID: $ID}}) SET s.InputHash = $InputHash", {"ID": stageID, "InputHash": inputHash})
+
+def deleteStage(conn: kuzu.Connection, stageID):
+    executeWrite(conn, f"MATCH (s:{stage_table} {{ID: $ID}}) DELETE s", {"ID": stageID})
+
+def invalidateStages(conn: kuzu.Connection, stageIDs):
+    # mark the recorded stages as incomplete, returns the IDs of the invalidated stages
+    if stage_table not in getTables(conn):
+        return []
+    result = executeWrite(conn, f"MATCH (s:{stage_table}) WHERE s.ID IN $IDs SET s.Complete = false RETURN s.ID", {"IDs": list(stageIDs)})
+    return result.get_as_df()['s.ID'].to_list()
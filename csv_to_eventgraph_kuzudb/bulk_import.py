@@ -0,0 +1,248 @@
+import kuzu
+import datetime, threading
+import numpy as np
+import pandas as pd
+from stage_scheduler import executeWrite
+
+# bulk construction of the event knowledge graph: instead of MERGE/CREATE queries that match events against
+# nodes row by row, the nodes and relationships are computed as columnar tables from the Event table
+# and loaded with a single COPY per table
+# works for the basic schema (all entities in node table Entity) and the typed schema (one node table per entity type,
+# CORR as relationship group from Event to each entity type)
+# each function returns the number of nodes/relationships it loaded
+# with min_idx (resp. only_new), the functions append to an existing graph: they only consider the events with idx >= min_idx
+# (the appended events) and only create the nodes and relationships that are not in the graph yet, see ekg_builder.append
+#
+# entity node tables have integer keys (getEntityTableDDL): each entity gets a dense INT64 key as primary key when it is
+# created, its identifier (ID) and type-qualified identifier (uID, e.g., "Application"+ID) remain properties and map
+# identifiers to keys (getEntities), so that CORR, REL and DERIVED relationships and the sorting of the DF inference use
+# integers instead of long strings; node tables with uID as primary key (as created by the Cypher queries) are supported as well
+
+# serializes the allocation of keys and the COPY of the new entities: the entity types of the basic schema share the node
+# table Entity, and ekg_builder creates entities of several entity types concurrently
+entity_key_lock = threading.Lock()
+
+def runQuery(conn: kuzu.Connection, query: str, write=False) -> kuzu.QueryResult:
+
+    start = datetime.datetime.now()
+    # print()
+    # print(query)
+    response = executeWrite(conn, query) if write else conn.execute(query)
+    end = datetime.datetime.now()
+    print(str(end-start))
+
+    return response
+
+def getEntityTableDDL(integer_keys=True):
+    # columns of an entity node table, with integer key or uID as primary key
+    if integer_keys:
+        return "(ID STRING, EntityType STRING, uID STRING, key INT64, PRIMARY KEY(key))"
+    return "(ID STRING, EntityType STRING, uID STRING, PRIMARY KEY(uID))"
+
+def getEntityKey(conn: kuzu.Connection, node_table):
+    # name of the primary key property of an entity node table: 'key' (integer keys) or 'uID'
+    properties = conn.execute(f"CALL table_info('{node_table}') RETURN name, `primary key` AS pk").get_as_df()
+    return properties.loc[properties["pk"], "name"].iloc[0]
+
+def addEntityKeys(conn: kuzu.Connection, entities, node_table):
+    # entities (columns ID, EntityType, uID) in the columns of the node table: with integer keys, the entities get the
+    # keys following the largest key of the node table
+    if getEntityKey(conn, node_table) == "uID":
+        return entities
+    maxKey = conn.execute(f"MATCH (n:{node_table}) RETURN max(n.key)").get_next()[0]
+    entities = entities.copy()
+    entities["key"] = np.arange(len(entities), dtype="int64") + (0 if maxKey is None else maxKey + 1)
+    return entities
+
+def getCopyOptions(from_table, to_table, typed):
+    # a relationship group (typed schema) needs the pair of node tables the copied relationships belong to
+    if typed:
+        return f" (from='{from_table}', to='{to_table}')"
+    return ""
+
+def getEventCondition(WHERE_event_property, min_idx):
+    # WHERE clause selecting the events of WHERE_event_property, restricted to idx >= min_idx
+    if min_idx is None:
+        return WHERE_event_property
+    if WHERE_event_property.strip() == "":
+        return f"WHERE e.idx >= {min_idx}"
+    return f"WHERE ({WHERE_event_property.strip()[len('WHERE'):]}) AND e.idx >= {min_idx}"
+
+def linkEventsToLog(conn: kuzu.Connection, log_id, min_idx=None):
+    # :HAS relationships from the Log node to all events of the log, same as
+    #   MATCH (e:Event {Log: log_id}) MATCH (l:Log {ID: log_id}) CREATE (l)-[:HAS]->(e)
+    start = datetime.datetime.now()
+
+    runQuery(conn, f'{"CREATE" if min_idx is None else "MERGE"} (:Log {{ID: "{log_id}" }})', write=True)
+    has = runQuery(conn, f'MATCH (e:Event {{Log: "{log_id}" }}) {getEventCondition("", min_idx)} RETURN e.idx AS idx').get_as_df()
+    has.insert(0, "log", log_id)
+
+    executeWrite(conn, "COPY HAS FROM has")
+    end = datetime.datetime.now()
+    print(f'{len(has)} HAS relationships in {end-start}')
+    return len(has)
+
+def createEntitiesAndCorrelate(conn: kuzu.Connection, entity_type, entity_id, WHERE_event_property, node_table="Entity", typed=False, min_idx=None):
+    # entity nodes for the distinct values of property entity_id of the events selected by WHERE_event_property
+    # and :CORR relationships from these events to their entity, same as
+    #   MATCH (e:Event) WHERE ... WITH e.<entity_id> AS id MERGE (en:<node_table> {ID:id, uID:(entity_type+id), EntityType:entity_type})
+    #   MATCH (e:Event) WHERE ... MATCH (n:<node_table> {EntityType: entity_type}) WHERE e.<entity_id> = n.ID CREATE (e)-[:CORR]->(n)
+    start = datetime.datetime.now()
+
+    qEventEntities = f'''
+        MATCH (e:Event) {getEventCondition(WHERE_event_property, min_idx)}
+        RETURN e.idx AS idx, e.{entity_id} AS ID
+        '''
+    corr = runQuery(conn, qEventEntities).get_as_df()
+    corr = corr[corr["ID"].notna()] # events without identifier are not correlated (uID would be null)
+    corr["ID"] = corr["ID"].astype(str)
+    corr["uID"] = entity_type + corr["ID"]
+
+    # one node per distinct identifier, columns in the order of the node table: ID, EntityType, uID (, key)
+    entities = corr[["ID","uID"]].drop_duplicates("uID")
+    existing = getEntities(conn, entity_type, typed) if min_idx is not None else None
+    if min_idx is not None: # only the entities the graph does not have yet
+        entities = entities[~entities["uID"].isin(existing["uID"])]
+    entities.insert(1, "EntityType", entity_type)
+    with entity_key_lock:
+        entities = addEntityKeys(conn, entities, node_table)
+        executeWrite(conn, f"COPY {node_table} FROM entities")
+
+    # one CORR relationship per selected event: primary keys of the event and of the entity node
+    if "key" in entities.columns:
+        keys = entities[["uID","key"]] if existing is None else pd.concat([existing[["uID","key"]], entities[["uID","key"]]])
+        corr = corr[["idx","uID"]].merge(keys, on="uID")[["idx","key"]]
+    else:
+        corr = corr[["idx","uID"]]
+    executeWrite(conn, f"COPY CORR FROM corr{getCopyOptions('Event', node_table, typed)}")
+
+    end = datetime.datetime.now()
+    print(f'{len(entities)} {entity_type} nodes, {len(corr)} CORR relationships in {end-start}')
+    return len(entities), len(corr)
+
+def antiJoin(left, right, columns):
+    # rows of left whose values in columns do not occur in right
+    merged = left.merge(right[columns].drop_duplicates(), on=columns, how="left", indicator=True)
+    return merged.loc[merged["_merge"] == "left_only", list(left.columns)]
+
+def getEntityMatch(entity_type, typed, variable="n"):
+    # pattern matching the nodes of an entity type
+    if typed:
+        return f"({variable}:{entity_type})"
+    return f'({variable}:Entity {{EntityType: "{entity_type}" }})'
+
+def getEntities(conn: kuzu.Connection, entity_type, typed=False):
+    # entities of an entity type with their uID, ID and primary key (key, or uID for node tables without integer keys)
+    key = getEntityKey(conn, entity_type if typed else "Entity")
+    return runQuery(conn, f"MATCH {getEntityMatch(entity_type, typed)} RETURN n.uID AS uID, n.ID AS ID, n.{key} AS key").get_as_df()
+
+def createEntityRelationships(conn: kuzu.Connection, relation_type, entity_type1, entity_type2, reference_from1to2, typed=False, only_new=False):
+    # :REL relationships from each entity n2 of entity_type2 to each entity n1 of entity_type1 that one of the events of n2
+    # refers to with its foreign key property reference_from1to2, same as
+    #   MATCH (e1:Event)-[:CORR]->(n1:<entity_type1>) MATCH (e2:Event)-[:CORR]->(n2:<entity_type2>)
+    #   WHERE n1 <> n2 AND e2.<reference_from1to2> = n1.ID WITH DISTINCT n1,n2 CREATE (n1)<-[:REL {Type: relation_type}]-(n2)
+    # instead of joining all events of n1 with all events of n2, the distinct (n2, foreign key) pairs are joined with the n1 nodes
+    start = datetime.datetime.now()
+
+    qForeignKeys = f'''
+        MATCH (e:Event) -[:CORR]-> {getEntityMatch(entity_type2, typed)}
+        RETURN n.uID AS uID, n.{getEntityKey(conn, entity_type2 if typed else "Entity")} AS key, e.{reference_from1to2} AS fk
+        '''
+    foreignKeys = runQuery(conn, qForeignKeys).get_as_df()
+    foreignKeys = foreignKeys[foreignKeys["fk"].notna()] # null never equals an identifier
+    foreignKeys["fk"] = foreignKeys["fk"].astype(str)
+    foreignKeys = foreignKeys.drop_duplicates()
+
+    entities1 = getEntities(conn, entity_type1, typed) # every entity node has at least one correlated event
+    rel = foreignKeys.merge(entities1, left_on="fk", right_on="ID", suffixes=("_from","_to"))
+    # n1 <> n2 by uID, integer keys of different node tables (typed schema) may be equal
+    rel = rel.loc[rel["uID_from"] != rel["uID_to"], ["key_from","key_to"]]
+    if only_new: # only the pairs the graph does not relate yet, appended events may refer to existing entities and vice versa
+        qRelations = f'''
+            MATCH {getEntityMatch(entity_type2, typed, "n2")} -[:REL {{Type:"{relation_type}"}}]-> {getEntityMatch(entity_type1, typed, "n1")}
+            RETURN n2.{getEntityKey(conn, entity_type2 if typed else "Entity")} AS key_from, n1.{getEntityKey(conn, entity_type1 if typed else "Entity")} AS key_to
+            '''
+        rel = antiJoin(rel, runQuery(conn, qRelations).get_as_df(), ["key_from","key_to"])
+    rel["Type"] = relation_type
+    executeWrite(conn, f"COPY REL FROM rel{getCopyOptions(entity_type2, entity_type1, typed)}")
+
+    end = datetime.datetime.now()
+    print(f'{len(rel)} {relation_type} relationships in {end-start}')
+    return len(rel)
+
+def reifyEntityRelations(conn: kuzu.Connection, relation_type, to_entity, from_entity, typed=False, only_new=False):
+    # one entity node of type relation_type per :REL {Type: relation_type} relationship (n1)-[:REL]->(n2), with
+    # ID n1.ID+"_"+n2.ID and uID relation_type+ID, related to n1 and n2 by
+    #   :REL {Type:"Reified"} (basic schema, node table Entity)
+    #   :DERIVED (typed schema, node table relation_type)
+    start = datetime.datetime.now()
+
+    qRelations = f'''
+        MATCH {getEntityMatch(from_entity, typed, "n1")} -[:REL {{Type:"{relation_type}"}}]-> {getEntityMatch(to_entity, typed, "n2")}
+        RETURN n1.{getEntityKey(conn, from_entity if typed else "Entity")} AS key1, n1.ID AS ID1,
+               n2.{getEntityKey(conn, to_entity if typed else "Entity")} AS key2, n2.ID AS ID2
+        '''
+    relations = runQuery(conn, qRelations).get_as_df()
+
+    # columns in the order of the node table: ID, EntityType, uID (, key)
+    entities = pd.DataFrame({"ID": relations["ID1"] + "_" + relations["ID2"]})
+    entities["EntityType"] = relation_type
+    entities["uID"] = relation_type + entities["ID"]
+    if only_new: # only the relationships that are not reified yet
+        new = ~entities["uID"].isin(getEntities(conn, relation_type, typed)["uID"])
+        entities, relations = entities[new].reset_index(drop=True), relations[new].reset_index(drop=True)
+    node_table = relation_type if typed else "Entity"
+    with entity_key_lock:
+        entities = addEntityKeys(conn, entities, node_table)
+        executeWrite(conn, f"COPY {node_table} FROM entities")
+    key = "key" if "key" in entities.columns else "uID"
+
+    if typed:
+        # one COPY per pair of node tables of the DERIVED relationship group
+        for key_col, entity_type in [["key1", from_entity], ["key2", to_entity]]:
+            derived = pd.DataFrame({"from": entities[key], "to": relations[key_col]})
+            executeWrite(conn, f"COPY DERIVED FROM derived{getCopyOptions(relation_type, entity_type, typed)}")
+    else:
+        # both :REL {Type:"Reified"} relationships of all new nodes with one COPY
+        derived = pd.DataFrame({"from": pd.concat([entities[key], entities[key]], ignore_index=True),
+                                "to": pd.concat([relations["key1"], relations["key2"]], ignore_index=True)})
+        derived["Type"] = "Reified"
+        executeWrite(conn, "COPY REL FROM derived")
+
+    end = datetime.datetime.now()
+    print(f'{len(entities)} {relation_type} nodes in {end-start}')
+    return len(entities)
+
+def correlateEventsToDerivedEntity(conn: kuzu.Connection, derived_entity_type, typed=False, min_idx=None):
+    # :CORR relationships from every event correlated to an entity to the entities derived from it, same as
+    #   MATCH (e:Event)-[:CORR]->(n)<-[:REL {Type:"Reified"}]-(r:Entity {EntityType: derived_entity_type}) CREATE (e)-[:CORR]->(r)  (basic)
+    #   MATCH (e:Event)-[:CORR]->(n)<-[:DERIVED]-(r:<derived_entity_type>) CREATE (e)-[:CORR]->(r)  (typed)
+    # computed by joining the (derived, entity) pairs with the CORR pairs of the entity types the derived entities stem from
+    start = datetime.datetime.now()
+
+    derived_key = getEntityKey(conn, derived_entity_type if typed else "Entity")
+    if typed:
+        qDerived = f"MATCH (r:{derived_entity_type}) -[:DERIVED]-> (n) RETURN r.{derived_key} AS key_derived, LABEL(n) AS EntityType, n.uID AS uID"
+    else:
+        qDerived = f'''MATCH (r:Entity {{EntityType: "{derived_entity_type}" }}) -[:REL {{Type:"Reified"}}]-> (n:Entity)
+                    RETURN r.{derived_key} AS key_derived, n.EntityType AS EntityType, n.uID AS uID'''
+    derived = runQuery(conn, qDerived).get_as_df()
+
+    corrParts = []
+    for entity_type in derived["EntityType"].unique():
+        corrParts.append(runQuery(conn, f"MATCH (e:Event) -[:CORR]-> {getEntityMatch(entity_type, typed)} RETURN e.idx AS idx, n.uID AS uID").get_as_df())
+    corr = pd.concat(corrParts) if corrParts else pd.DataFrame(columns=["idx","uID"])
+
+    # one CORR relationship per path e -> n <- r, as created by the query (joined by uID, which is unique across entity types)
+    corr = corr.merge(derived[["key_derived","uID"]], on="uID")[["idx","key_derived"]]
+    if min_idx is not None:
+        # the graph has the paths of the existing events to the existing derived entities, new are the paths
+        # of the appended events and the paths to derived entities that have no CORR relationship yet
+        qCorrelated = f"MATCH (e:Event) -[:CORR]-> {getEntityMatch(derived_entity_type, typed, 'r')} RETURN DISTINCT r.{derived_key} AS key_derived"
+        correlated = runQuery(conn, qCorrelated).get_as_df()["key_derived"]
+        corr = corr[(corr["idx"] >= min_idx) | ~corr["key_derived"].isin(correlated)]
+    executeWrite(conn, f"COPY CORR FROM corr{getCopyOptions('Event', derived_entity_type, typed)}")
+
+    end = datetime.datetime.now()
+    print(f'{len(corr)} CORR relationships to {derived_entity_type} in {end-start}')
+    return len(corr)
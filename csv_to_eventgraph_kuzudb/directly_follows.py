@@ -0,0 +1,472 @@
+import kuzu
+import datetime
+import numpy as np
+from bulk_import import runQuery, getEntityKey, getEntityMatch
+
+# inference of DF relationships independent of the schema, for infer_df_edges.py (basic schema) and infer_df_edges_typed.py
+# (typed schema), which hold the queries of their schema: the kernels computing the DF relationships of CORR rows as arrow/NumPy
+# arrays (in the calling process or in a pool of worker processes), the removal of parallel DF relationships of derived entity
+# types, the inference in batches for graphs that do not fit in memory and the benchmarks of the kernels
+# as in bulk_import.py, the functions that query the graph work for both schemas (typed: one node table per entity type)
+
+def getSchemaModule(typed):
+    # module with the queries of the schema
+    if typed:
+        import infer_df_edges_typed
+        return infer_df_edges_typed
+    import infer_df_edges
+    return infer_df_edges
+
+parallel_min_rows = 1000000 # CORR results with fewer rows are computed in the calling process
+
+def encodeDirectlyFollowsColumns(corr):
+    # entity types, entity keys, timestamps and event indices of the arrow table corr (see computeDirectlyFollows) as NumPy arrays:
+    # entity types and keys as integers, the integer keys of the node tables, or the dictionary indices of uID keys (only equality matters)
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    def codes(column):
+        column = column.combine_chunks()
+        if pa.types.is_integer(column.type):
+            return column.to_numpy(zero_copy_only=False)
+        if not pa.types.is_dictionary(column.type):
+            column = pc.dictionary_encode(column)
+        return column.indices.to_numpy(zero_copy_only=False)
+
+    return codes(corr["EntityType"]), codes(corr["key"]), corr["timestamp"].to_numpy(), corr["src"].to_numpy()
+
+def computeDirectlyFollows(corr, workers=1):
+    # DF relationships (arrow table src, tgt, ID, EntityType) of the CORR rows of the arrow table corr (columns EntityType, key, ID,
+    # src, timestamp) of any number of entity types, computed on the columns as arrow/NumPy arrays without converting them to
+    # Python lists or pandas DataFrames: the events of each entity are sorted by timestamp and idx (stable, as the previous
+    # ORDER BY n.uID, e.timestamp, e.idx), and each event is followed by the next event in this order of the same entity
+    # with workers > 1, large results are computed by a pool of processes, see computeDirectlyFollowsParallel
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if workers > 1 and len(corr) >= parallel_min_rows:
+        return computeDirectlyFollowsParallel(corr, workers)
+
+    types, keys, timestamps, src = encodeDirectlyFollowsColumns(corr)
+    # sorted here instead of ORDER BY: on large results, kuzu returns the rows of an ORDER BY only sorted in runs
+    order = np.lexsort((src, timestamps, keys, types)) # last key first: entity type, entity, timestamp, idx
+
+    # successive events in this order of the same entity are in a DF relationship
+    types = types[order]
+    keys = keys[order]
+    src = src[order]
+    same = (types[:-1] == types[1:]) & (keys[:-1] == keys[1:])
+    sources = np.flatnonzero(same)
+    return pa.table({"src": src[sources], "tgt": src[sources + 1],
+                     "ID": pc.take(corr["ID"], order[sources]), "EntityType": pc.take(corr["EntityType"], order[sources])})
+
+def computeDirectlyFollowsParallel(corr, workers):
+    # computeDirectlyFollows in a pool of worker processes: the CORR rows are partitioned by a hash of entity type and key (all
+    # events of an entity in one partition), the partitions are copied to shared memory, each worker process sorts one partition
+    # and writes the rows of the source and target events of its DF relationships to shared memory, and the partitions are
+    # merged into one arrow table for one COPY (the same DF relationships as computeDirectlyFollows, in the order of the partitions)
+    import itertools
+    import multiprocessing
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from concurrent.futures import ProcessPoolExecutor
+
+    types, keys, timestamps, src = encodeDirectlyFollowsColumns(corr)
+    if timestamps.dtype == object: # e.g., STRING timestamps, by their rank
+        timestamps = np.unique(timestamps, return_inverse=True)[1]
+    # the integer keys are dense, the remainder balances the entities of each type over the partitions
+    partitions = (keys.astype(np.int64) * 31 + types) % workers
+    rows = np.argsort(partitions, kind="stable")
+    bounds = np.searchsorted(partitions[rows], np.arange(workers + 1)).tolist()
+    blocks, arrays = shareArrays({"types": types[rows], "keys": keys[rows], "timestamp": timestamps[rows], "src": src[rows], "rows": rows,
+                                  "sources": np.empty(len(rows), np.int64), "targets": np.empty(len(rows), np.int64)})
+    try:
+        # spawned instead of forked: the calling process may hold the threads of kuzu and of the stage scheduler
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            counts = list(pool.map(computeDirectlyFollowsPartition, itertools.repeat(arrays), bounds[:-1], bounds[1:]))
+        sources, targets = (np.concatenate([sharedArray(blocks[name], arrays[name])[start:start + count] for start, count in zip(bounds, counts)])
+                            for name in ["sources", "targets"])
+    finally:
+        for block in blocks.values():
+            block.close()
+            block.unlink()
+    return pa.table({"src": src[sources], "tgt": src[targets],
+                     "ID": pc.take(corr["ID"], sources), "EntityType": pc.take(corr["EntityType"], sources)})
+
+def shareArrays(arrays):
+    # copies of the NumPy arrays in shared memory blocks, returns the blocks and the (block name, dtype, length) of each array by name
+    from multiprocessing import shared_memory
+
+    blocks, shared = {}, {}
+    for name, array in arrays.items():
+        blocks[name] = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared[name] = (blocks[name].name, array.dtype.str, len(array))
+        sharedArray(blocks[name], shared[name])[:] = array
+    return blocks, shared
+
+def sharedArray(block, array):
+    # NumPy array (block name, dtype, length) on the buffer of the shared memory block, must be released before closing the block
+    return np.ndarray((array[2],), dtype=np.dtype(array[1]), buffer=block.buf)
+
+def computeDirectlyFollowsPartition(arrays, start, end):
+    # DF relationships of the rows start to end of the shared arrays (one partition of computeDirectlyFollowsParallel) in a worker
+    # process: writes the rows of corr of their source and target events to the shared arrays sources and targets from start on,
+    # returns their number
+    from multiprocessing import shared_memory
+
+    blocks = {name: shared_memory.SharedMemory(name=array[0]) for name, array in arrays.items()}
+    try:
+        return directlyFollowsRows(*[sharedArray(blocks[name], arrays[name]) for name in ["types", "keys", "timestamp", "src", "rows", "sources", "targets"]],
+                                   start, end)
+    finally:
+        for block in blocks.values():
+            block.close()
+
+def directlyFollowsRows(types, keys, timestamps, src, rows, sources, targets, start, end):
+    # the sort and shift of computeDirectlyFollows on the rows start to end, on rows of corr instead of event indices
+    order = np.lexsort((src[start:end], timestamps[start:end], keys[start:end], types[start:end]))
+    partition_types = types[start:end][order]
+    partition_keys = keys[start:end][order]
+    partition_rows = rows[start:end][order]
+    same = np.flatnonzero((partition_types[:-1] == partition_types[1:]) & (partition_keys[:-1] == partition_keys[1:]))
+    sources[start:start + len(same)] = partition_rows[same]
+    targets[start:start + len(same)] = partition_rows[same + 1]
+    return len(same)
+
+def filterParallelDirectlyFollows(df, parallel_entity_types, original=None):
+    # DF relationships of the arrow table df (src, tgt, ID, EntityType) without those of a derived entity type that are
+    # parallel to a DF relationship (same src and tgt) of one of its original entity types, in memory instead of inserting
+    # them and deleting them afterwards (same result): parallel_entity_types are the original
+    # entity types by derived entity type, whose DF relationships are taken from df or, if given, from the arrow table
+    # original (src, tgt, EntityType, e.g., getDirectlyFollowsPairs of DF relationships already in the graph)
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    original = df if original is None else original
+    if len(df) == 0 or len(original) == 0 or not parallel_entity_types:
+        return df
+
+    src, tgt = df["src"].to_numpy(), df["tgt"].to_numpy()
+    original_src, original_tgt = original["src"].to_numpy(), original["tgt"].to_numpy()
+    # (src, tgt) pairs of event indices as one integer each to anti-join them with np.isin
+    size = int(max(src.max(), tgt.max(), original_src.max(), original_tgt.max())) + 1
+    keep = np.ones(len(df), dtype=bool)
+    for derived_entity_type, original_entity_types in parallel_entity_types.items():
+        derived = np.flatnonzero(pc.equal(df["EntityType"], derived_entity_type).to_numpy())
+        originals = pc.is_in(original["EntityType"], value_set=pa.array(original_entity_types, pa.string())).to_numpy()
+        if len(derived) == 0 or not originals.any():
+            continue
+        original_pairs = np.ravel_multi_index((original_src[originals], original_tgt[originals]), (size, size))
+        derived_pairs = np.ravel_multi_index((src[derived], tgt[derived]), (size, size))
+        keep[derived[np.isin(derived_pairs, original_pairs)]] = False
+    return df if keep.all() else df.filter(pa.array(keep))
+
+def getDirectlyFollowsPairs(conn: kuzu.Connection, entity_types, min_src=None, max_src=None):
+    # (src, tgt, EntityType) of the DF relationships of entity_types in the graph, as arrow table for filterParallelDirectlyFollows,
+    # with min_src and max_src only those whose source event idx is in this range
+    conditions = ["df.EntityType IN $entity_types"]
+    parameters = {"entity_types": list(entity_types)}
+    if min_src is not None:
+        conditions.append("e1.idx >= $min_src AND e1.idx <= $max_src")
+        parameters.update({"min_src": int(min_src), "max_src": int(max_src)})
+    qDirectlyFollows = f'''
+        MATCH ( e1 : Event ) -[df:DF]-> ( e2 : Event ) WHERE {" AND ".join(conditions)}
+        RETURN e1.idx AS src, e2.idx AS tgt, df.EntityType AS EntityType
+        '''
+    return conn.execute(qDirectlyFollows, parameters).get_as_arrow()
+
+def getDirectlyFollowsBatches(entities, batch_size):
+    # batches of the CORR rows of an entity type by the number of events of its entities (DataFrame key, events, first, last
+    # with the first and last timestamp of the events of each entity): consecutive entities (by key) with at most batch_size
+    # events together, and each entity with more events in ceil(events / batch_size) intervals of its timestamps (about
+    # batch_size events each if they are uniform, DATE/TIMESTAMP or numeric timestamps only) in temporal order
+    import math
+
+    batches, events = [], 0
+    for entity in entities.sort_values("key", ignore_index=True).itertuples():
+        if events > 0 and events + entity.events > batch_size:
+            events = 0
+        if entity.events > batch_size and isinstance(entity.first, (datetime.date, int, float, np.number)) and entity.last > entity.first:
+            intervals = math.ceil(entity.events / batch_size)
+            bounds = [entity.first + (entity.last - entity.first) * i / intervals for i in range(1, intervals)]
+            bounds = [bound.to_pydatetime() if hasattr(bound, "to_pydatetime") else bound for bound in bounds]
+            for after, before in zip([None] + bounds, bounds + [None]):
+                batches.append({"first_key": entity.key, "last_key": entity.key, "after": after, "before": before})
+            events = 0
+            continue
+        if events == 0:
+            batches.append({"first_key": entity.key, "last_key": entity.key, "after": None, "before": None})
+        batches[-1]["last_key"] = entity.key
+        events += entity.events
+    return batches
+
+def streamDirectlyFollows(conn: kuzu.Connection, entity_type, typed=False, batch_size=1000000):
+    # DF relationships of an entity type in batches (see getDirectlyFollowsBatches) instead of from the entire query result: yields
+    # the number of CORR rows of each batch and their DF relationships (arrow table src, tgt, ID, EntityType, see computeDirectlyFollows);
+    # the last event of an entity split into intervals of timestamps is carried to the first event of its next interval, events
+    # without timestamp are in the last interval (sorted last as in computeDirectlyFollows)
+    # each batch runs its own query of the CORR rows of its entities (and interval), so the number of scans of the CORR
+    # relationships grows with the number of batches; the rows are not read from one ordered result in record batches, as
+    # kuzu returns the rows of such an ORDER BY on large results only sorted in runs (see getDirectlyFollowsPandas)
+    import pyarrow as pa
+
+    key = getEntityKey(conn, entity_type if typed else "Entity")
+    qEntities = f'''
+        MATCH {getEntityMatch(entity_type, typed)} <-[:CORR]- ( e : Event )
+        RETURN n.{key} AS key, count(*) AS events, min(e.timestamp) AS first, max(e.timestamp) AS last
+        '''
+    entities = runQuery(conn, qEntities).get_as_df() # one row per entity
+    carry = None # source event idx and entity ID of the last event of the previous interval of an entity
+    for batch in getDirectlyFollowsBatches(entities, batch_size):
+        conditions = [f"n.{key} >= $first_key", f"n.{key} <= $last_key"]
+        if batch["after"] is not None:
+            conditions.append("e.timestamp >= $after" if batch["before"] is not None else "(e.timestamp >= $after OR e.timestamp IS NULL)")
+        if batch["before"] is not None:
+            conditions.append("e.timestamp < $before")
+        qEntityEvents = f'''
+            MATCH {getEntityMatch(entity_type, typed)} <-[:CORR]- ( e : Event )
+            WHERE {" AND ".join(conditions)}
+            RETURN n.EntityType AS EntityType, n.{key} AS key, n.ID AS ID, e.idx AS src, e.timestamp AS timestamp
+            '''
+        corr = conn.execute(qEntityEvents, {name: value for name, value in batch.items() if value is not None}).get_as_arrow()
+        edges = computeDirectlyFollows(corr)
+        if batch["after"] is None:
+            carry = None
+        if len(corr) > 0 and (batch["after"] is not None or batch["before"] is not None): # interval of one entity
+            order = np.lexsort((corr["src"].to_numpy(), corr["timestamp"].to_numpy()))
+            first, last = int(order[0]), int(order[-1])
+            if carry is not None:
+                edges = pa.concat_tables([pa.table({"src": [carry[0]], "tgt": [corr["src"][first].as_py()], "ID": [carry[1]],
+                                                    "EntityType": [entity_type]}, schema=edges.schema), edges])
+            carry = (corr["src"][last].as_py(), corr["ID"][last].as_py())
+        yield len(corr), edges
+
+def createDirectlyFollowsStreaming(conn: kuzu.Connection, entity_type, typed=False, parallel_entity_types=[], batch_size=1000000,
+                                   copy_rows=10000000, spill_directory=None):
+    # DF relationships of an entity type whose CORR rows do not fit in memory (see streamDirectlyFollows): the DF relationships
+    # of the batches are appended to a Parquet spill file in a temporary directory (in spill_directory), which is copied into DF
+    # and removed whenever it has copy_rows rows, returns the number of DF relationships, batches, COPY statements and the rows
+    # of the largest batch
+    # the DF relationships parallel to those of parallel_entity_types already in the graph (the original entity types of a
+    # derived entity type) are left out of each batch (filterParallelDirectlyFollows), against the DF relationships of these
+    # entity types whose source events are in the idx range of the sources of the batch
+    import os
+    import shutil
+    import tempfile
+    import pyarrow.parquet as pq
+
+    start = datetime.datetime.now()
+
+    stats = {"DF": 0, "batches": 0, "copies": 0, "max_batch_rows": 0}
+    directory = tempfile.mkdtemp(prefix="df_spill_", dir=spill_directory)
+    spill = os.path.join(directory, "DF.parquet")
+    writer, rows = None, 0
+    try:
+        for corr_rows, edges in streamDirectlyFollows(conn, entity_type, typed, batch_size):
+            stats["batches"] += 1
+            stats["max_batch_rows"] = max(stats["max_batch_rows"], corr_rows)
+            if parallel_entity_types and len(edges) > 0:
+                src = edges["src"].to_numpy()
+                edges = filterParallelDirectlyFollows(edges, {entity_type: parallel_entity_types},
+                                                      getDirectlyFollowsPairs(conn, parallel_entity_types, src.min(), src.max()))
+            if len(edges) > 0:
+                writer = writer or pq.ParquetWriter(spill, edges.schema)
+                writer.write_table(edges)
+                rows += len(edges)
+            if writer is not None and rows >= copy_rows:
+                writer.close()
+                writer = None
+                runQuery(conn, f"COPY DF FROM '{spill}'", write=True)
+                stats["DF"] += rows
+                stats["copies"] += 1
+                rows = 0
+        if writer is not None:
+            writer.close()
+            writer = None
+            runQuery(conn, f"COPY DF FROM '{spill}'", write=True)
+            stats["DF"] += rows
+            stats["copies"] += 1
+    finally:
+        if writer is not None:
+            writer.close()
+        shutil.rmtree(directory, ignore_errors=True)
+    end = datetime.datetime.now()
+    print(f'{stats} in {end-start}')
+    return stats
+
+def benchmarkDirectlyFollows(conn: kuzu.Connection, entity_types, typed=False, repeat=3):
+    # compare the DF kernel of createDirectlyFollowsFast (getDirectlyFollowsArrow) with the previous pandas kernel
+    # (getDirectlyFollowsPandas) on a built graph: best time of repeat runs per entity type (query and kernel, without COPY)
+    # and whether both compute the same DF relationships, returns the results per entity type
+    import time
+
+    schema = getSchemaModule(typed)
+    results = {}
+    for entity_type in entity_types:
+        seconds = {}
+        for kernel, function in [("pandas", schema.getDirectlyFollowsPandas), ("arrow", schema.getDirectlyFollowsArrow)]:
+            times = []
+            for i in range(repeat):
+                start = time.perf_counter()
+                edges = function(conn, entity_type)
+                times.append(time.perf_counter() - start)
+            seconds[kernel] = min(times)
+            if kernel == "pandas":
+                expected = set(zip(edges["src"], edges["tgt"], edges["ID"]))
+            else:
+                identical = expected == set(zip(edges["src"].to_pylist(), edges["tgt"].to_pylist(), edges["ID"].to_pylist()))
+        results[entity_type] = {"DF": len(expected), "pandas_seconds": round(seconds["pandas"], 3), "arrow_seconds": round(seconds["arrow"], 3),
+                                "speedup": round(seconds["pandas"] / seconds["arrow"], 2), "identical": identical}
+        print(f'{entity_type}: {results[entity_type]}')
+    return results
+
+def benchmarkSinglePass(conn: kuzu.Connection, typed=False, repeat=3):
+    # compare the single scan of all entity types (getDirectlyFollowsAllArrow) with one query per entity type
+    # (getDirectlyFollowsArrow) on a built graph: best time of repeat runs (query and kernel, without COPY), the time of the single
+    # pass is attributed to the entity types by their share of CORR relationships, the difference is the time saved per entity type
+    import time
+
+    schema = getSchemaModule(typed)
+    def best(function, *args):
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            edges = function(conn, *args)
+            times.append(time.perf_counter() - start)
+        return min(times), edges
+
+    single_seconds, single = best(schema.getDirectlyFollowsAllArrow)
+    entity_types = sorted(set(single["EntityType"].to_pylist()))
+    corr = {entity_type: conn.execute(f"MATCH (e:Event) -[:CORR]-> {getEntityMatch(entity_type, typed)} RETURN count(*)").get_next()[0]
+            for entity_type in entity_types}
+    results = {"single_pass_seconds": round(single_seconds, 3), "entity_types": {}}
+    for entity_type in entity_types:
+        seconds, edges = best(schema.getDirectlyFollowsArrow, entity_type)
+        share = single_seconds * corr[entity_type] / sum(corr.values())
+        identical = set(zip(edges["src"].to_pylist(), edges["tgt"].to_pylist())) == \
+            set((src, tgt) for src, tgt, t in zip(single["src"].to_pylist(), single["tgt"].to_pylist(), single["EntityType"].to_pylist()) if t == entity_type)
+        results["entity_types"][entity_type] = {"CORR": corr[entity_type], "per_type_seconds": round(seconds, 3),
+                                                "single_pass_share_seconds": round(share, 3), "saved_seconds": round(seconds - share, 3), "identical": identical}
+        print(f'{entity_type}: {results["entity_types"][entity_type]}')
+    results["per_type_seconds"] = round(sum(r["per_type_seconds"] for r in results["entity_types"].values()), 3)
+    results["saved_seconds"] = round(results["per_type_seconds"] - single_seconds, 3)
+    return results
+
+def compareParallelDirectlyFollows(conn: kuzu.Connection, typed=False):
+    # compare the DF relationships of filterParallelDirectlyFollows with the DF relationships in a built graph (e.g., one built
+    # with delete_parallel_df), returns the number of DF relationships per entity type
+    # in both and whether they are identical
+    schema = getSchemaModule(typed)
+    parallel = {}
+    for et_derived_pair in schema.getDerivedEntityTypes(conn):
+        parallel.setdefault(et_derived_pair[0], []).append(et_derived_pair[1])
+    filtered = filterParallelDirectlyFollows(schema.getDirectlyFollowsAllArrow(conn), parallel)
+    graph = conn.execute("MATCH (e1:Event) -[df:DF]-> (e2:Event) RETURN e1.idx AS src, e2.idx AS tgt, df.ID AS ID, df.EntityType AS EntityType").get_as_arrow()
+
+    def edges(table):
+        return sorted(zip(table["EntityType"].to_pylist(), table["src"].to_pylist(), table["tgt"].to_pylist(), table["ID"].to_pylist()))
+
+    filtered_edges, graph_edges = edges(filtered), edges(graph)
+    results = {}
+    for entity_type in sorted(set(e[0] for e in filtered_edges) | set(e[0] for e in graph_edges)):
+        results[entity_type] = {"filtered": sum(1 for e in filtered_edges if e[0] == entity_type),
+                                "graph": sum(1 for e in graph_edges if e[0] == entity_type)}
+    results["identical"] = filtered_edges == graph_edges
+    return results
+
+def compareStreamingDirectlyFollows(conn: kuzu.Connection, entity_types, typed=False, batch_size=1000000):
+    # compare the DF relationships of streamDirectlyFollows (without COPY) with getDirectlyFollowsArrow on a built graph: the
+    # number of batches, the CORR rows of the largest batch (which bounds the memory of the streaming inference) and of the
+    # entity type, and whether both compute the same DF relationships
+    import pyarrow as pa
+
+    results = {}
+    for entity_type in entity_types:
+        batches = list(streamDirectlyFollows(conn, entity_type, typed, batch_size))
+        streamed = pa.concat_tables([edges for rows, edges in batches])
+        expected = getSchemaModule(typed).getDirectlyFollowsArrow(conn, entity_type)
+        results[entity_type] = {"CORR": sum(rows for rows, edges in batches), "batches": len(batches), "max_batch_rows": max([rows for rows, edges in batches], default=0),
+                                "DF": len(expected), "identical": sorted(zip(streamed["src"].to_pylist(), streamed["tgt"].to_pylist(), streamed["ID"].to_pylist())) ==
+                                                                 sorted(zip(expected["src"].to_pylist(), expected["tgt"].to_pylist(), expected["ID"].to_pylist()))}
+        print(f'{entity_type}: {results[entity_type]}')
+    return results
+
+def syntheticCorr(scale=10, seed=0):
+    # CORR rows (arrow table EntityType, key, ID, src, timestamp as for computeDirectlyFollows) of a synthetic log of scale times
+    # the size of BPIC17: 1,202,267 events over 13 months per scale, correlated to Application (31,509 entities per scale, all
+    # events), Workflow (31,509, 64% of the events), Offer (42,995, 16%) and Resource (149, all events) with random entities
+    # (approximately the entity types of bpic17_import_csv_to_kuzu_db.py without derived entities); ID is the key of the entity
+    import pyarrow as pa
+
+    rng = np.random.default_rng(seed)
+    events = 1202267 * scale
+    timestamps = np.sort(rng.integers(0, 13 * 30 * 24 * 3600 * 10**6, events)).astype("datetime64[us]")
+    entity_types = [("Application", 31509 * scale, 1.0), ("Workflow", 31509 * scale, 0.64), ("Offer", 42995 * scale, 0.16), ("Resource", 149, 1.0)]
+    columns = {"EntityType": [], "key": [], "src": []}
+    offset = 0
+    for code, (entity_type, entities, share) in enumerate(entity_types):
+        src = np.arange(events) if share == 1.0 else np.flatnonzero(rng.random(events) < share)
+        columns["EntityType"].append(np.full(len(src), code, dtype=np.int32))
+        columns["key"].append(offset + rng.integers(0, entities, len(src)))
+        columns["src"].append(src)
+        offset += entities
+    keys = np.concatenate(columns["key"])
+    src = np.concatenate(columns["src"])
+    return pa.table({"EntityType": pa.DictionaryArray.from_arrays(np.concatenate(columns["EntityType"]), [t[0] for t in entity_types]),
+                     "key": keys, "ID": keys, "src": src, "timestamp": timestamps[src]})
+
+def benchmarkParallelDirectlyFollows(corr, workers=[1, 2, 4, 8], repeat=3):
+    # scaling of computeDirectlyFollowsParallel with the number of worker processes on the CORR rows corr (e.g., syntheticCorr):
+    # best time of repeat runs (including the start of the pool and the copies to and from shared memory) against
+    # computeDirectlyFollows in the calling process, and whether both compute the same DF relationships
+    import time
+
+    def best(function, *args):
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            edges = function(corr, *args)
+            times.append(time.perf_counter() - start)
+        return min(times), edges
+
+    def pairs(edges):
+        src, tgt = edges["src"].to_numpy(), edges["tgt"].to_numpy()
+        order = np.lexsort((tgt, src))
+        return src[order], tgt[order]
+
+    serial_seconds, serial = best(computeDirectlyFollows)
+    expected = pairs(serial)
+    results = {"CORR": len(corr), "DF": len(serial), "serial_seconds": round(serial_seconds, 3), "workers": {}}
+    for count in workers:
+        seconds, edges = best(computeDirectlyFollowsParallel, count)
+        results["workers"][count] = {"seconds": round(seconds, 3), "speedup": round(serial_seconds / seconds, 2),
+                                     "identical": all(np.array_equal(a, b) for a, b in zip(expected, pairs(edges)))}
+        print(f'{count} workers: {results["workers"][count]}')
+    return results
+
+def main(typed, database):
+    # benchmarks of the DF kernels on the graph built by bpic17_import_csv_to_kuzu_db[_typed].py, see infer_df_edges[_typed].py
+    import argparse, json
+
+    parser = argparse.ArgumentParser(description="Compare the arrow DF kernel with the previous pandas kernel on a built graph")
+    parser.add_argument("database", nargs="?", default=database)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--single-pass", action="store_true", help="compare the single scan of all entity types with one query per entity type")
+    parser.add_argument("--workers", type=int, nargs="*", help="scaling of the DF kernel with 1/2/4/8 (or the given numbers of) worker processes on a synthetic log, without database")
+    parser.add_argument("--scale", type=int, default=10, help="size of the synthetic log of --workers in multiples of BPIC17 (default: 10)")
+    parser.add_argument("--stream", type=int, metavar="BATCH_SIZE", help="compare the streaming DF inference in batches of BATCH_SIZE CORR rows with the in-memory inference")
+    parser.add_argument("--parallel", action="store_true", help="compare the in-memory removal of parallel DF relationships with the DF relationships in the graph")
+    args = parser.parse_args()
+    if args.workers is not None:
+        print(json.dumps(benchmarkParallelDirectlyFollows(syntheticCorr(args.scale), args.workers or [1, 2, 4, 8], args.repeat), indent=2))
+        return
+    conn = kuzu.Connection(kuzu.Database(args.database))
+    entity_types = getSchemaModule(typed).getEntityTypes(conn)
+    if args.stream is not None:
+        print(json.dumps(compareStreamingDirectlyFollows(conn, entity_types, typed, args.stream), indent=2))
+    elif args.parallel:
+        print(json.dumps(compareParallelDirectlyFollows(conn, typed), indent=2))
+    elif args.single_pass:
+        print(json.dumps(benchmarkSinglePass(conn, typed, args.repeat), indent=2))
+    else:
+        print(json.dumps(benchmarkDirectlyFollows(conn, entity_types, typed, args.repeat), indent=2))
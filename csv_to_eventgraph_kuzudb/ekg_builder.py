@@ -0,0 +1,658 @@
+import kuzu
+import argparse, functools, json, os, tempfile, time
+import pandas as pd
+import event_schema
+import prepare_utils
+import bulk_import
+import build_stages
+import stage_scheduler
+from stage_scheduler import executeWrite
+import incremental_update
+import directly_follows
+import infer_df_edges
+import infer_df_edges_typed
+import queries_build_dfg
+import queries_build_dfg_typed
+
+# config-driven construction of an event knowledge graph in KuzuDB from prepared event tables, for any dataset
+# described by a dataset specification (dict, or JSON file for the command line, see ./specs/):
+#    name                    name of the dataset, also the name of the log if there is only one event table
+#    files                   prepared event tables (CSV or Parquet) in input_directory; several tables are imported into
+#                            one Event node table, with one log per table named by its file name
+#    input_directory         directory of the files (default: ./prepared/)
+#    schema                  'basic' (all entities in node table Entity) or 'typed' (one node table per entity type)
+#    database                directory of the database (default: ./db_<name>_ekg_<schema>)
+#    include_entities, model_entities, model_relations, model_entities_derived
+#                            specification of entities, relations and derived entities as in the import scripts
+#    classifier              event classifier of the directly-follows graph: 'Activity+Lifecycle', 'Activity' or 'Resource' (requires class_codes)
+#    delete_parallel_df      remove DF relationships of derived entities parallel to those of their entities (default: False)
+#    build_dfg               aggregate DF relationships to :Class nodes and :DF_C relationships (default: True)
+#    infer_types             infer INT64, DOUBLE, BOOLEAN, DATE and TIMESTAMP columns of CSV event tables from a sample of their
+#                            values, 'Unknown' is a missing value (default: True), see event_schema.inferColumnTypes
+#    column_types            kuzu data types of event columns by name, overriding the inferred types (e.g., {"CreditScore": "DOUBLE"});
+#                            the identifiers of entities and the foreign keys of relations are always STRING
+#    event_partitioning      None (default) or 'table'/'parquet': store the event attributes that are not hot (see event_schema.getHotColumns)
+#                            in the node table EventAttributes or in the Parquet file <database>.EventAttributes.parquet by idx
+#    entity_keys             'integer' (default): entity nodes have a dense INT64 key as primary key, or 'string': uID as primary key
+#                            (see bulk_import.getEntityTableDDL)
+#    single_pass_df          infer the DF relationships of all entity types in one stage from one scan of the CORR relationships
+#                            (default: False, one stage per entity type that can be invalidated on its own), see infer_df_edges.createDirectlyFollowsAll
+#    class_codes             give events an integer code per classifier when importing them, build the :Class nodes and :OBSERVED
+#                            relationships and count the :DF_C relationships by these codes (default: True), see event_schema.addClassCodes
+#    df_workers              number of worker processes computing the DF relationships of large CORR results (default: 1, in the
+#                            builder process), see directly_follows.computeDirectlyFollowsParallel
+#    df_batch_size           None (default) or the number of CORR rows of the batches from which the DF relationships of each
+#                            entity type are inferred for graphs that do not fit in memory (not with single_pass_df),
+#                            see directly_follows.createDirectlyFollowsStreaming
+#
+# build(spec) constructs the graph with the bulk construction of bulk_import.py, directly_follows.py, infer_df_edges[_typed].py and
+# queries_build_dfg[_typed].py and returns a report with the duration and the number of loaded rows of each stage, e.g.
+#    python ekg_builder.py specs/bpic19.json --schema typed --report report_bpic19.json
+# the stages (events, log, entities, relations, derived entities, DF per entity type, classes, DF_C per entity type) are
+# recorded in the database (see build_stages.py): a second build resumes from the first stage that did not complete or whose
+# input changed (event tables or specification) and runs again only the stages depending on it, --rebuild builds from scratch
+# invalidate(spec, entity_types) marks entity types to be created again by the next build, e.g.
+#    python ekg_builder.py specs/bpic17.json --invalidate Offer
+# independent stages run concurrently in a pool of workers with a single writer (see stage_scheduler.py), the report lists
+# the critical path of the stages, e.g., python ekg_builder.py specs/bpic17.json --rebuild --workers 4
+#
+# append(spec, files) adds the events of further prepared event tables to the graph built by build(spec): it copies only the
+# new events, creates only the new entities, relations and derived entities, recomputes the DF relationships of the entities
+# of the new events and updates the DF_C counts by the difference, see incremental_update.py
+# verifyAppend(spec) checks on the dataset that appending gives the same graph as a full build, e.g.
+#    python ekg_builder.py specs/bpic17.json --verify-append 0.9
+
+spec_defaults = {'input_directory': './prepared/',
+                 'schema': 'basic',
+                 'model_relations': [],
+                 'model_entities_derived': [],
+                 'classifier': 'Activity',
+                 'delete_parallel_df': False,
+                 'build_dfg': True,
+                 'infer_types': True,
+                 'column_types': {},
+                 'event_partitioning': None,
+                 'entity_keys': 'integer',
+                 'class_codes': True,
+                 'single_pass_df': False,
+                 'df_workers': 1,
+                 'df_batch_size': None}
+
+def loadSpec(fileName):
+    with open(fileName) as f:
+        return json.load(f)
+
+def completeSpec(spec):
+    # specification with defaults for all optional entries
+    spec = {**spec_defaults, **spec}
+    if spec['schema'] not in ['basic', 'typed']:
+        raise ValueError(f"unknown schema {spec['schema']}, use 'basic' or 'typed'")
+    if spec['classifier'] not in event_schema.classifiers:
+        raise ValueError(f"unknown classifier {spec['classifier']}, use one of {list(event_schema.classifiers)}")
+    if spec['classifier'] == 'Resource' and not spec['class_codes']:
+        raise ValueError("the classifier 'Resource' requires class_codes")
+    if spec['entity_keys'] not in ['integer', 'string']:
+        raise ValueError(f"unknown entity keys {spec['entity_keys']}, use 'integer' or 'string'")
+    if spec['df_workers'] < 1:
+        raise ValueError(f"df_workers must be at least 1, not {spec['df_workers']}")
+    if spec['df_batch_size'] is not None and spec['single_pass_df']:
+        raise ValueError("df_batch_size infers the DF relationships per entity type, it cannot be combined with single_pass_df")
+    if 'database' not in spec:
+        spec['database'] = f"./db_{spec['name'].lower()}_ekg_{spec['schema']}"
+    if 'include_entities' not in spec:
+        spec['include_entities'] = [entity[0] for entity in spec['model_entities']]
+    return spec
+
+def getLogNames(spec):
+    if len(spec['files']) == 1:
+        return [spec['name']]
+    return [os.path.splitext(fileName)[0] for fileName in spec['files']]
+
+def getEntities(spec):
+    return [entity for entity in spec['model_entities'] if entity[0] in spec['include_entities']]
+
+def getRelations(spec):
+    # relations between two included entities
+    return [relation for relation in spec['model_relations']
+            if relation[1] in spec['include_entities'] and relation[2] in spec['include_entities']]
+
+def getDerivedRelations(spec):
+    # relations to reify into derived entities
+    return [relation for relation in getRelations(spec)
+            if relation[0] in spec['model_entities_derived'] and relation[0] in spec['include_entities']]
+
+def getCount(conn: kuzu.Connection, pattern):
+    return conn.execute(f"MATCH {pattern} RETURN count(*)").get_next()[0]
+
+def getEventProperties(conn: kuzu.Connection):
+    return conn.execute("CALL table_info('Event') RETURN name").get_as_df()['name'].to_list()
+
+def getEntityTypes(spec):
+    # entity types of the graph: the included entities and the derived entities
+    return [entity[0] for entity in getEntities(spec)] + [relation[0] for relation in getDerivedRelations(spec)]
+
+def getColumnTypes(spec):
+    # types of the event columns set by the specification: the identifiers of entities and the foreign keys of relations are
+    # STRING, as the entity nodes and the joins of the relations use them as text
+    types = {entity[1]: 'STRING' for entity in spec['model_entities']}
+    types.update({relation[3]: 'STRING' for relation in spec['model_relations']})
+    types.update(spec['column_types'])
+    return types
+
+def getDatabaseSize(database):
+    # bytes of the database on disk (a file, or a directory of files)
+    if os.path.isfile(database):
+        return os.path.getsize(database) + (os.path.getsize(database + '.wal') if os.path.exists(database + '.wal') else 0)
+    return sum(os.path.getsize(os.path.join(path, fileName)) for path, dirs, fileNames in os.walk(database) for fileName in fileNames)
+
+def addStage(report, stage, start, rows):
+    end = time.time()
+    report['stages'].append({'stage': stage, 'seconds': round(end - start, 3), 'rows': rows})
+    print(f'{stage} done: took {end - start} seconds')
+
+def clearDatabase(conn: kuzu.Connection, keep=[]):
+    # drop all tables of the database except the tables in keep, relationship tables before the node tables they connect
+    tables = conn.execute("CALL show_tables() RETURN name, type").get_as_df()
+    for tableType in ['REL', 'NODE']:
+        for table in tables.loc[tables['type'] == tableType, 'name']:
+            if table not in keep:
+                executeWrite(conn, f"DROP TABLE IF EXISTS {table}")
+
+def createEntityTables(conn: kuzu.Connection, spec):
+    # node and relationship tables of entities, correlation, relations and derived entities
+    entityTableDDL = bulk_import.getEntityTableDDL(spec['entity_keys'] == 'integer')
+    if spec['schema'] == 'basic':
+        executeWrite(conn, f"CREATE NODE TABLE Entity {entityTableDDL}")
+        executeWrite(conn, "CREATE REL TABLE CORR (FROM Event TO Entity)")
+        executeWrite(conn, "CREATE REL TABLE REL (FROM Entity TO Entity, Type STRING)")
+        return
+
+    corrString = ""     # type string for the CORR relationship group (Event to entity types)
+    relString = ""      # type string for the REL relationship group (entity type to entity type)
+    derivedString = ""  # type string for the DERIVED relationship group (derived entity type to entity types)
+    for entity in getEntities(spec):
+        executeWrite(conn, f"CREATE NODE TABLE {entity[0]} {entityTableDDL}")
+        corrString = corrString + f"FROM Event TO {entity[0]}, "
+    for relation in getRelations(spec):
+        relString = relString + f"FROM {relation[2]} TO {relation[1]}, "
+    for relation in getDerivedRelations(spec):
+        executeWrite(conn, f"CREATE NODE TABLE {relation[0]} {entityTableDDL}")
+        corrString = corrString + f"FROM Event TO {relation[0]}, "
+        derivedString = derivedString + f"FROM {relation[0]} TO {relation[2]}, FROM {relation[0]} TO {relation[1]}, "
+
+    executeWrite(conn, "CREATE REL TABLE CORR ("+corrString[:-2]+")")
+    if relString != "":
+        executeWrite(conn, "CREATE REL TABLE REL ("+relString+"Type STRING)")
+    if derivedString != "":
+        executeWrite(conn, "CREATE REL TABLE DERIVED ("+derivedString[:-2]+")")
+
+def importEvents(conn: kuzu.Connection, spec):
+    files = [os.path.join(spec['input_directory'], fileName) for fileName in spec['files']]
+    logNames = getLogNames(spec)
+
+    if len(files) == 1 and not spec['infer_types'] and spec['event_partitioning'] is None and not spec['class_codes']:
+        executeWrite(conn, "CREATE NODE TABLE Event ("+event_schema.getEventDDL(files[0])+")")
+        executeWrite(conn, event_schema.getEventCopy(files[0]))
+        executeWrite(conn, f"ALTER TABLE Event ADD Log STRING DEFAULT '{logNames[0]}'")
+    else:
+        events = event_schema.getEventTable(files, logNames, inferTypes=spec['infer_types'], types=getColumnTypes(spec))
+        if spec['class_codes']:
+            events, classCodes = event_schema.addClassCodes(events)
+            event_schema.storeClassCodes(conn, classCodes)
+        if spec['event_partitioning'] is not None:
+            events, cold = event_schema.splitEventTable(events, event_schema.getHotColumns(spec['model_entities'], spec['model_relations']))
+            coldFile = event_schema.getColdFile(spec['database'])
+            if os.path.exists(coldFile): # cold attributes of a previous build
+                os.remove(coldFile)
+            event_schema.storeColdEvents(conn, cold, spec['event_partitioning'], coldFile)
+        executeWrite(conn, "CREATE NODE TABLE Event ("+event_schema.getEventDDLFromSchema(events.schema)+")")
+        executeWrite(conn, "COPY Event FROM events") # kuzu scans the arrow table of the variable 'events'
+
+def runImportEvents(conn: kuzu.Connection, spec):
+    importEvents(conn, spec)
+    return {'Event': getCount(conn, "(e:Event)")}
+
+def runLinkLog(conn: kuzu.Connection, spec):
+    executeWrite(conn, "CREATE NODE TABLE Log (ID STRING, PRIMARY KEY(ID))")
+    executeWrite(conn, "CREATE REL TABLE HAS (FROM Log TO Event)")
+    has = 0
+    for logName in getLogNames(spec):
+        has = has + bulk_import.linkEventsToLog(conn, logName)
+    return {'Log': len(getLogNames(spec)), 'HAS': has}
+
+def runEntityTables(conn: kuzu.Connection, spec):
+    createEntityTables(conn, spec)
+    return {}
+
+# as in Neo4j, a property that no event has (e.g., a column of a table that is not imported) is null for all events:
+# there are no entities with this identifier and no relations with this foreign key
+
+def runEntity(conn: kuzu.Connection, spec, entity):
+    typed = spec['schema'] == 'typed'
+    nodes, corr = 0, 0
+    if entity[1] in getEventProperties(conn):
+        nodes, corr = bulk_import.createEntitiesAndCorrelate(conn, entity[0], entity[1], entity[2], entity[0] if typed else "Entity", typed)
+    return {entity[0]: nodes, 'CORR': corr}
+
+def runRelation(conn: kuzu.Connection, spec, relation):
+    rel = 0
+    if relation[3] in getEventProperties(conn):
+        rel = bulk_import.createEntityRelationships(conn, relation[0], relation[1], relation[2], relation[3], spec['schema'] == 'typed')
+    return {'REL': rel}
+
+def runDerived(conn: kuzu.Connection, spec, relation):
+    typed = spec['schema'] == 'typed'
+    nodes = bulk_import.reifyEntityRelations(conn, relation[0], relation[1], relation[2], typed)
+    corr = bulk_import.correlateEventsToDerivedEntity(conn, relation[0], typed)
+    return {relation[0]: nodes, 'DERIVED' if typed else 'REL': 2*nodes, 'CORR': corr}
+
+def runDirectlyFollows(conn: kuzu.Connection, spec, entity_type, parallel_entity_types):
+    # DF relationships of one entity type as infer_df_edges[_typed].infer_df, without those parallel to the DF relationships
+    # of parallel_entity_types (delete_parallel_df of a derived entity type)
+    infer_df_module = infer_df_edges_typed if spec['schema'] == 'typed' else infer_df_edges
+    executeWrite(conn, "CREATE REL TABLE IF NOT EXISTS DF (FROM Event TO Event, ID STRING, EntityType STRING)")
+    if spec['df_batch_size'] is not None:
+        directly_follows.createDirectlyFollowsStreaming(conn, entity_type, spec['schema'] == 'typed', parallel_entity_types, spec['df_batch_size'])
+    else:
+        infer_df_module.createDirectlyFollowsFast(conn, entity_type, parallel_entity_types, spec['df_workers'])
+    return {'DF': getCount(conn, f"()-[df:DF {{EntityType: '{entity_type}'}}]->()")}
+
+def runDirectlyFollowsAll(conn: kuzu.Connection, spec, parallel_entity_types):
+    # DF relationships of all entity types from one scan (infer_df_edges[_typed].createDirectlyFollowsAll), without those of
+    # derived entity types parallel to the DF relationships of the entity types in parallel_entity_types (by derived entity type)
+    infer_df_module = infer_df_edges_typed if spec['schema'] == 'typed' else infer_df_edges
+    executeWrite(conn, "CREATE REL TABLE IF NOT EXISTS DF (FROM Event TO Event, ID STRING, EntityType STRING)")
+    infer_df_module.createDirectlyFollowsAll(conn, parallel_entity_types, spec['df_workers'])
+    return {'DF': getCount(conn, "()-[df:DF]->()")}
+
+def runEventClasses(conn: kuzu.Connection, spec):
+    queries_build_dfg_module = queries_build_dfg_typed if spec['schema'] == 'typed' else queries_build_dfg
+    queries_build_dfg_module.prepareDFGtables(conn)
+    if spec['class_codes']:
+        queries_build_dfg_module.createEventClassFromCodes(conn, spec['classifier'])
+    elif spec['classifier'] == 'Activity+Lifecycle':
+        queries_build_dfg_module.createEventClass_ActivityANDLifeCycle(conn)
+    else:
+        queries_build_dfg_module.createEventClass_Activity(conn)
+    return {'Class': getCount(conn, "(c:Class)"), 'OBSERVED': getCount(conn, "()-[:OBSERVED]->()")}
+
+def runDFrelations(conn: kuzu.Connection, spec, entity_type):
+    queries_build_dfg_module = queries_build_dfg_typed if spec['schema'] == 'typed' else queries_build_dfg
+    if spec['class_codes']:
+        queries_build_dfg_module.aggregateDFrelationsFromCodes(conn, entity_type, spec['classifier'])
+    else:
+        queries_build_dfg_module.aggregateDFrelations(conn, entity_type, spec['classifier'])
+    return {'DF_C': getCount(conn, f"()-[d:DF_C {{EntityType: '{entity_type}'}}]->()")}
+
+def getEntityStageIDs(spec):
+    # stage creating the entities of each entity type
+    stageIDs = {entity[0]: f'entity {entity[0]}' for entity in getEntities(spec)}
+    stageIDs.update({relation[0]: f'derived {relation[0]}' for relation in getDerivedRelations(spec)})
+    return stageIDs
+
+def getStages(spec):
+    # stages of the construction of the graph in the order of build: dicts with the ID of the stage (also its name in the report),
+    # the IDs of the stages it depends on, the part of the specification it depends on (config) and the function that runs it
+    typed = spec['schema'] == 'typed'
+    entityStageIDs = getEntityStageIDs(spec)
+    eventTables = {fileName: prepare_utils.hashFile(os.path.join(spec['input_directory'], fileName)) for fileName in spec['files']}
+    tables = {'schema': spec['schema'], 'entity_keys': spec['entity_keys']}
+    if typed: # the typed schema has a node table per entity type and relationship table groups of all entity types
+        tables.update({'entities': getEntityTypes(spec), 'relations': [relation[:3] for relation in getRelations(spec)],
+                       'derived': [relation[0] for relation in getDerivedRelations(spec)]})
+
+    stages = [{'ID': 'import_events', 'deps': [], 'run': runImportEvents,
+               'config': {'files': eventTables, 'logs': getLogNames(spec), 'infer_types': spec['infer_types'], 'types': getColumnTypes(spec),
+                          'partitioning': spec['event_partitioning'], 'class_codes': spec['class_codes']}},
+              {'ID': 'link_log', 'deps': ['import_events'], 'config': {'logs': getLogNames(spec)}, 'run': runLinkLog},
+              {'ID': 'entity_tables', 'deps': ['import_events'], 'config': tables, 'run': runEntityTables}]
+    for entity in getEntities(spec):
+        stages.append({'ID': entityStageIDs[entity[0]], 'deps': ['entity_tables'], 'config': entity,
+                       'run': functools.partial(runEntity, entity=entity)})
+    for relation in getRelations(spec):
+        stages.append({'ID': f'relation {relation[0]}', 'deps': [entityStageIDs[relation[1]], entityStageIDs[relation[2]]], 'config': relation,
+                       'run': functools.partial(runRelation, relation=relation)})
+    for relation in getDerivedRelations(spec):
+        stages.append({'ID': entityStageIDs[relation[0]], 'deps': [f'relation {relation[0]}'], 'config': relation,
+                       'run': functools.partial(runDerived, relation=relation)})
+
+    # DF relationships of the entities before those of the derived entities, which may exclude parallel DF relationships
+    parallel = {relation[0]: [relation[1], relation[2]] for relation in getDerivedRelations(spec)} if spec['delete_parallel_df'] else {}
+    if spec['single_pass_df']:
+        stages.append({'ID': 'infer_df', 'deps': list(entityStageIDs.values()), 'config': {'parallel': parallel},
+                       'run': functools.partial(runDirectlyFollowsAll, parallel_entity_types=parallel)})
+    for entity_type in getEntityTypes(spec) if not spec['single_pass_df'] else []:
+        parallel_entity_types = parallel.get(entity_type, [])
+        stages.append({'ID': f'infer_df {entity_type}', 'deps': [entityStageIDs[entity_type]] + [f'infer_df {t}' for t in parallel_entity_types],
+                       'config': {'parallel': parallel_entity_types},
+                       'run': functools.partial(runDirectlyFollows, entity_type=entity_type, parallel_entity_types=parallel_entity_types)})
+
+    if spec['build_dfg']:
+        stages.append({'ID': 'classes', 'deps': ['import_events'], 'config': {'classifier': spec['classifier'], 'class_codes': spec['class_codes']},
+                       'run': runEventClasses})
+        for entity_type in getEntityTypes(spec):
+            stages.append({'ID': f'build_dfg {entity_type}', 'deps': ['infer_df' if spec['single_pass_df'] else f'infer_df {entity_type}', 'classes'], 'config': {'classifier': spec['classifier']},
+                           'run': functools.partial(runDFrelations, entity_type=entity_type)})
+    return stages
+
+def undoStage(conn: kuzu.Connection, spec, stageID):
+    # remove the output of a stage from the graph before it runs again, the stage may have failed or its input changed
+    # import_events and classes start from empty tables, see build and queries_build_dfg[_typed].prepareDFGtables
+    kind, _, name = stageID.partition(' ')
+    tables = build_stages.getTables(conn)
+    if kind == 'link_log':
+        executeWrite(conn, "DROP TABLE IF EXISTS HAS")
+        executeWrite(conn, "DROP TABLE IF EXISTS Log")
+    elif kind == 'entity_tables':
+        clearDatabase(conn, keep=['Event', event_schema.cold_table, event_schema.class_table, 'Log', 'HAS', 'DF', 'Class', 'OBSERVED', 'DF_C', build_stages.stage_table])
+    elif kind in ['entity', 'derived']:
+        if spec['schema'] == 'typed' and name in tables:
+            executeWrite(conn, f"MATCH (n:{name}) DETACH DELETE n")
+        elif spec['schema'] == 'basic' and 'Entity' in tables:
+            executeWrite(conn, "MATCH (n:Entity) WHERE n.EntityType = $type DETACH DELETE n", {"type": name})
+    elif kind == 'relation' and 'REL' in tables:
+        executeWrite(conn, "MATCH ()-[r:REL]->() WHERE r.Type = $type DELETE r", {"type": name})
+    elif kind == 'infer_df' and 'DF' in tables and name == '': # DF relationships of all entity types (single_pass_df)
+        executeWrite(conn, "DROP TABLE DF")
+    elif kind == 'infer_df' and 'DF' in tables:
+        executeWrite(conn, "MATCH ()-[df:DF]->() WHERE df.EntityType = $type DELETE df", {"type": name})
+    elif kind == 'build_dfg' and 'DF_C' in tables:
+        executeWrite(conn, "MATCH ()-[d:DF_C]->() WHERE d.EntityType = $type DELETE d", {"type": name})
+
+def build(spec, resume=True, workers=4):
+    # build the event knowledge graph of a dataset specification in its database, returns the report of all stages
+    # with resume, the stages recorded as complete in the database are kept if their input did not change (see getStages),
+    # the other stages and all stages depending on them run again; without resume, the graph is built from scratch
+    # the stages run in up to 'workers' threads (see stage_scheduler.py), the report lists the critical path of the stages
+    spec = completeSpec(spec)
+    report = {'dataset': spec['name'], 'schema': spec['schema'], 'database': spec['database'], 'stages': []}
+    startBuild = time.time()
+
+    db = kuzu.Database(spec['database'])
+    conn = kuzu.Connection(db)
+
+    stages = getStages(spec)
+    records = build_stages.getStageRecords(conn) if resume else {}
+    inputHashes = {}
+    runs = set()
+    for stage in stages:
+        inputHashes[stage['ID']] = prepare_utils.hashConfig({'config': stage['config'], 'deps': [inputHashes[dep] for dep in stage['deps']]})
+        record = records.get(stage['ID'])
+        if record is None or not record['Complete'] or record['InputHash'] != inputHashes[stage['ID']] or any(dep in runs for dep in stage['deps']):
+            runs.add(stage['ID'])
+
+    if 'import_events' in runs:
+        clearDatabase(conn)
+        records = {}
+    build_stages.createStageTable(conn)
+    for stageID in records:
+        if stageID not in inputHashes: # e.g., an entity type that is no longer included
+            undoStage(conn, spec, stageID)
+            build_stages.deleteStage(conn, stageID)
+    if all(stage['ID'] in runs for stage in stages if stage['ID'].startswith('infer_df')):
+        executeWrite(conn, "DROP TABLE IF EXISTS DF") # faster than deleting the DF relationships of each entity type
+
+    conn.close()
+
+    def runStage(conn, stage):
+        start = time.time()
+        if stage['ID'] in records:
+            undoStage(conn, spec, stage['ID'])
+        build_stages.startStage(conn, stage['ID'], inputHashes[stage['ID']])
+        rows = stage['run'](conn, spec)
+        build_stages.completeStage(conn, stage['ID'], rows, round(time.time() - start, 3))
+        print(f"{stage['ID']} done: took {time.time() - start} seconds")
+        return rows
+
+    # the stages that run again, in a pool of workers as soon as the stages they depend on completed
+    try:
+        results = stage_scheduler.runStages(db, [stage for stage in stages if stage['ID'] in runs], runStage, workers)
+    finally:
+        db.close() # also if a stage failed, a later build of this process opens the database again
+    for stage in stages:
+        if stage['ID'] in results:
+            rows, timing = results[stage['ID']]
+            report['stages'].append({'stage': stage['ID'], 'seconds': round(timing['end'] - timing['start'], 3), 'rows': rows, **timing})
+        else:
+            report['stages'].append({'stage': stage['ID'], 'seconds': 0, 'rows': records[stage['ID']]['Rows'], 'resumed': True})
+            print(f"{stage['ID']} is up to date")
+
+    report['total_seconds'] = round(time.time() - startBuild, 3)
+    report['database_bytes'] = getDatabaseSize(spec['database'])
+    report['stage_seconds'] = round(sum(stage['seconds'] for stage in report['stages']), 3)
+    report['critical_path'] = stage_scheduler.getCriticalPath(stages, {stageID: timing for stageID, (rows, timing) in results.items()})
+    print(f"built in {report['total_seconds']} seconds with {workers} workers ({report['database_bytes']} bytes), the stages took {report['stage_seconds']} seconds, "
+          f"critical path {report['critical_path']['seconds']} seconds: {' -> '.join(report['critical_path']['stages'])}")
+    return report
+
+def invalidate(spec, entity_types):
+    # mark the construction of the given entity types (entities or derived entities) as incomplete: the next build creates
+    # these entities again, and only the stages depending on them (their relations, derived entities, DF and DF_C relationships)
+    spec = completeSpec(spec)
+    stageIDs = getEntityStageIDs(spec)
+    unknown = [entity_type for entity_type in entity_types if entity_type not in stageIDs]
+    if unknown != []:
+        raise ValueError(f"unknown entity types {unknown}, the specification has {list(stageIDs)}")
+    db = kuzu.Database(spec['database'])
+    conn = kuzu.Connection(db)
+    invalidated = build_stages.invalidateStages(conn, [stageIDs[entity_type] for entity_type in entity_types])
+    conn.close()
+    return invalidated
+
+def append(spec, files, logNames=None):
+    # append the events of the prepared event tables files (in the input directory of the specification) to the graph of the
+    # specification, returns the report of all stages
+    # the events are recorded in the log of the dataset (one event table) or in one log per file (several event tables)
+    spec = completeSpec(spec)
+    typed = spec['schema'] == 'typed'
+    if logNames is None:
+        logNames = [spec['name']]*len(files) if len(spec['files']) == 1 else [os.path.splitext(fileName)[0] for fileName in files]
+    report = {'dataset': spec['name'], 'schema': spec['schema'], 'database': spec['database'], 'append': files, 'stages': []}
+    startAppend = time.time()
+
+    db = kuzu.Database(spec['database'])
+    conn = kuzu.Connection(db)
+
+    start = time.time()
+    properties = conn.execute("CALL table_info('Event') RETURN name, type").get_as_df()
+    min_idx = conn.execute("MATCH (e:Event) RETURN max(e.idx)").get_next()[0] + 1 # idx of the first new event
+    # the new events get the types of the Event node table
+    events = event_schema.getEventTable([os.path.join(spec['input_directory'], fileName) for fileName in files], logNames, offset=min_idx,
+                                        types=dict(zip(properties['name'], properties['type'])))
+    if event_schema.getClassCodes(conn) is not None: # the classes of the new events get new codes
+        events, classCodes = event_schema.addClassCodes(events, event_schema.getClassCodes(conn))
+        event_schema.storeClassCodes(conn, classCodes)
+    if spec['event_partitioning'] is not None: # the attributes that are not in the Event node table are cold
+        events, cold = event_schema.splitEventTable(events, properties['name'].to_list())
+        event_schema.storeColdEvents(conn, cold, spec['event_partitioning'], event_schema.getColdFile(spec['database']))
+        cold = None
+    events = event_schema.alignEventTable(events, list(zip(properties['name'], properties['type'])))
+    executeWrite(conn, "COPY Event FROM events") # kuzu scans the arrow table of the variable 'events'
+    addStage(report, 'import_events', start, {'Event': len(events)})
+    events = None
+    # the graph no longer contains the events of the event tables of the specification only, the next build starts from scratch
+    records = build_stages.getStageRecords(conn)
+    if 'import_events' in records:
+        appended = {fileName: prepare_utils.hashFile(os.path.join(spec['input_directory'], fileName)) for fileName in files}
+        build_stages.setStageHash(conn, 'import_events', prepare_utils.hashConfig({'build': records['import_events']['InputHash'], 'append': appended}))
+
+    start = time.time()
+    has = 0
+    for logName in sorted(set(logNames)):
+        has = has + bulk_import.linkEventsToLog(conn, logName, min_idx)
+    addStage(report, 'link_log', start, {'HAS': has})
+
+    eventProperties = list(properties['name'])
+    for entity in getEntities(spec):
+        start = time.time()
+        node_table = entity[0] if typed else "Entity"
+        nodes, corr = 0, 0
+        if entity[1] in eventProperties:
+            nodes, corr = bulk_import.createEntitiesAndCorrelate(conn, entity[0], entity[1], entity[2], node_table, typed, min_idx)
+        addStage(report, f'entity {entity[0]}', start, {entity[0]: nodes, 'CORR': corr})
+
+    for relation in getRelations(spec):
+        start = time.time()
+        rel = 0
+        if relation[3] in eventProperties:
+            rel = bulk_import.createEntityRelationships(conn, relation[0], relation[1], relation[2], relation[3], typed, True)
+        addStage(report, f'relation {relation[0]} ({relation[2]} to {relation[1]})', start, {'REL': rel})
+
+    new_uIDs = {} # new derived entities, existing events may get correlated to them
+    for relation in getDerivedRelations(spec):
+        start = time.time()
+        existing = bulk_import.getEntities(conn, relation[0], typed)['uID']
+        nodes = bulk_import.reifyEntityRelations(conn, relation[0], relation[1], relation[2], typed, True)
+        corr = bulk_import.correlateEventsToDerivedEntity(conn, relation[0], typed, min_idx)
+        uIDs = bulk_import.getEntities(conn, relation[0], typed)['uID']
+        new_uIDs[relation[0]] = uIDs[~uIDs.isin(existing)].to_list()
+        addStage(report, f'derived entity {relation[0]}', start, {relation[0]: nodes, 'DERIVED' if typed else 'REL': 2*nodes, 'CORR': corr})
+
+    # DF relationships of the entities before those of the derived entities, which may exclude parallel DF relationships
+    start = time.time()
+    df_changes = {}
+    for entity_type in getEntityTypes(spec):
+        parallel_entity_types = []
+        if spec['delete_parallel_df']:
+            parallel_entity_types = [[relation[1], relation[2]] for relation in getDerivedRelations(spec) if relation[0] == entity_type]
+            parallel_entity_types = parallel_entity_types[0] if parallel_entity_types != [] else []
+        df_changes[entity_type] = incremental_update.updateDirectlyFollows(conn, entity_type, typed, min_idx, parallel_entity_types)
+    addStage(report, 'infer_df', start, {'DF created': sum(len(added) for added, removed in df_changes.values()),
+                                         'DF deleted': sum(len(removed) for added, removed in df_changes.values())})
+
+    if spec['build_dfg']:
+        start = time.time()
+        classes, observed = incremental_update.updateEventClasses(conn, spec['classifier'], min_idx)
+        dfc = [0, 0, 0]
+        for entity_type in getEntityTypes(spec):
+            added, removed = df_changes[entity_type]
+            changes = incremental_update.updateDFrelations(conn, entity_type, spec['classifier'], typed, min_idx, added, removed,
+                                                           new_uIDs.get(entity_type, []))
+            dfc = [count + change for count, change in zip(dfc, changes)]
+        addStage(report, 'build_dfg', start, {'Class': classes, 'OBSERVED': observed,
+                                              'DF_C created': dfc[0], 'DF_C updated': dfc[1], 'DF_C deleted': dfc[2]})
+
+    conn.close()
+    report['total_seconds'] = round(time.time() - startAppend, 3)
+    return report
+
+def dumpGraph(conn: kuzu.Connection):
+    # content of all tables except the build stages, nodes by their properties and relationships by the primary keys of their nodes and their properties,
+    # as sorted lists of rows to compare graphs independent of the order of construction
+    # entities are identified by their uID instead of their integer key, which depends on the order in which the entities were created,
+    # and the class codes of events are left out for the same reason (the classes are compared by the :OBSERVED relationships)
+    dump = {}
+    tables = conn.execute("CALL show_tables() RETURN name, type").get_as_df()
+    properties = {name: conn.execute(f"CALL table_info('{name}') RETURN name").get_as_df()['name'].to_list() for name in tables['name']}
+    def getIdentity(table, primaryKey):
+        return 'uID' if 'uID' in properties[table] else primaryKey
+    for name, tableType in zip(tables['name'], tables['type']):
+        if name in [build_stages.stage_table, event_schema.class_table]:
+            continue
+        if tableType == 'NODE':
+            ignored = (['key'] if 'uID' in properties[name] else []) + (list(event_schema.class_code_columns.values()) if name == 'Event' else [])
+            queries = [f"MATCH (n:{name}) RETURN " + ", ".join(f"n.{p}" for p in properties[name] if p not in ignored)]
+        else:
+            connections = conn.execute(f"CALL show_connection('{name}') RETURN *").get_as_df()
+            queries = [f"MATCH (a:{c['source table name']}) -[r:{name}]-> (b:{c['destination table name']}) RETURN "
+                       + ", ".join([f"a.{getIdentity(c['source table name'], c['source table primary key'])}",
+                                    f"b.{getIdentity(c['destination table name'], c['destination table primary key'])}"] + [f"r.{p}" for p in properties[name]])
+                       for c in connections.to_dict('records')]
+        rows = []
+        for query in queries:
+            rows = rows + [tuple(str(value) for value in row) for row in conn.execute(query).get_as_df().itertuples(index=False)]
+        dump[name] = sorted(rows)
+    return dump
+
+def verifyAppend(spec, base_fraction=0.9, directory=None, later=None):
+    # check that appending events gives the same graph as building it from all events: splits the prepared event table of the
+    # specification by time into the events until the base_fraction quantile and the later events, builds the graph of all events
+    # and the graph of the earlier events, appends the later events to the latter and compares both graphs
+    # later (boolean per event of the table) selects the appended events instead, e.g., events inside the DF chains of the graph
+    # returns whether the graphs are identical and the reports of the full build and of the append
+    spec = completeSpec(spec)
+    if directory is None:
+        directory = tempfile.mkdtemp()
+    log = pd.read_csv(os.path.join(spec['input_directory'], spec['files'][0]), dtype=str, keep_default_na=False)
+    if later is None:
+        timestamps = pd.to_datetime(log['timestamp'], format='ISO8601', utc=True)
+        later = timestamps > timestamps.quantile(base_fraction)
+    later = pd.Series(later, index=log.index)
+
+    # all events with the later events last, so that both graphs number the events in the same way
+    log = pd.concat([log[~later], log[later]], ignore_index=True)
+    log['idx'] = range(len(log))
+    base = log.iloc[:(~later).sum()]
+    new = log.iloc[(~later).sum():].copy()
+    new['idx'] = range(len(new)) # as written by a prepare script
+    for table, fileName in [[log, 'full.csv'], [base, 'base.csv'], [new, 'new.csv']]:
+        table.to_csv(os.path.join(directory, fileName), index=False)
+
+    fullSpec = {**spec, 'input_directory': directory, 'files': ['full.csv'], 'database': os.path.join(directory, 'db_full')}
+    appendSpec = {**spec, 'input_directory': directory, 'files': ['base.csv'], 'database': os.path.join(directory, 'db_append')}
+    fullReport = build(fullSpec)
+    build(appendSpec)
+    appendReport = append(appendSpec, ['new.csv'])
+
+    dumps = []
+    for database in [fullSpec['database'], appendSpec['database']]:
+        db = kuzu.Database(database)
+        conn = kuzu.Connection(db)
+        dumps.append(dumpGraph(conn))
+        conn.close()
+        db.close()
+    identical = dumps[0] == dumps[1]
+    for table in sorted(set(dumps[0]) | set(dumps[1])):
+        if dumps[0].get(table) != dumps[1].get(table):
+            print(f"{table} differs: {len(dumps[0].get(table, []))} rows in the full build, {len(dumps[1].get(table, []))} after appending")
+    print(f"{len(new)} events appended to {len(base)} events, graph identical to full build: {identical}")
+    return identical, fullReport, appendReport
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the event knowledge graph of a dataset specification in KuzuDB')
+    parser.add_argument('spec', help='dataset specification (JSON file)')
+    parser.add_argument('--schema', choices=['basic', 'typed'], help='schema of the graph, overrides the specification')
+    parser.add_argument('--database', help='directory of the database, overrides the specification')
+    parser.add_argument('--entity-keys', choices=['integer', 'string'], help='primary keys of entity nodes, overrides the specification')
+    parser.add_argument('--input-dir', help='directory of the prepared event tables, overrides the specification')
+    parser.add_argument('--report', help='write the report (stage timings and row counts) as JSON to this file')
+    parser.add_argument('--append', nargs='+', metavar='FILE', help='append the events of these prepared event tables to the existing graph')
+    parser.add_argument('--workers', type=int, default=4, help='number of stages that run concurrently (default: 4)')
+    parser.add_argument('--df-workers', type=int, help='number of worker processes computing DF relationships, overrides the specification')
+    parser.add_argument('--df-batch-size', type=int, help='infer DF relationships from batches of this number of CORR rows, overrides the specification')
+    parser.add_argument('--rebuild', action='store_true', help='build the graph from scratch instead of resuming from the recorded stages')
+    parser.add_argument('--invalidate', nargs='+', metavar='ENTITY_TYPE', help='create the entities of these entity types and all stages depending on them again')
+    parser.add_argument('--verify-append', type=float, metavar='FRACTION',
+                        help='check that appending the events after the FRACTION quantile of time gives the same graph as a full build')
+    args = parser.parse_args()
+
+    spec = loadSpec(args.spec)
+    if args.schema is not None:
+        spec['schema'] = args.schema
+    if args.database is not None:
+        spec['database'] = args.database
+    if args.input_dir is not None:
+        spec['input_directory'] = args.input_dir
+    if args.entity_keys is not None:
+        spec['entity_keys'] = args.entity_keys
+    if args.df_workers is not None:
+        spec['df_workers'] = args.df_workers
+    if args.df_batch_size is not None:
+        spec['df_batch_size'] = args.df_batch_size
+
+    if args.verify_append is not None:
+        identical, fullReport, appendReport = verifyAppend(spec, args.verify_append)
+        report = {'identical': identical, 'build': fullReport, 'append': appendReport}
+    elif args.append is not None:
+        report = append(spec, args.append)
+    else:
+        if args.invalidate is not None:
+            print(f"invalidated {invalidate(spec, args.invalidate)}")
+        report = build(spec, resume=not args.rebuild, workers=args.workers)
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+import csv
+import re
+
+# data definition of the Event node table for a prepared event table in CSV or Parquet format
+
+# placeholder of missing values in the prepared CSV event tables (na_rep of the prepare scripts)
+na_values = ['Unknown']
+
+# patterns of the text values of the kuzu data types that are inferred for CSV columns (see inferColumnTypes), in the order
+# in which they are tried: integral numbers are INT64 also when written as 5000.0 (as pandas writes integers of columns with
+# missing values), numbers with leading zeros (e.g., identifiers like 007) and integers of more than 15 digits (which do not
+# pass through float exactly) are text
+value_patterns = [('BOOLEAN', re.compile(r'(?i)true|false')),
+                  ('INT64', re.compile(r'[+-]?(0|[1-9][0-9]{0,14})(\.0*)?')),
+                  ('DOUBLE', re.compile(r'[+-]?((0|[1-9][0-9]*)(\.[0-9]*)?|\.[0-9]+)([eE][+-]?[0-9]+)?')),
+                  ('DATE', re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}')),
+                  ('TIMESTAMP', re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}[T ][0-9]{2}:[0-9]{2}(:[0-9]{2}(\.[0-9]+)?)?(Z|[+-][0-9]{2}:?[0-9]{2})?'))]
+
+# load log header (attribute names) from import file
+def getLogHeader(fileName):
+    with open(fileName) as f:
+        reader = csv.reader(f)
+        logHeader = list(next(reader))
+        f.close()
+    return logHeader
+
+def getKuzuType(arrowType):
+    # kuzu data type of a column of a Parquet file, given by its arrow type
+    import pyarrow as pa
+
+    if pa.types.is_dictionary(arrowType): # dictionary-encoded column, e.g., pandas category
+        arrowType = arrowType.value_type
+
+    if pa.types.is_timestamp(arrowType):
+        return 'TIMESTAMP'
+    elif pa.types.is_date(arrowType):
+        return 'DATE'
+    elif pa.types.is_boolean(arrowType):
+        return 'BOOLEAN'
+    elif pa.types.is_int8(arrowType):
+        return 'INT8'
+    elif pa.types.is_int16(arrowType):
+        return 'INT16'
+    elif pa.types.is_int32(arrowType):
+        return 'INT32'
+    elif pa.types.is_integer(arrowType):
+        return 'INT64'
+    elif pa.types.is_float32(arrowType):
+        return 'FLOAT'
+    elif pa.types.is_floating(arrowType):
+        return 'DOUBLE'
+    else:
+        return 'STRING'
+
+def getEventDDLFromSchema(schema):
+    # build data definition string for importing an event table given as arrow table or Parquet file with this arrow schema
+    ddlString = ""
+    for field in schema:
+        ddlString = ddlString + f'{field.name} {getKuzuType(field.type)}, '
+    ddlString = ddlString + "PRIMARY KEY(idx)"
+    return ddlString
+
+def getEventDDL(fileName):
+    # build data definition string for importing the event table
+    #   CSV: all values are strings, the type of timestamp and index columns is set by their name
+    #   Parquet: the type of each column is taken from the schema of the file
+    if fileName.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        return getEventDDLFromSchema(pq.read_schema(fileName))
+
+    ddlString = ""
+    for col in getLogHeader(fileName):
+        if col in ['timestamp','start','end']:
+            ddlEntry = f'{col} TIMESTAMP, '
+        elif col in ['idx']:
+            ddlEntry = f'{col} INT32, '
+        else:
+            ddlEntry = f'{col} STRING, '
+
+        ddlString = ddlString + ddlEntry
+    ddlString = ddlString + "PRIMARY KEY(idx)"
+    return ddlString
+
+def inferColumnType(values):
+    # kuzu data type of text values (without missing values): the first type of value_patterns all values match, else STRING
+    values = values.astype(str)
+    for kuzuType, pattern in value_patterns:
+        if values.str.fullmatch(pattern).all():
+            return kuzuType
+    return 'STRING'
+
+def inferColumnTypes(log, overrides={}, sampleSize=1000, exclude=['idx', 'Log']):
+    # kuzu data types of the text columns of an event table read as strings (pandas DataFrame), inferred from a sample of up to
+    # sampleSize values of each column spread over the table: values in na_values are missing, a column without values is STRING
+    # overrides sets the type of columns by name (e.g., {'CreditScore': 'DOUBLE', 'OfferID': 'STRING'}), columns in exclude
+    # keep the type they have
+    import pandas as pd
+
+    types = {}
+    for col in log.columns:
+        if col in overrides:
+            types[col] = overrides[col]
+        elif col not in exclude and pd.api.types.is_string_dtype(log[col].dtype):
+            values = log[col].dropna()
+            values = values[~values.isin(na_values)]
+            if len(values) > sampleSize:
+                values = values.iloc[::len(values) // sampleSize]
+            types[col] = inferColumnType(values) if len(values) > 0 else 'STRING'
+    return types
+
+def castColumn(values, kuzuType):
+    # arrow array of a text column (pandas Series) with the values of kuzu data type kuzuType, values in na_values are missing
+    # except in STRING columns
+    # raises ValueError if a value is not of the type (the type was inferred from a sample or set by an override)
+    import pandas as pd
+    import pyarrow as pa
+
+    if kuzuType == 'STRING': # text keeps na_values, as in the CSV
+        return pa.array(values.astype(object), type=pa.string(), from_pandas=True)
+    values = values.astype(object).where(~values.isin(na_values))
+    present = values.dropna().astype(str)
+    pattern = dict(value_patterns).get('BOOLEAN' if kuzuType == 'BOOL' else 'INT64' if kuzuType.startswith('INT') else kuzuType)
+    if pattern is not None and not present.str.fullmatch(pattern).all():
+        invalid = present[~present.str.fullmatch(pattern)].iloc[0]
+        raise ValueError(f"value {invalid!r} of column {values.name} is not of type {kuzuType}")
+
+    if kuzuType in ['BOOLEAN', 'BOOL']:
+        values = values.str.lower().map({'true': True, 'false': False})
+    elif kuzuType in ['TIMESTAMP', 'DATE']:
+        values = pd.to_datetime(values, format='ISO8601', utc=True).dt.tz_localize(None)
+    elif kuzuType.startswith('INT'):
+        values = pd.to_numeric(values).astype('Int64')
+    elif kuzuType in ['DOUBLE', 'FLOAT']:
+        values = pd.to_numeric(values)
+    return pa.array(values, from_pandas=True).cast(getArrowType(kuzuType))
+
+def getEventCopy(fileName, table="Event"):
+    # COPY statement that loads the event table into node table 'table'
+    if fileName.endswith('.parquet'):
+        return f"COPY {table} FROM '{fileName}';"
+    else:
+        return f"COPY {table} FROM '{fileName}' (header=true, quote='\"');"
+
+def getEventTable(fileNames, logNames, timestampColumns=['timestamp','start','end'], offset=0, inferTypes=False, types={}):
+    # union of several prepared event tables (CSV or Parquet) as one arrow table for COPY Event FROM ...
+    #   columns missing in a table are null, the column types follow getEventDDL: timestamps as TIMESTAMP
+    #   (in UTC, as kuzu stores timestamps with offset), all other CSV columns as STRING
+    #   idx is shifted per table to stay unique (starting at offset), column Log holds the name of the log the event was recorded in
+    # with inferTypes, the type of the other CSV columns is inferred from a sample of their values (see inferColumnTypes), a column
+    # with a value that does not match the inferred type stays STRING; types sets the type of CSV columns by name, e.g., the
+    # types of the Event node table to append the events to, a value that does not match raises ValueError (see castColumn)
+    import pandas as pd
+    import pyarrow as pa
+
+    logs = []
+    for fileName, logName in zip(fileNames, logNames):
+        if fileName.endswith('.parquet'):
+            import pyarrow.parquet as pq
+
+            # booleans and integers with missing values keep their type (to_pandas makes them object and float columns)
+            log = pq.read_table(fileName).to_pandas(types_mapper={pa.bool_(): pd.BooleanDtype(), pa.int64(): pd.Int64Dtype()}.get)
+        else:
+            log = pd.read_csv(fileName, dtype=str, keep_default_na=False, na_values=[''])
+            for col in log.columns:
+                if col in timestampColumns:
+                    log[col] = pd.to_datetime(log[col], format='ISO8601', utc=True).dt.tz_localize(None)
+        log['idx'] = log['idx'].astype('int64') + offset
+        log['Log'] = logName
+        offset = log['idx'].max() + 1 if len(log) > 0 else offset
+        logs.append(log)
+    log = pd.concat(logs, ignore_index=True)
+
+    inferred = inferColumnTypes(log) if inferTypes else {}
+    columns = {} # text columns have the object dtype or, with pandas 3, the string dtype that read_csv(dtype=str) gives
+    for col in log.columns:
+        if pd.api.types.is_string_dtype(log[col].dtype) and col in types:
+            columns[col] = castColumn(log[col], types[col])
+        elif pd.api.types.is_string_dtype(log[col].dtype) and inferred.get(col, 'STRING') != 'STRING':
+            try:
+                columns[col] = castColumn(log[col], inferred[col])
+            except ValueError as e:
+                print(f"Warning: {e} (inferred from a sample), {col} is imported as STRING")
+                columns[col] = castColumn(log[col], 'STRING')
+        elif pd.api.types.is_string_dtype(log[col].dtype) or isinstance(log[col].dtype, pd.CategoricalDtype):
+            # text columns, also those that are entirely null in all tables
+            columns[col] = pa.array(log[col].astype(object), type=pa.string(), from_pandas=True)
+        else:
+            columns[col] = pa.array(log[col], from_pandas=True)
+    return pa.table(columns)
+
+def getArrowType(kuzuType):
+    # arrow type of the values of a column of kuzu data type kuzuType
+    import pyarrow as pa
+
+    arrowTypes = {'STRING': pa.string(), 'TIMESTAMP': pa.timestamp('us'), 'DATE': pa.date32(), 'BOOL': pa.bool_(), 'BOOLEAN': pa.bool_(),
+                  'INT8': pa.int8(), 'INT16': pa.int16(), 'INT32': pa.int32(), 'INT64': pa.int64(),
+                  'FLOAT': pa.float32(), 'DOUBLE': pa.float64()}
+    return arrowTypes[kuzuType]
+
+def alignEventTable(events, properties):
+    # arrow table with the columns of the Event node table given by properties (list of name and kuzu data type),
+    # e.g., to append events to an existing Event node table: columns the events do not have are null
+    import pyarrow as pa
+
+    names = [name for name, kuzuType in properties]
+    unknown = [name for name in events.column_names if name not in names]
+    if unknown != []:
+        raise ValueError(f"Event node table has no properties {unknown}")
+
+    columns = {}
+    for name, kuzuType in properties:
+        if name in events.column_names:
+            columns[name] = events[name].cast(getArrowType(kuzuType))
+        else:
+            columns[name] = pa.nulls(len(events), getArrowType(kuzuType))
+    return pa.table(columns)
+
+# vertical partitioning of the Event node table (event_partitioning of the import scripts and of ekg_builder.py): the hot Event
+# node table keeps the index, the log and the attributes by which queries match and order events (the OCPQ queries use only
+# activity, timestamp, lifecycle and resource), the other (cold) attributes are stored by idx in the node table cold_table
+# ('table') or in a Parquet file next to the database ('parquet') and are only read when a query needs them
+hot_columns = ['idx', 'Log', 'timestamp', 'activity', 'lifecycle', 'resource']
+cold_table = 'EventAttributes'
+
+def getHotColumns(model_entities, model_relations, columns=hot_columns):
+    # hot columns of an event knowledge graph: the given columns, the class codes, the identifiers of entities, the properties in the conditions
+    # of entities (e.g., EventOrigin in 'WHERE e.EventOrigin = "Offer"') and the foreign keys of relations, as the construction
+    # of entities and relations reads them from the Event node table
+    hot = list(columns) + list(class_code_columns.values())
+    for entity in model_entities:
+        hot = hot + [entity[1]] + re.findall(r'\be\.(\w+)', entity[2])
+    hot = hot + [relation[3] for relation in model_relations]
+    return list(dict.fromkeys(hot))
+
+def splitEventTable(events, hotColumns):
+    # hot and cold part of an event table (arrow table), both with column idx: kuzu property names are case-insensitive,
+    # so are the names in hotColumns
+    hotNames = [name.lower() for name in hotColumns]
+    hot = [name for name in events.column_names if name.lower() in hotNames]
+    cold = ['idx'] + [name for name in events.column_names if name.lower() not in hotNames]
+    return events.select(hot), events.select(cold)
+
+def getColdFile(database):
+    # Parquet file of the cold attributes of the events of the database with event_partitioning 'parquet'
+    return database.rstrip('/') + '.' + cold_table + '.parquet'
+
+def storeColdEvents(conn, cold, storage, fileName=None):
+    # store the cold attributes of events (arrow table with column idx): 'table' copies them into the node table cold_table
+    # (created with the first events), 'parquet' writes them to fileName (appends to the events in the file)
+    if storage == 'table':
+        from stage_scheduler import executeWrite
+        tables = conn.execute("CALL show_tables() RETURN name").get_as_df()['name'].to_list()
+        if cold_table not in tables:
+            executeWrite(conn, f"CREATE NODE TABLE {cold_table} ("+getEventDDLFromSchema(cold.schema)+")")
+        else: # events appended to the table get its columns and types
+            properties = conn.execute(f"CALL table_info('{cold_table}') RETURN name, type").get_as_df()
+            cold = alignEventTable(cold, list(zip(properties['name'], properties['type'])))
+        executeWrite(conn, f"COPY {cold_table} FROM cold") # kuzu scans the arrow table of the variable 'cold'
+    elif storage == 'parquet':
+        import os
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if os.path.exists(fileName):
+            cold = pa.concat_tables([pq.read_table(fileName), cold], promote_options='default')
+        pq.write_table(cold, fileName)
+    else:
+        raise ValueError(f"unknown event partitioning {storage}, use 'table' or 'parquet'")
+    return len(cold)
+
+def loadEventAttributes(conn, storage, idx=None, columns=None, fileName=None):
+    # cold attributes (all or the given columns) of the events with the given idx values (all events if idx is None)
+    # as pandas DataFrame with column idx, read from the node table cold_table or the Parquet file fileName, e.g.,
+    # loadEventAttributes(conn, 'table', [17, 42], ['OfferedAmount', 'CreditScore'])
+    # within a query, the node table is matched by idx, e.g., MATCH (e:Event) MATCH (a:EventAttributes {idx: e.idx}) RETURN a.CreditScore
+    if storage == 'parquet':
+        import pyarrow.parquet as pq
+
+        filters = [('idx', 'in', list(idx))] if idx is not None else None
+        return pq.read_table(fileName, columns=['idx'] + list(columns) if columns is not None else None, filters=filters).to_pandas()
+
+    if columns is None:
+        columns = [col for col in conn.execute(f"CALL table_info('{cold_table}') RETURN name").get_as_df()['name'] if col != 'idx']
+    returns = ", ".join(f"a.{col} AS {col}" for col in ['idx'] + list(columns))
+    if idx is None:
+        return conn.execute(f"MATCH (a:{cold_table}) RETURN {returns}").get_as_df()
+    return conn.execute(f"MATCH (a:{cold_table}) WHERE a.idx IN $idx RETURN {returns}", {"idx": list(idx)}).get_as_df()
+
+# event classes encoded as integers: each event gets a class code per classifier when it is imported (addClassCodes), the
+# dictionary node table class_table maps the codes to the classes, so that :Class nodes and :OBSERVED relationships are
+# built from the codes (queries_build_dfg[_typed].createEventClassFromCodes) and queries can filter events by an integer code
+# instead of comparing strings, e.g., MATCH (e:Event {ActivityClass: 3})
+# classifiers: the event properties whose values form the class of an event (class ID: the values joined by '+')
+classifiers = {'Activity': ['Activity'], 'Activity+Lifecycle': ['Activity', 'lifecycle'], 'Resource': ['resource']}
+class_code_columns = {'Activity': 'ActivityClass', 'Activity+Lifecycle': 'ActivityLifecycleClass', 'Resource': 'ResourceClass'}
+class_table = 'ClassCode'
+
+def addClassCodes(events, dictionary=None):
+    # events (arrow table) with a column of class codes (INT32) for each classifier whose properties the events have, events
+    # with a missing value of these properties have no class code; dictionary (pandas DataFrame with Type, Code and ID,
+    # see getClassCodes) holds the codes of the classes known already, e.g., of the events of the graph to append to
+    # returns the events and the dictionary entries of the classes that are not in dictionary (to store with storeClassCodes)
+    import pandas as pd
+    import pyarrow as pa
+
+    columns = {name.lower(): name for name in events.column_names}
+    entries = []
+    for classifier, properties in classifiers.items():
+        if any(p.lower() not in columns for p in properties):
+            continue
+        values = pd.DataFrame({p: events[columns[p.lower()]].to_pandas().astype(object) for p in properties})
+        present = values.notna().all(axis=1)
+        ids = values.loc[present, properties[0]].astype(str)
+        for p in properties[1:]:
+            ids = ids + '+' + values.loc[present, p].astype(str)
+
+        known = dictionary[dictionary['Type'] == classifier] if dictionary is not None else pd.DataFrame({'Code': [], 'ID': []})
+        newIDs = ids.drop_duplicates()
+        newIDs = newIDs[~newIDs.isin(known['ID'])]
+        firstCode = int(known['Code'].max()) + 1 if len(known) > 0 else 0
+        new = pd.DataFrame({'Type': classifier, 'Code': range(firstCode, firstCode + len(newIDs)),
+                            'Name': values.loc[newIDs.index, properties[0]].astype(str).to_numpy(),
+                            'Lifecycle': values.loc[newIDs.index, properties[1]].astype(str).to_numpy() if len(properties) > 1 else None,
+                            'ID': newIDs.to_numpy()})
+        entries.append(new)
+
+        codeOf = pd.concat([known.set_index('ID')['Code'], new.set_index('ID')['Code']])
+        codes = pd.Series(pd.NA, index=values.index, dtype='Int32')
+        codes[present] = ids.map(codeOf).astype('Int32')
+        events = events.append_column(class_code_columns[classifier], pa.array(codes, type=pa.int32(), from_pandas=True))
+    entries = pd.concat(entries, ignore_index=True) if entries != [] else pd.DataFrame(columns=['Type', 'Code', 'Name', 'Lifecycle', 'ID'])
+    return events, entries
+
+def storeClassCodes(conn, entries):
+    # add dictionary entries (see addClassCodes) to the node table class_table, created with the first entries
+    import pyarrow as pa
+    from stage_scheduler import executeWrite
+
+    executeWrite(conn, f"CREATE NODE TABLE IF NOT EXISTS {class_table} (Key STRING, Type STRING, Code INT32, Name STRING, Lifecycle STRING, ID STRING, PRIMARY KEY(Key))")
+
+    if len(entries) == 0:
+        return 0
+    # as arrow table with the types of the node table, Lifecycle is null for all classes of classifiers without lifecycle
+    codes = pa.table({'Key': pa.array(entries['Type'] + ':' + entries['ID'], type=pa.string()),
+                      'Type': pa.array(entries['Type'], type=pa.string()),
+                      'Code': pa.array(entries['Code'], type=pa.int32()),
+                      'Name': pa.array(entries['Name'], type=pa.string()),
+                      'Lifecycle': pa.array(entries['Lifecycle'], type=pa.string(), from_pandas=True),
+                      'ID': pa.array(entries['ID'], type=pa.string())})
+    executeWrite(conn, f"COPY {class_table} FROM codes") # kuzu scans the arrow table of the variable 'codes'
+    return len(codes)
+
+def getClassCodes(conn, classifier=None):
+    # dictionary of the class codes (pandas DataFrame with Type, Code, Name, Lifecycle and ID) of all or one classifier,
+    # None if the events have no class codes
+    tables = conn.execute("CALL show_tables() RETURN name").get_as_df()['name'].to_list()
+    if class_table not in tables:
+        return None
+    dictionary = conn.execute(f"MATCH (c:{class_table}) RETURN c.Type AS Type, c.Code AS Code, c.Name AS Name, c.Lifecycle AS Lifecycle, c.ID AS ID").get_as_df()
+    if classifier is not None:
+        dictionary = dictionary[dictionary['Type'] == classifier].reset_index(drop=True)
+    return dictionary
+
+def getClassCode(conn, classifier, name, lifecycle=None):
+    # class code of the events of a class, e.g., getClassCode(conn, 'Activity+Lifecycle', 'O_Created', 'complete') to query
+    # MATCH (e:Event {ActivityLifecycleClass: $code}), None if no event is of this class
+    ID = name if lifecycle is None else name + '+' + lifecycle
+    result = conn.execute(f"MATCH (c:{class_table} {{Key: $key}}) RETURN c.Code", {"key": classifier + ':' + ID})
+    return result.get_next()[0] if result.has_next() else None
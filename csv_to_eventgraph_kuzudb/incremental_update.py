@@ -0,0 +1,216 @@
+import kuzu
+import datetime
+import numpy as np
+import pandas as pd
+import event_schema
+from bulk_import import runQuery, getEntityMatch, antiJoin
+from stage_scheduler import executeWrite
+
+# incremental update of the DF relationships and the directly-follows graph after appending events, see ekg_builder.append
+# instead of inferring all DF relationships and aggregating all DF_C relationships again, only the DF chains of the
+# entities the appended events are correlated to are recomputed, and the DF_C counts are updated by the difference
+# the results are the same as those of infer_df_edges[_typed].py and queries_build_dfg[_typed].py on the entire graph
+
+def getDirectlyFollows(corr_sorted):
+    # DF relationships between successive events of the same entity, of the events sorted by entity, time and idx as in
+    # createDirectlyFollowsFast: columns src, tgt, ID, EntityType
+    src = corr_sorted["src"].to_numpy()
+    uID = corr_sorted["uID"].to_numpy()
+    same = uID[:-1] == uID[1:]
+    return pd.DataFrame({"src": src[:-1][same], "tgt": src[1:][same],
+                         "ID": corr_sorted["ID"].to_numpy()[:-1][same], "EntityType": corr_sorted["EntityType"].to_numpy()[:-1][same]})
+
+def getEntityEventsAfter(conn: kuzu.Connection, entity_type, typed, min_idx, uIDs, since):
+    # events before min_idx of the entities uIDs that the events from min_idx on can be inserted between: the events from timestamp
+    # since on, the events at the latest timestamp before since and the events without timestamp (sorted last), i.e., per entity a
+    # contiguous tail of its events sorted by timestamp and idx, all of it if since is None (no appended event has a timestamp)
+    columns = "n.uID AS uID, n.ID AS ID, n.EntityType AS EntityType, e.idx AS src, e.timestamp AS timestamp"
+    if since is None:
+        qTail = f'''
+            MATCH (e:Event) -[:CORR]-> {getEntityMatch(entity_type, typed)} WHERE n.uID IN $uIDs AND e.idx < $min_idx
+            RETURN {columns}'''
+        return conn.execute(qTail, {"uIDs": uIDs, "min_idx": min_idx}).get_as_df()
+    qTail = f'''
+        MATCH (e:Event) -[:CORR]-> {getEntityMatch(entity_type, typed)}
+        WHERE n.uID IN $uIDs AND e.idx < $min_idx AND (e.timestamp >= $since OR e.timestamp IS NULL)
+        RETURN {columns}'''
+    qLast = f'''
+        MATCH (e:Event) -[:CORR]-> {getEntityMatch(entity_type, typed)} WHERE n.uID IN $uIDs AND e.idx < $min_idx AND e.timestamp < $since
+        WITH n, max(e.timestamp) AS last
+        MATCH (e:Event) -[:CORR]-> (n) WHERE e.idx < $min_idx AND e.timestamp = last
+        RETURN {columns}'''
+    parameters = {"uIDs": uIDs, "min_idx": min_idx, "since": since}
+    return pd.concat([conn.execute(qTail, parameters).get_as_df(), conn.execute(qLast, parameters).get_as_df()], ignore_index=True)
+
+def updateDirectlyFollows(conn: kuzu.Connection, entity_type, typed, min_idx, parallel_entity_types=[]):
+    # DF relationships of entity_type after appending the events with idx >= min_idx: recomputes the DF chains of the entities
+    # correlated to appended events (new events may also be older than the last event of an entity) and creates/deletes
+    # the DF relationships that differ from the graph
+    # the queries only read the events of these entities from the first appended timestamp on and the event before,
+    # so that the cost depends on the appended events and not on the size of the graph (see getEntityEventsAfter)
+    # with parallel_entity_types (delete_parallel_df of a derived entity type), the DF relationships parallel to those of these
+    # entity types are not created, like directly_follows.filterParallelDirectlyFollows
+    # returns the created and the deleted DF relationships
+    start = datetime.datetime.now()
+
+    qNew = f'''
+        MATCH (e:Event) -[:CORR]-> {getEntityMatch(entity_type, typed)} WHERE e.idx >= {min_idx}
+        RETURN n.uID AS uID, n.ID AS ID, n.EntityType AS EntityType, e.idx AS src, e.timestamp AS timestamp'''
+    new = runQuery(conn, qNew).get_as_df()
+    if len(new) == 0:
+        empty = pd.DataFrame({"src": pd.Series([], dtype="int64"), "tgt": pd.Series([], dtype="int64"), "ID": pd.Series([], dtype=object)})
+        return empty, empty
+    touched = new[["uID","ID"]].drop_duplicates("uID")
+    since = new["timestamp"].min()
+    since = None if pd.isna(since) else since.to_pydatetime() if isinstance(since, pd.Timestamp) else since
+    tail = getEntityEventsAfter(conn, entity_type, typed, min_idx, touched["uID"].to_list(), since)
+    corr = pd.concat([tail, new], ignore_index=True)
+    desired = getDirectlyFollows(corr.sort_values(["uID","timestamp","src"], kind="stable", ignore_index=True))
+
+    if parallel_entity_types != [] and len(desired) > 0:
+        qParallel = f'''
+            MATCH (e1:Event) -[df:DF]-> (e2:Event) WHERE df.EntityType IN $types AND e1.idx IN $srcs
+            RETURN e1.idx AS src, e2.idx AS tgt'''
+        parallel = conn.execute(qParallel, {"types": parallel_entity_types, "srcs": desired["src"].unique().tolist()}).get_as_df()
+        desired = antiJoin(desired, parallel, ["src","tgt"])
+
+    # the DF relationships of the touched entities that may change leave the events of their tails (the ends of their chains)
+    qExisting = f'''
+        MATCH (e1:Event) -[df:DF]-> (e2:Event) WHERE df.EntityType = $entity_type AND e1.idx IN $srcs AND df.ID IN $IDs
+        RETURN e1.idx AS src, e2.idx AS tgt, df.ID AS ID'''
+    existing = conn.execute(qExisting, {"entity_type": entity_type, "srcs": tail["src"].unique().tolist(),
+                                        "IDs": touched["ID"].unique().tolist()}).get_as_df()
+    existing = existing.merge(tail[["src","ID"]].drop_duplicates(), on=["src","ID"]) # an event of a tail may be inside the chain of another entity
+
+    added = antiJoin(desired, existing, ["src","tgt","ID"])
+    removed = antiJoin(existing, desired, ["src","tgt","ID"])
+
+    recreated = added.iloc[:0]
+    if len(removed) > 0:
+        # deleted as a set instead of matching each relationship (UNWIND), which is slow: all DF relationships of the
+        # removed entities from the source events of the removed relationships, the ones that remain are created again
+        qRemovedDF = f'''
+            MATCH (e1:Event) -[df:DF]-> (e2:Event) WHERE df.EntityType = $entity_type AND e1.idx IN $srcs AND df.ID IN $IDs
+            '''
+        parameters = {"entity_type": entity_type, "srcs": removed["src"].unique().tolist(), "IDs": removed["ID"].unique().tolist()}
+        deleted = conn.execute(qRemovedDF + "RETURN e1.idx AS src, e2.idx AS tgt, df.ID AS ID", parameters).get_as_df()
+        executeWrite(conn, qRemovedDF + "DELETE df", parameters)
+        recreated = antiJoin(deleted, removed, ["src","tgt","ID"]).assign(EntityType=entity_type)
+    df = pd.concat([added, recreated], ignore_index=True)[["src","tgt","ID","EntityType"]]
+    executeWrite(conn, "COPY DF FROM df")
+
+    end = datetime.datetime.now()
+    print(f'{entity_type}: {len(touched)} entities, {len(added)} DF relationships created, {len(removed)} deleted in {end-start}')
+    return added[["src","tgt","ID"]], removed
+
+def updateEventClasses(conn: kuzu.Connection, classifier, min_idx):
+    # :Class nodes and :OBSERVED relationships of the appended events, like createEventClass_Activity[ANDLifeCycle] or, if the events
+    # have class codes, createEventClassFromCodes
+    # returns the number of created classes and OBSERVED relationships
+    start = datetime.datetime.now()
+
+    lifecycle = classifier == "Activity+Lifecycle"
+    dictionary = event_schema.getClassCodes(conn, classifier)
+    if dictionary is not None: # the classes of the class codes of the events, see queries_build_dfg.createEventClassFromCodes
+        code = event_schema.class_code_columns[classifier]
+        qEvents = f"MATCH (e:Event) WHERE e.idx >= {min_idx} AND e.{code} IS NOT NULL RETURN e.idx AS idx, e.{code} AS Code"
+        events = runQuery(conn, qEvents).get_as_df().merge(dictionary[["Code","Name","Lifecycle","ID"]], on="Code")
+    else:
+        qEvents = f"MATCH (e:Event) WHERE e.idx >= {min_idx} RETURN e.idx AS idx, e.Activity AS Name{', e.lifecycle AS Lifecycle' if lifecycle else ''}"
+        events = runQuery(conn, qEvents).get_as_df().dropna()
+        if lifecycle:
+            events["ID"] = events["Name"] + "+" + events["Lifecycle"]
+        else:
+            events["Lifecycle"] = pd.Series([None]*len(events), index=events.index, dtype=object)
+            events["ID"] = events["Name"]
+
+    # columns in the order of the node table: Name, Lifecycle, Type, ID
+    classes = events[["Name","Lifecycle","ID"]].drop_duplicates("ID")
+    classes = classes[~classes["ID"].isin(runQuery(conn, "MATCH (c:Class) RETURN c.ID AS ID").get_as_df()["ID"])]
+    classes.insert(2, "Type", classifier)
+    executeWrite(conn, "COPY Class FROM classes")
+
+    observed = events[["idx","ID"]]
+    executeWrite(conn, "COPY OBSERVED FROM observed")
+
+    end = datetime.datetime.now()
+    print(f'{len(classes)} Class nodes, {len(observed)} OBSERVED relationships in {end-start}')
+    return len(classes), len(observed)
+
+def updateDFrelations(conn: kuzu.Connection, entity_type, classifier, typed, min_idx, added, removed, new_uIDs=[]):
+    # DF_C relationships of entity_type after updateDirectlyFollows, by the difference of the counts of aggregateDFrelations:
+    # the query counts each DF relationship once per entity of entity_type both events are correlated to
+    # the count of a DF relationship changes if it is created or deleted, or if one of its (existing) events got correlated
+    # to a new entity of entity_type, i.e., a derived entity in new_uIDs
+    # returns the number of created, updated and deleted DF_C relationships
+    start = datetime.datetime.now()
+
+    # the queries only read the relationships of the events of the changed DF relationships, as updateDirectlyFollows
+    edges = [added.assign(sign=1), removed.assign(sign=-1)]
+    if len(new_uIDs) > 0:
+        qAffected = f'''
+            MATCH (e:Event) -[:CORR]-> {getEntityMatch(entity_type, typed)} WHERE n.uID IN $uIDs AND e.idx < $min_idx
+            RETURN DISTINCT e.idx AS idx'''
+        affected = conn.execute(qAffected, {"uIDs": list(new_uIDs), "min_idx": min_idx}).get_as_df()["idx"].tolist()
+        if len(affected) > 0:
+            qKept = f'''
+                MATCH (e1:Event) -[df:DF]-> (e2:Event) WHERE df.EntityType = $entity_type AND (e1.idx IN $idxs OR e2.idx IN $idxs)
+                RETURN e1.idx AS src, e2.idx AS tgt, df.ID AS ID'''
+            kept = conn.execute(qKept, {"entity_type": entity_type, "idxs": affected}).get_as_df()
+            edges.append(antiJoin(kept, added, ["src","tgt","ID"]).assign(sign=0))
+    edges = pd.concat(edges, ignore_index=True)
+    if len(edges) == 0:
+        return 0, 0, 0
+    edges["edge"] = np.arange(len(edges))
+    idxs = pd.concat([edges["src"], edges["tgt"]]).unique().tolist()
+    qCorr = f"MATCH (e:Event) -[:CORR]-> {getEntityMatch(entity_type, typed)} WHERE e.idx IN $idxs RETURN e.idx AS idx, n.uID AS uID"
+    corr = conn.execute(qCorr, {"idxs": idxs}).get_as_df()
+
+    # entities of entity_type shared by source and target event: count in the updated graph and without the new entities
+    shared = edges[["edge","src","tgt"]].merge(corr, left_on="src", right_on="idx").merge(corr, left_on=["tgt","uID"], right_on=["idx","uID"])
+    shared["old"] = ~shared["uID"].isin(new_uIDs)
+    counts = shared.groupby("edge").agg(new=("uID","size"), old=("old","sum"))
+    edges = edges.merge(counts, left_on="edge", right_index=True, how="left").fillna({"new": 0, "old": 0})
+    # created relationships count in the updated graph, deleted ones counted in the graph before, others by the difference
+    edges["delta"] = np.where(edges["sign"] == 1, edges["new"], np.where(edges["sign"] == -1, -edges["old"], edges["new"] - edges["old"]))
+
+    dictionary = event_schema.getClassCodes(conn, classifier)
+    if dictionary is not None: # the classes of the events by their class codes, as queries_build_dfg.aggregateDFrelationsFromCodes
+        code = event_schema.class_code_columns[classifier]
+        qClasses = f"MATCH (e:Event) WHERE e.idx IN $idxs AND e.{code} IS NOT NULL RETURN e.idx AS idx, e.{code} AS Code"
+        classes = conn.execute(qClasses, {"idxs": idxs}).get_as_df().merge(dictionary[["Code","ID"]], on="Code")[["idx","ID"]]
+    else:
+        qClasses = f"MATCH (e:Event) -[:OBSERVED]-> (c:Class) WHERE c.Type = $classifier AND e.idx IN $idxs RETURN e.idx AS idx, c.ID AS ID"
+        classes = conn.execute(qClasses, {"classifier": classifier, "idxs": idxs}).get_as_df()
+    edges = edges.merge(classes.rename(columns={"idx": "src", "ID": "c1"}), on="src").merge(classes.rename(columns={"idx": "tgt", "ID": "c2"}), on="tgt")
+    delta = edges.groupby(["c1","c2"], as_index=False)["delta"].sum()
+    delta = delta[delta["delta"] != 0]
+
+    qDFC = f"MATCH (c1:Class) -[d:DF_C]-> (c2:Class) WHERE d.EntityType = $entity_type RETURN c1.ID AS c1, c2.ID AS c2, d.count AS count"
+    dfc = conn.execute(qDFC, {"entity_type": entity_type}).get_as_df()
+    delta = delta.merge(dfc, on=["c1","c2"], how="left")
+    exists = delta["count"].notna()
+    delta["count"] = delta["count"].fillna(0) + delta["delta"]
+
+    updated = delta[exists & (delta["count"] > 0)]
+    if len(updated) > 0:
+        qUpdate = f'''
+            UNWIND $rows AS r
+            MATCH (c1:Class {{ID: r.c1}}) -[d:DF_C]-> (c2:Class {{ID: r.c2}}) WHERE d.EntityType = $entity_type
+            SET d.count = r.count'''
+        rows = [{"c1": r.c1, "c2": r.c2, "count": int(r.count)} for r in updated.itertuples()]
+        executeWrite(conn, qUpdate, {"rows": rows, "entity_type": entity_type})
+    deleted = delta[exists & (delta["count"] <= 0)]
+    if len(deleted) > 0:
+        qDelete = f'''
+            UNWIND $rows AS r
+            MATCH (c1:Class {{ID: r.c1}}) -[d:DF_C]-> (c2:Class {{ID: r.c2}}) WHERE d.EntityType = $entity_type
+            DELETE d'''
+        executeWrite(conn, qDelete, {"rows": deleted[["c1","c2"]].to_dict("records"), "entity_type": entity_type})
+    created = delta[~exists & (delta["count"] > 0)]
+    df_c = pd.DataFrame({"c1": created["c1"], "c2": created["c2"], "EntityType": entity_type, "count": created["count"].astype("int32")})
+    executeWrite(conn, "COPY DF_C FROM df_c")
+
+    end = datetime.datetime.now()
+    print(f'{entity_type}: {len(created)} DF_C relationships created, {len(updated)} updated, {len(deleted)} deleted in {end-start}')
+    return len(created), len(updated), len(deleted)
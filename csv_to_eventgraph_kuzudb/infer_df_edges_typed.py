@@ -2,13 +2,17 @@ import kuzu
 import datetime
 import pandas as df
 import numpy as np
+from bulk_import import getEntityKey
+from stage_scheduler import executeWrite
+import directly_follows
+from directly_follows import computeDirectlyFollows, filterParallelDirectlyFollows, getDirectlyFollowsPairs
 
-def runQuery(conn: kuzu.Connection, query: str) -> kuzu.QueryResult:
+def runQuery(conn: kuzu.Connection, query: str, write=False) -> kuzu.QueryResult:
 
     start = datetime.datetime.now()
     # print()
     # print(query)
-    response = conn.execute(query)
+    response = executeWrite(conn, query) if write else conn.execute(query)
     end = datetime.datetime.now()
     print(str(end-start))
 
@@ -21,19 +25,80 @@ def getEntityTypes(conn: kuzu.Connection):
     et_df = runQuery(conn, qGetEntityTypes).get_as_df()
     return et_df["label"].to_list()
 
-def createDirectlyFollowsFast(conn: kuzu.Connection, entity_type):
+def getDirectlyFollowsArrow(conn: kuzu.Connection, entity_type, workers=1):
+    # DF relationships of an entity type as arrow table (src, tgt, ID, EntityType), see computeDirectlyFollows
+    key = getEntityKey(conn, entity_type)
+    qEntityEvents = f'''
+        MATCH ( n : {entity_type} )
+        MATCH ( n ) <-[:CORR]- ( e : Event )
+        RETURN n.EntityType AS EntityType, n.{key} AS key, n.ID AS ID, e.idx AS src, e.timestamp AS timestamp
+        '''
+    return computeDirectlyFollows(runQuery(conn, qEntityEvents).get_as_arrow(), workers)
+
+def getDirectlyFollowsAllArrow(conn: kuzu.Connection, workers=1):
+    # DF relationships of all entity types as arrow table (src, tgt, ID, EntityType) from one scan of the CORR relationship
+    # group (all entity types) instead of one scan per entity type, see computeDirectlyFollows
+    # the integer keys of different node tables may be equal: computeDirectlyFollows tells entities apart by type and key
+    key = "key" if all(getEntityKey(conn, table) == "key" for table in getCorrTables(conn)) else "uID"
+    qEntityEvents = f'''
+        MATCH ( e : Event ) -[:CORR]-> ( n )
+        RETURN n.EntityType AS EntityType, n.{key} AS key, n.ID AS ID, e.idx AS src, e.timestamp AS timestamp
+        '''
+    return computeDirectlyFollows(runQuery(conn, qEntityEvents).get_as_arrow(), workers)
+
+def getCorrTables(conn: kuzu.Connection):
+    # entity node tables of the CORR relationship group
+    connections = conn.execute("CALL show_connection('CORR') RETURN *").get_as_df()
+    return connections["destination table name"].unique().tolist()
+
+def createDirectlyFollowsAll(conn: kuzu.Connection, parallel_entity_types={}, workers=1):
+    # DF relationships of all entity types with one scan and one COPY, without those of derived entity types parallel to the
+    # DF relationships of their original entity types (parallel_entity_types, see filterParallelDirectlyFollows), returns the
+    # number of DF relationships per entity type (workers: see computeDirectlyFollows)
+    import pyarrow.compute as pc
+
+    start = datetime.datetime.now()
+
+    df = filterParallelDirectlyFollows(getDirectlyFollowsAllArrow(conn, workers), parallel_entity_types)
+    executeWrite(conn, "COPY DF FROM df") # kuzu scans the arrow table of the variable 'df'
+    counts = {count["values"]: count["counts"] for count in pc.value_counts(df["EntityType"]).to_pylist()}
+    end = datetime.datetime.now()
+    print(f'{len(df)} DF relationships of {len(counts)} entity types in {end-start}')
+    return counts
+
+def createDirectlyFollowsFast(conn: kuzu.Connection, entity_type, parallel_entity_types=[], workers=1):
+    # DF relationships of one entity type, without those parallel to the DF relationships of parallel_entity_types already
+    # in the graph (the original entity types of a derived entity type)
+
+    start = datetime.datetime.now()
+
+    # import edges directly into DF table
+    df = getDirectlyFollowsArrow(conn, entity_type, workers)
+    if parallel_entity_types:
+        df = filterParallelDirectlyFollows(df, {entity_type: parallel_entity_types}, getDirectlyFollowsPairs(conn, parallel_entity_types))
+    executeWrite(conn, "COPY DF FROM df") # kuzu scans the arrow table of the variable 'df'
+    end = datetime.datetime.now()
+    print(str(end-start))
+
+def getDirectlyFollowsPandas(conn: kuzu.Connection, entity_type):
+    # DF relationships of an entity type computed with pandas (the previous kernel of createDirectlyFollowsFast), as
+    # reference for getDirectlyFollowsArrow in benchmarkDirectlyFollows
 
     start = datetime.datetime.now()
 
     # query for all events correlated to an entity, ordered by time
-    # uID,ID,type of entity + idx of event which will be the source event for the DF edge
+    # key (integer key, or uID for entity node tables without integer keys),ID,type of entity + idx of event which will be the source event for the DF edge
+    key = getEntityKey(conn, entity_type)
     qEntityEventsOrdered = f'''
         MATCH ( n : {entity_type} )
         MATCH ( n ) <-[:CORR]- ( e : Event )
-        RETURN n.uID AS uID, n.ID AS ID, n.EntityType AS EntityType, e.idx AS src ORDER BY n.uID, e.timestamp ASC, e.idx ASC
+        RETURN n.{key} AS uID, n.ID AS ID, n.EntityType AS EntityType, e.idx AS src, e.timestamp AS timestamp
         '''
     result = runQuery(conn, qEntityEventsOrdered)
-    corr_sorted = result.get_as_df()
+    # sorted here instead of ORDER BY n.uID, e.timestamp, e.idx: on large results, kuzu returns the rows of this
+    # ORDER BY (string key before timestamp) only sorted in runs, which breaks the DF chains of entities with many events
+    # the column uID holds the key of the entity, with integer keys the sort compares integers instead of strings
+    corr_sorted = result.get_as_df().sort_values(["uID","timestamp","src"], kind="stable", ignore_index=True)
 
     #print(corr_sorted)
 
@@ -71,10 +136,9 @@ def createDirectlyFollowsFast(conn: kuzu.Connection, entity_type):
     df.drop(['uID','uID_tgt'], axis=1, inplace=True)
     #print(df)
 
-    # import edges directly into DF table
-    conn.execute("COPY DF FROM df")
     end = datetime.datetime.now()
     print(str(end-start))
+    return df
 
 def getDerivedEntityTypes(conn: kuzu.Connection):
     qGetDerivedEntityTypes = f'''
@@ -87,39 +151,45 @@ def getDerivedEntityTypes(conn: kuzu.Connection):
         et_pairs.append(res.get_next())
     return et_pairs
 
-
-def deleteParallelDirectlyFollows_Derived(conn: kuzu.Connection, derived_entity_type, original_entity_type):
-    qDeleteDF = f'''
-        MATCH (e1:Event) -[df:DF {{EntityType: "{derived_entity_type}" }}]-> (e2:Event)
-        WHERE (e1:Event) -[:DF {{EntityType: "{original_entity_type}" }}]-> (e2:Event)
-        DELETE df'''
-    runQuery(conn, qDeleteDF)
-
-def infer_df(conn: kuzu.Connection, delete_parallel_df: bool = True):
+def infer_df(conn: kuzu.Connection, delete_parallel_df: bool = True, single_pass: bool = False, workers: int = 1, batch_size: int = None):
+    # with single_pass, the DF relationships of all entity types are inferred from one scan of the CORR relationships
+    # (createDirectlyFollowsAll), else with one query per entity type (createDirectlyFollowsFast); with workers > 1, the DF
+    # relationships of large results are computed by a pool of worker processes (directly_follows.computeDirectlyFollowsParallel)
+    # with batch_size, the DF relationships of each entity type are inferred from batches of at most about batch_size CORR
+    # rows for graphs that do not fit in memory (directly_follows.createDirectlyFollowsStreaming)
+    # single_pass is off by default, as single_pass_df in ekg_builder.py: its scan holds the CORR rows of all entity types in memory
 
     print("Removing DF from DB")
-    runQuery(conn, "DROP TABLE IF EXISTS DF")
+    runQuery(conn, "DROP TABLE IF EXISTS DF", write=True)
 
     # infer directly-follows
     print("Inferring DF")
-    runQuery(conn, "CREATE REL TABLE DF (FROM Event TO Event, ID STRING, EntityType STRING)")
+    runQuery(conn, "CREATE REL TABLE DF (FROM Event TO Event, ID STRING, EntityType STRING)", write=True)
 
 
-    entities = getEntityTypes(conn)
-    for entity in entities:
-        createDirectlyFollowsFast(conn, entity)
-        print(f'{entity} df done')
+    # DF relationships of derived entities parallel to those of their contributing entities are left out before the COPY
+    parallel = {}
+    if delete_parallel_df:
+        for et_derived_pair in getDerivedEntityTypes(conn): #for each derived entity and one of its contributing entities
+            parallel.setdefault(et_derived_pair[0], []).append(et_derived_pair[1])
+
+    if single_pass and batch_size is None:
+        for entity, count in createDirectlyFollowsAll(conn, parallel, workers).items():
+            print(f'{entity} df done: {count}')
+    else:
+        # entities before derived entities, whose parallel DF relationships are filtered against those in the graph
+        entities = sorted(getEntityTypes(conn), key=lambda entity: entity in parallel)
+        for entity in entities:
+            if batch_size is not None:
+                print(f'{entity} df done: {directly_follows.createDirectlyFollowsStreaming(conn, entity, True, parallel.get(entity, []), batch_size)}')
+            else:
+                createDirectlyFollowsFast(conn, entity, parallel.get(entity, []), workers)
+                print(f'{entity} df done')
 
     res = runQuery(conn, "MATCH ()-[df:DF]->() RETURN count(df)")
     while res.has_next():
         print(res.get_next())
 
-    # delete parallel DF relations of derived entities
-    if delete_parallel_df:
-        et_derived_pairs = getDerivedEntityTypes(conn)
-        for et_derived_pair in et_derived_pairs: #for each derived entity and one of its contributing entities
-
-            # delete df relations of derived entity when in parallel with  contributing entity
-            deleteParallelDirectlyFollows_Derived(conn, et_derived_pair[0], et_derived_pair[1])
-            print(f'{et_derived_pair[0]} cleaned df wrt. {et_derived_pair[1]}')
-
+if __name__ == "__main__":
+    # benchmarks of the DF kernels on the graph built by bpic17_import_csv_to_kuzu_db_typed.py, see directly_follows.main
+    directly_follows.main(True, "./db_bpic17_ekg_typed")
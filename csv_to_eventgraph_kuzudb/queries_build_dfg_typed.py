@@ -1,30 +1,63 @@
 import kuzu
 import datetime
+import pandas as pd
+import event_schema
+from stage_scheduler import executeWrite
 
 
-def runQuery(conn: kuzu.Connection, query: str) -> kuzu.QueryResult:
+def runQuery(conn: kuzu.Connection, query: str, write=False) -> kuzu.QueryResult:
 
     start = datetime.datetime.now()
 #     print()
 #     print(query)
-    response = conn.execute(query)
+    response = executeWrite(conn, query) if write else conn.execute(query)
     end = datetime.datetime.now()
     print(str(end-start))
 
     return response
 
+def createEventClass_Activity(conn: kuzu.Connection):
+    qCreateEC = f'''
+        MATCH ( e : Event ) WITH distinct e.Activity AS actName
+        MERGE ( c : Class {{ Name:actName, Type:"Activity", ID: actName}})'''
+    runQuery(conn, qCreateEC, write=True)
+
+    qLinkEventToClass = f'''
+        MATCH ( c : Class ) WHERE c.Type = "Activity"
+        MATCH ( e : Event ) WHERE c.Name = e.Activity
+        CREATE ( e ) -[:OBSERVED]-> ( c )'''
+    runQuery(conn, qLinkEventToClass, write=True)
+
 def createEventClass_ActivityANDLifeCycle(conn: kuzu.Connection):
     qCreateEC = f'''
         MATCH ( e : Event ) WITH distinct e.Activity AS actName,e.lifecycle AS lifecycle
         MERGE ( c : Class {{ Name:actName, Lifecycle:lifecycle, Type:"Activity+Lifecycle", ID: actName+"+"+lifecycle}})'''
-    runQuery(conn, qCreateEC)
+    runQuery(conn, qCreateEC, write=True)
         
     qLinkEventToClass = f'''
         MATCH ( c : Class ) WHERE c.Type = "Activity+Lifecycle"    
         MATCH ( e : Event ) where e.Activity = c.Name AND e.lifecycle = c.Lifecycle
         CREATE ( e ) -[:OBSERVED]-> ( c )'''
-    runQuery(conn, qLinkEventToClass)
+    runQuery(conn, qLinkEventToClass, write=True)
     
+def createEventClassFromCodes(conn: kuzu.Connection, classifier):
+    # Class nodes and OBSERVED relationships of a classifier from the class codes the events got when they were imported
+    # (see event_schema.addClassCodes), each with one COPY instead of joining all events with all classes by their names,
+    # same classes and relationships as createEventClass_Activity and createEventClass_ActivityANDLifeCycle
+    start = datetime.datetime.now()
+
+    dictionary = event_schema.getClassCodes(conn, classifier)
+    classes = dictionary[["Name","Lifecycle","Type","ID"]] # columns in the order of the node table
+    executeWrite(conn, "COPY Class FROM classes")
+
+    qEventCodes = f"MATCH ( e : Event ) WHERE e.{event_schema.class_code_columns[classifier]} IS NOT NULL RETURN e.idx AS idx, e.{event_schema.class_code_columns[classifier]} AS Code"
+    observed = runQuery(conn, qEventCodes).get_as_df()
+    observed = observed.merge(dictionary[["Code","ID"]], on="Code")[["idx","ID"]]
+    executeWrite(conn, "COPY OBSERVED FROM observed")
+
+    end = datetime.datetime.now()
+    print(f'{len(classes)} Class nodes, {len(observed)} OBSERVED relationships from class codes in {end-start}')
+
 def aggregateDFrelations(conn: kuzu.Connection, entity_type, event_cl):
     # aggregate only for a specific entity type and event classifier
     qCreateDFC = f'''
@@ -33,8 +66,29 @@ def aggregateDFrelations(conn: kuzu.Connection, entity_type, event_cl):
         WHERE n.EntityType = "{entity_type}" AND df.EntityType = "{entity_type}" AND c1.Type = "{event_cl}" AND c2.Type="{event_cl}"
         WITH n.EntityType as EType,c1,count(df) AS df_freq,c2
         MERGE ( c1 ) -[rel2:DF_C {{EntityType:EType}}]-> ( c2 ) ON CREATE SET rel2.count=df_freq'''
-    runQuery(conn, qCreateDFC)
+    runQuery(conn, qCreateDFC, write=True)
     
+def aggregateDFrelationsFromCodes(conn: kuzu.Connection, entity_type, classifier):
+    # DF_C relationships of an entity type as aggregateDFrelations, for events with class codes (see createEventClassFromCodes):
+    # the DF relationships are counted by the integer class codes of their events instead of joining the events with the
+    # :Class nodes by their string IDs, the counts are copied with one COPY
+    start = datetime.datetime.now()
+
+    code = event_schema.class_code_columns[classifier]
+    qCountDF = f'''
+        MATCH ( e1 : Event ) -[df:DF]-> ( e2 : Event )
+        MATCH (e1) -[:CORR] -> (n : {entity_type}) <-[:CORR]- (e2)
+        WHERE df.EntityType = $entity_type AND e1.{code} IS NOT NULL AND e2.{code} IS NOT NULL
+        RETURN e1.{code} AS Code1, e2.{code} AS Code2, count(df) AS count'''
+    counts = conn.execute(qCountDF, {"entity_type": entity_type}).get_as_df()
+    dictionary = event_schema.getClassCodes(conn, classifier)[["Code","ID"]]
+    counts = counts.merge(dictionary.rename(columns={"Code": "Code1", "ID": "c1"}), on="Code1").merge(dictionary.rename(columns={"Code": "Code2", "ID": "c2"}), on="Code2")
+    df_c = pd.DataFrame({"c1": counts["c1"], "c2": counts["c2"], "EntityType": entity_type, "count": counts["count"].astype("int32")})
+    executeWrite(conn, "COPY DF_C FROM df_c")
+
+    end = datetime.datetime.now()
+    print(f'{len(df_c)} DF_C relationships of {entity_type} from class codes in {end-start}')
+
 def aggregateDFrelationsFiltering(conn: kuzu.Connection, entity_type, event_cl, df_threshold, relative_df_threshold):
     # aggregate only for a specific entity type and event classifier
     # include only edges with a minimum threshold, drop weak edges (similar to heuristics miner)
@@ -48,15 +102,15 @@ def aggregateDFrelationsFiltering(conn: kuzu.Connection, entity_type, event_cl,
         WITH EntityType as EType,c1,df_freq,count(df2) AS df_freq2,c2
         WHERE (df_freq*{relative_df_threshold} > df_freq2)
         MERGE ( c1 ) -[rel2:DF_C  {{EntityType:EType}}]-> ( c2 ) ON CREATE SET rel2.count=df_freq'''
-    runQuery(conn, qCreateDFC)
+    runQuery(conn, qCreateDFC, write=True)
     
 def prepareDFGtables(conn: kuzu.Connection):
     print("Removing DFG from DB")
-    runQuery(conn, "DROP TABLE IF EXISTS OBSERVED")
-    runQuery(conn, "DROP TABLE IF EXISTS DF_C")
-    runQuery(conn, "DROP TABLE IF EXISTS Class")
+    runQuery(conn, "DROP TABLE IF EXISTS OBSERVED", write=True)
+    runQuery(conn, "DROP TABLE IF EXISTS DF_C", write=True)
+    runQuery(conn, "DROP TABLE IF EXISTS Class", write=True)
 
     print("Creating tables")
-    runQuery(conn, "CREATE NODE TABLE Class (Name STRING, Lifecycle STRING, Type STRING, ID STRING, PRIMARY KEY(ID))")
-    runQuery(conn, "CREATE REL TABLE OBSERVED (FROM Event TO Class)")
-    runQuery(conn, "CREATE REL TABLE DF_C (FROM Class TO Class, EntityType STRING, count INT32)")
+    runQuery(conn, "CREATE NODE TABLE Class (Name STRING, Lifecycle STRING, Type STRING, ID STRING, PRIMARY KEY(ID))", write=True)
+    runQuery(conn, "CREATE REL TABLE OBSERVED (FROM Event TO Class)", write=True)
+    runQuery(conn, "CREATE REL TABLE DF_C (FROM Class TO Class, EntityType STRING, count INT32)", write=True)
@@ -0,0 +1,154 @@
+import kuzu
+import threading, time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# runs the stages of ekg_builder.build as a dependency graph: every stage whose dependencies completed runs in a pool of worker
+# threads, so that stages that only depend on completed stages (e.g., the entities of different entity types, the DF
+# relationships of different entity types) read and compute their tables concurrently
+# kuzu allows one write transaction at a time and a write (e.g., COPY) waits for all open read transactions before it
+# checkpoints: each stage queries through a StageConnection, which runs reads on the connection of its worker under a shared
+# lock and all writes on the connection of the single writer under an exclusive lock, one write at a time
+# the stages and the functions they call declare their writes: every statement that changes the database (CREATE, MERGE, SET,
+# DELETE, COPY, DROP, ALTER, a CALL of a procedure that writes, ...) runs with executeWrite(conn, ...), all others with conn.execute
+
+def executeWrite(conn, query, parameters=None):
+    # run a statement that changes the database: on the writer of a StageConnection, directly on a kuzu.Connection
+    if isinstance(conn, StageConnection):
+        return conn.write(query, parameters)
+    return conn.execute(query, parameters)
+
+class ReadWriteLock:
+    # any number of readers or one writer, a waiting writer blocks new readers so that writes are not starved by reads
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.readers = 0
+        self.writing = False
+        self.waitingWriters = 0
+
+    def acquireRead(self):
+        with self.condition:
+            while self.writing or self.waitingWriters > 0:
+                self.condition.wait()
+            self.readers = self.readers + 1
+
+    def releaseRead(self):
+        with self.condition:
+            self.readers = self.readers - 1
+            self.condition.notify_all()
+
+    def acquireWrite(self):
+        with self.condition:
+            self.waitingWriters = self.waitingWriters + 1
+            while self.writing or self.readers > 0:
+                self.condition.wait()
+            self.waitingWriters = self.waitingWriters - 1
+            self.writing = True
+
+    def releaseWrite(self):
+        with self.condition:
+            self.writing = False
+            self.condition.notify_all()
+
+class StageConnection:
+    # the connection a stage gets in place of a kuzu.Connection: reads on the connection of the worker, writes serialized on
+    # the connection of the writer; measures the seconds of the stage spent in reads, in writes and waiting for the writer
+    # COPY <table> FROM <variable> still finds the variable of the calling function, kuzu searches all calling frames
+    def __init__(self, reader: kuzu.Connection, writer: kuzu.Connection, lock: ReadWriteLock):
+        self.reader = reader
+        self.writer = writer
+        self.lock = lock
+        self.resetTimes()
+
+    def resetTimes(self):
+        self.times = {'read_seconds': 0.0, 'write_seconds': 0.0, 'write_wait_seconds': 0.0}
+
+    def write(self, query, parameters=None):
+        # a statement that changes the database, see executeWrite
+        waitStart = time.time()
+        self.lock.acquireWrite()
+        writeStart = time.time()
+        self.times['write_wait_seconds'] += writeStart - waitStart
+        try:
+            return self.writer.execute(query, parameters)
+        finally:
+            self.lock.releaseWrite()
+            self.times['write_seconds'] += time.time() - writeStart
+
+    def execute(self, query, parameters=None):
+        # a statement that only reads
+        self.lock.acquireRead()
+        readStart = time.time()
+        try:
+            return self.reader.execute(query, parameters)
+        finally:
+            self.lock.releaseRead()
+            self.times['read_seconds'] += time.time() - readStart
+
+def runStages(db: kuzu.Database, stages, runStage, workers=4):
+    # run runStage(conn, stage) for the stages (dicts with 'ID' and 'deps', the IDs of the stages to complete before; stages
+    # not in the list are completed already) in up to 'workers' threads, each stage as soon as its dependencies completed
+    # returns the result of runStage and the timing of each stage by ID: start and end (seconds since the start of the first
+    # stage) and the seconds spent in reads, in writes and waiting for the writer
+    # if a stage fails, no further stages start, the running stages complete and the exception of the stage is raised
+    lock = ReadWriteLock()
+    writer = kuzu.Connection(db)
+    workerConnections = threading.local()
+    readers = [] # connections of the workers, closed with the writer when all stages completed
+    startAll = time.time()
+
+    def runTimed(stage):
+        if not hasattr(workerConnections, 'conn'):
+            workerConnections.conn = StageConnection(kuzu.Connection(db), writer, lock)
+            readers.append(workerConnections.conn.reader)
+        conn = workerConnections.conn
+        conn.resetTimes()
+        start = time.time() - startAll
+        result = runStage(conn, stage)
+        return result, {'start': round(start, 3), 'end': round(time.time() - startAll, 3), **{key: round(value, 3) for key, value in conn.times.items()}}
+
+    stageIDs = set(stage['ID'] for stage in stages)
+    pending = list(stages)
+    running = {}
+    results = {}
+    failure = None
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while (pending != [] and failure is None) or running != {}:
+            if failure is None:
+                ready = [stage for stage in pending if all(dep in results or dep not in stageIDs for dep in stage['deps'])]
+                for stage in ready:
+                    running[executor.submit(runTimed, stage)] = stage['ID']
+                    pending.remove(stage)
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stageID = running.pop(future)
+                if future.exception() is not None:
+                    failure = failure or future.exception()
+                else:
+                    results[stageID] = future.result()
+    for conn in readers + [writer]:
+        conn.close()
+    if failure is not None:
+        raise failure
+    return results
+
+def getCriticalPath(stages, timing):
+    # longest chain of dependent stages by the seconds they worked (without waiting for the writer): the least time the stages
+    # need with any number of workers, and the stages to speed up to shorten the build
+    finish = {}
+    previous = {}
+    for stage in stages: # in an order in which every stage follows its dependencies
+        if stage['ID'] not in timing:
+            continue
+        deps = [dep for dep in stage['deps'] if dep in finish]
+        previous[stage['ID']] = max(deps, key=lambda dep: finish[dep]) if deps != [] else None
+        seconds = timing[stage['ID']]['end'] - timing[stage['ID']]['start'] - timing[stage['ID']]['write_wait_seconds']
+        finish[stage['ID']] = (finish[previous[stage['ID']]] if previous[stage['ID']] is not None else 0) + seconds
+    if finish == {}:
+        return {'seconds': 0, 'stages': []}
+    stageID = max(finish, key=lambda ID: finish[ID])
+    seconds = finish[stageID]
+    path = []
+    while stageID is not None:
+        path.insert(0, stageID)
+        stageID = previous[stageID]
+    return {'seconds': round(seconds, 3), 'stages': path}
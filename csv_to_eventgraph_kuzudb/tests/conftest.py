@@ -0,0 +1,10 @@
+import os, sys
+import pandas as pd
+
+# the modules of csv_to_eventgraph_kuzudb import each other by name, as when running the scripts from their directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# kuzu 0.11 scans text columns of pandas data frames (COPY ... FROM <variable>) only with the NumPy object dtype,
+# not with the arrow-backed string dtype that pandas 3 infers by default; the tests of the event tables themselves
+# (test_prepare_utils.py) also run with the string dtype
+pd.set_option('future.infer_string', False)
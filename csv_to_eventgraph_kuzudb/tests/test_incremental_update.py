@@ -0,0 +1,58 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import ekg_builder
+
+# ekg_builder.append must give the same graph as a full build (ekg_builder.verifyAppend compares the Event, Log, entity,
+# CORR, REL/DERIVED, DF, Class, OBSERVED and DF_C tables of both graphs) on a small synthetic BPIC17-like event table
+
+def writeSyntheticLog(directory, cases=40, seed=0):
+    # prepared event table of application, workflow and offer events of each case, as written by bpic17_prepare.py
+    rng = np.random.default_rng(seed)
+    rows = []
+    for case in range(cases):
+        time = pd.Timestamp('2016-01-01 08:00') + pd.Timedelta(hours=int(rng.integers(0, 24*60)))
+        offers = [f'Offer_{case}_{i}' for i in range(int(rng.integers(1, 3)))]
+        for step in range(int(rng.integers(4, 12))):
+            origin = rng.choice(['Application', 'Workflow', 'Offer'])
+            time = time + pd.Timedelta(minutes=int(rng.integers(1, 3000)))
+            rows.append({'Activity': f'{origin[0]}_{rng.choice(["Create", "Submit", "Accept", "Complete"])}',
+                         'lifecycle': rng.choice(['start', 'complete']),
+                         'resource': rng.choice(['User_1', 'User_2', 'User_3', 'User_4', 'Unknown']),
+                         'EventOrigin': origin,
+                         'timestamp': time,
+                         'ApplicationId': f'Application_{case}',
+                         'OfferID': rng.choice(offers) if origin == 'Offer' else 'Unknown'})
+    log = pd.DataFrame(rows).sort_values(['ApplicationId', 'timestamp'], kind='stable', ignore_index=True)
+    log['timestamp'] = log['timestamp'].dt.strftime('%Y-%m-%dT%H:%M:%S.000') + '+0100'
+    log.to_csv(directory / 'BPIC17full.csv', index=True, index_label='idx')
+    return len(log)
+
+def getSpec(directory, schema, delete_parallel_df):
+    spec = ekg_builder.loadSpec(os.path.join(os.path.dirname(ekg_builder.__file__), 'specs', 'bpic17.json'))
+    return {**spec, 'input_directory': str(directory), 'schema': schema, 'delete_parallel_df': delete_parallel_df}
+
+def getStageRows(report, stage):
+    return next(entry['rows'] for entry in report['stages'] if entry['stage'] == stage)
+
+@pytest.mark.parametrize('schema', ['basic', 'typed'])
+@pytest.mark.parametrize('delete_parallel_df', [False, True])
+def test_append_later_events(tmp_path, schema, delete_parallel_df):
+    # the events after the 70% quantile of time extend the DF chains of the entities
+    writeSyntheticLog(tmp_path)
+    identical, fullReport, appendReport = ekg_builder.verifyAppend(getSpec(tmp_path, schema, delete_parallel_df), 0.7, str(tmp_path))
+    assert identical
+    assert getStageRows(appendReport, 'infer_df')['DF created'] > 0
+    assert getStageRows(appendReport, 'build_dfg')['DF_C created'] + getStageRows(appendReport, 'build_dfg')['DF_C updated'] > 0
+
+@pytest.mark.parametrize('schema', ['basic', 'typed'])
+@pytest.mark.parametrize('delete_parallel_df', [False, True])
+def test_append_events_inside_chains(tmp_path, schema, delete_parallel_df):
+    # randomly chosen events are inserted between events of the graph: DF and DF_C relationships are also deleted
+    events = writeSyntheticLog(tmp_path)
+    later = np.random.default_rng(1).random(events) < 0.3
+    identical, fullReport, appendReport = ekg_builder.verifyAppend(getSpec(tmp_path, schema, delete_parallel_df), directory=str(tmp_path), later=later)
+    assert identical
+    assert getStageRows(appendReport, 'infer_df')['DF deleted'] > 0
+    assert getStageRows(appendReport, 'build_dfg')['DF_C deleted'] > 0
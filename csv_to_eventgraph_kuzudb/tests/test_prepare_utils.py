@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+import event_schema
+import prepare_utils
+
+# the shared building blocks of the prepare scripts must give the same event tables as the CSV files the importers read
+
+def getPreparedLog():
+    # prepared event table with the kinds of columns of BPIC17: text, booleans, integers and numbers with missing values
+    return pd.DataFrame({'Activity': pd.Categorical(['O_Create Offer', 'O_Accepted', 'O_Create Offer', 'A_Create Application']),
+                         'OfferID': ['Offer_1', 'Offer_1', 'Offer_2', np.nan],
+                         'Accepted': [True, np.nan, False, True],
+                         'NumberOfTerms': [120.0, np.nan, 60.0, 44.0],
+                         'MonthlyCost': [498.29, np.nan, 200.0, 1000.0],
+                         'timestamp': pd.to_datetime(['2016-01-01 10:51:15.304', '2016-01-01 11:00:00.000', '2016-01-02 09:00:00.000', '2016-01-03 12:00:00.000'])})
+
+@pytest.mark.parametrize('inferString', [False, True])
+def test_arrow_table_has_the_types_of_the_csv(tmp_path, inferString):
+    # the in-process and Parquet event table (toArrowTable) and the CSV event table with inferred types give the Event node
+    # table the same column types and values, also with the string dtype pandas 3 infers by default
+    with pd.option_context('future.infer_string', inferString):
+        log = getPreparedLog()
+        events = prepare_utils.toArrowTable(log, ['timestamp'])
+        csvLog = log.copy()
+        csvLog['timestamp'] = prepare_utils.renderTimestamps(csvLog['timestamp'])
+        csvLog.to_csv(tmp_path / 'events.csv', index=True, index_label='idx', na_rep='Unknown')
+        csv = event_schema.getEventTable([str(tmp_path / 'events.csv')], ['events'], inferTypes=True).drop_columns(['Log'])
+
+    types = {field.name: event_schema.getKuzuType(field.type) for field in events.schema}
+    assert types == {field.name: event_schema.getKuzuType(field.type) for field in csv.schema}
+    assert types['Accepted'] == 'BOOLEAN' and types['NumberOfTerms'] == 'INT64' and types['MonthlyCost'] == 'DOUBLE'
+    for col in events.column_names:
+        assert events.column(col).to_pylist() == csv.column(col).to_pylist(), col
+
+def test_concat_renders_missing_values_as_str():
+    # 'concat' gives the values of the row-wise derivation of BPIC14, str(Category) + ": " + str(ClosureCode), also for
+    # missing values, in object, category and string columns, also with the string dtype pandas 3 infers by default
+    expected = ['incident: Other', 'request: nan', 'nan: X']
+    for inferString in [False, True]:
+        with pd.option_context('future.infer_string', inferString):
+            log = pd.DataFrame({'Category': ['incident', 'request', np.nan], 'ClosureCode': ['Other', np.nan, 'X']})
+            for dtype in [None, 'category']:
+                derived = prepare_utils.deriveColumns(log if dtype is None else log.astype(dtype), [['Activity', 'concat', ['Category', 'ClosureCode'], ': ']])
+                assert derived['Activity'].tolist() == expected, (inferString, dtype)
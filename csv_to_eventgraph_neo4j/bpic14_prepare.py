@@ -5,182 +5,277 @@ Created on Mon Jul  1 14:02:29 2019
 @author: 20175070
 """
 #incidents
-import pandas as pd
 import math,random
-import time, os, csv
+import time, os, csv, argparse
+import prepare_utils
 
 #config
 sample = False
+use_cache = True # skip the preparation if input data, scripts and configuration did not change since the last run, see manifest file in the output directory
+jobs = 4 # number of tables prepared in parallel worker processes, can be overridden with --jobs
 inputpath = '.\\BPIC14\\'
 path_to_neo4j_import_directory = 'C:\\Temp\\Import\\' # where prepared files will be stored
 
 
-start = time.time()
-
-### data prep
-
-change = pd.read_csv(inputpath+f'Detail_Change.csv', keep_default_na=True, sep=';')
-incident = pd.read_csv(inputpath+f'Detail_Incident.csv', keep_default_na=True, sep=';')
-incidentDetail = pd.read_csv(inputpath+f'Detail_Incident_Activity.csv', keep_default_na=True, sep=';')
-interaction = pd.read_csv(inputpath+f'Detail_Interaction.csv', keep_default_na=True, sep=';')
-
-
-
-incident.drop(incident.iloc[:, 28:78], inplace=True, axis=1) #drop all empty columns
-incident = incident.dropna(thresh=19) #drops all 'nan-only' rows
-
-
-change.rename(columns={'Service Component WBS (aff)':'ServiceComponentAff',#sample by
-                       'CI Name (aff)':'CINameAff',
-                       'CI Type (aff)':'CITypeAff',
-                       'CI Subtype (aff)':'CISubTypeAff',
-                       'Change ID':'ChangeID',
-                       'Change Type':'Activity', # activity name
-                       'Risk Assessment':'RiskAssessment',
-                       'Emergency Change':'EmergencyChange',
-                       'CAB-approval needed':'CABApprovalNeeded',
-                       'Planned Start':'PlannedStart',
-                       'Planned End':'PlannedEnd',
-                       'Scheduled Downtime Start':'ScheduledDowntimeStart',
-                       'Scheduled Downtime End':'ScheduledDowntimeEnd',
-                       'Actual Start':'start', # start timestamp of the activity
-                       'Actual End':'timestamp', # complete timestamp of the activity
-                       'Requested End Date':'RequestedEndDate',
-                       'Change record Open Time':'ChangeRecordOpenTime',#only 2 timestamps with no null values
-                       'Change record Close Time':'ChangeRecordCloseTime',#only 2 timestamps with no null values
-                       'Originated from':'OriginatedFrom',
-                       '# Related Interactions':'NoRelatedInteractions',
-                       '# Related Incidents':'NoRelatedIncidents'
-                       }, inplace=True)
-
-
-
-
-incident.rename(columns={'Service Component WBS (aff)':'ServiceComponentAff',#sample by
-                         'CI Name (aff)':'CINameAff',
-                         'CI Type (aff)':'CITypeAff',
-                         'CI Subtype (aff)':'CISubTypeAff',
-                         'Incident ID':'IncidentID',
-                         'KM number':'KMNo',
-                         'Alert Status':'AlertStatus',
-                         '# Reassignments':'NoReassignments',
-                         'Open Time':'start', #only 2 timestamps with no null values
-                         'Reopen Time':'ReopenTime',
-                         'Resolved Time':'ResolvedTime',
-                         'Close Time':'timestamp', #only 2 timestamps with no null values
-                         'Handle Time (Hours)':'HandleTime',
-                         'Closure Code':'ClosureCode',
-                         '# Related Interactions':'NoRelatedInteractions',
-                         'Related Interaction':'RelatedInteraction',
-                         '# Related Incidents':'NoRelatedIncidents',
-                         '# Related Changes':'NoRelatedChanges',
-                         'Related Change':'RelatedChange',
-                         'CI Name (CBy)':'CINameCBy',
-                         'CI Type (CBy)':'CITypeCBy',
-                         'CI Subtype (CBy)':'CISubTypeCBy',
-                         'ServiceComp WBS (CBy)':'ServiceComponentCBy'}, inplace=True)
-
-
-incidentDetail.rename(columns={'Incident ID':'IncidentID',#sample by
-                               'DateStamp':'timestamp', #timestamp
-                               'IncidentActivity_Number':'IncidentActivityNumber',
-                               'IncidentActivity_Type':'Activity',
-                               'Assignment Group':'AssignmentGroup',
-                               'KM number':'KMNo',
-                               'Interaction ID':'InteractionID'}, inplace=True)
-
-interaction.rename(columns={'Service Comp WBS (aff)':'ServiceComponentAff',#sample by
-                            'CI Name (aff)':'CINameAff',
-                            'CI Type (aff)':'CITypeAff',
-                            'CI Subtype (aff)':'CISubTypeAff',
-                            'Interaction ID':'InteractionID',
-                            'KM number':'KMNo',
-                            'Open Time (First Touch)':'start', #start timestamp
-                            'Close Time':'timestamp', #end timestamp
-                            'Closure Code':'ClosureCode',
-                            'First Call Resolution':'FirstCallResolution',
-                            'Handle Time (secs)':'HandleTime',
-                            'Related Incident':'RelatedIncident',
-                            'Category':'Category'}, inplace=True)
-    
-    
-    
-    
-if sample: ## global sample params
-    random.seed(1)
-    change = change[change['ServiceComponentAff'].isin(random.sample(change.ServiceComponentAff.unique().tolist(),20))]
-    incident = incident[incident['ServiceComponentAff'].isin(random.sample(incident.ServiceComponentAff.unique().tolist(),20))]
-    incidentDetail = incidentDetail[incidentDetail['IncidentID'].isin(random.sample(incidentDetail.IncidentID.unique().tolist(),20))]
-    interaction = interaction[interaction['ServiceComponentAff'].isin(random.sample(interaction.ServiceComponentAff.unique().tolist(),10))]
-
-
+# derived attributes per table, see prepare_utils.deriveColumns
 # Actual Start (start)/Actual End (timestamp) are not always defined: impute missing values from ChangeRecord attributes
-for i in change.index:
-    if change.at[i ,'start'] != change.at[i ,'start']:
-        change.at[i ,'start'] = change.at[i,'ChangeRecordOpenTime']
-    if change.at[i ,'timestamp'] != change.at[i ,'timestamp']:
-        change.at[i ,'timestamp'] = change.at[i,'ChangeRecordCloseTime']
-
-change['start'] = pd.to_datetime(change['start'], format='%d-%m-%Y %H:%M')
-change['start'] = change['start'].map(lambda x: x.strftime('%Y-%m-%dT%H:%M')+':00.000+0100')
-change['timestamp'] = pd.to_datetime(change['timestamp'], format='%d-%m-%Y %H:%M')
-change['timestamp'] = change['timestamp'].map(lambda x: x.strftime('%Y-%m-%dT%H:%M')+':00.000+0100')
-
-change = change.reset_index(drop=True)
-
-if sample: #sample params for log file
-    fileName = 'BPIC14Change_sample.csv'
-else:
-    fileName = 'BPIC14Change.csv'
- 
-change.to_csv(path_to_neo4j_import_directory+fileName, index=True, index_label="idx",na_rep="Unknown")
-
-
-for i in incident.index:
-    incident.at[i ,'Activity'] = str(incident.at[i ,'Category'])+": "+str(incident.at[i ,'ClosureCode'])
-
-incident = incident.replace(['#MULTIVALUE','#N/B'], 'Unknown')
-incident['start'] = pd.to_datetime(incident['start'], format='%d/%m/%Y %H:%M:%S')
-incident['start'] = incident['start'].map(lambda x: x.strftime('%Y-%m-%dT%H:%M:%S')+'.000+0100')
-incident['timestamp'] = pd.to_datetime(incident['timestamp'], format='%d/%m/%Y %H:%M:%S')
-incident['timestamp'] = incident['timestamp'].map(lambda x: x.strftime('%Y-%m-%dT%H:%M:%S')+'.000+0100')
-incident = incident.reset_index(drop=True)
-if sample: #sample params for log file
-    fileName = 'BPIC14Incident_sample.csv'
-else:
-    fileName = 'BPIC14Incident.csv'
-
-incident.to_csv(path_to_neo4j_import_directory+fileName, index=True, index_label="idx",na_rep="Unknown")
+change_derivations = [['start', 'fill', 'ChangeRecordOpenTime'],
+                      ['timestamp', 'fill', 'ChangeRecordCloseTime']]
+# the activity of incidents and interactions is given by their category and closure code
+incident_derivations = [['Activity', 'concat', ['Category','ClosureCode'], ': '],
+                        [None, 'replace', ['#MULTIVALUE','#N/B'], 'Unknown']]
+interaction_derivations = [['Activity', 'concat', ['Category','ClosureCode'], ': '],
+                           [None, 'replace', ['#MULTIVALUE','#N/B'], 'Unknown']]
+
+# column types of the raw tables, see prepare_utils.readLog
+# identifiers and text attributes that repeat over many records are loaded as categories, numeric codes are left to pandas
+# timestamps of Change are not parsed while loading, as the imputed start/end values are taken from the (text) ChangeRecord columns
+change_schema = {'Service Component WBS (aff)': 'category',
+                 'CI Name (aff)': 'category',
+                 'CI Type (aff)': 'category',
+                 'CI Subtype (aff)': 'category',
+                 'Change Type': 'category',
+                 'Risk Assessment': 'category',
+                 'Emergency Change': 'category',
+                 'CAB-approval needed': 'category',
+                 'Originated from': 'category'}
+incident_schema = {'Service Component WBS (aff)': 'category',
+                   'CI Name (aff)': 'category',
+                   'CI Type (aff)': 'category',
+                   'CI Subtype (aff)': 'category',
+                   'Status': 'category',
+                   'Category': 'category',
+                   'KM number': 'category',
+                   'Alert Status': 'category',
+                   'Open Time': ['datetime', '%d/%m/%Y %H:%M:%S'],
+                   'Close Time': ['datetime', '%d/%m/%Y %H:%M:%S'],
+                   'Closure Code': 'category',
+                   'CI Name (CBy)': 'category',
+                   'CI Type (CBy)': 'category',
+                   'CI Subtype (CBy)': 'category',
+                   'ServiceComp WBS (CBy)': 'category'}
+incident_detail_schema = {'Incident ID': 'category',
+                          'DateStamp': ['datetime', '%d-%m-%Y %H:%M:%S'],
+                          'IncidentActivity_Type': 'category',
+                          'Assignment Group': 'category',
+                          'KM number': 'category',
+                          'Interaction ID': 'category'}
+# the format of the Interaction timestamps is inferred, so they are parsed after sampling as before
+interaction_schema = {'Service Comp WBS (aff)': 'category',
+                      'CI Name (aff)': 'category',
+                      'CI Type (aff)': 'category',
+                      'CI Subtype (aff)': 'category',
+                      'Status': 'category',
+                      'Category': 'category',
+                      'KM number': 'category',
+                      'Closure Code': 'category',
+                      'First Call Resolution': 'category'}
 
 
-
-incidentDetail['timestamp'] = pd.to_datetime(incidentDetail['timestamp'], format='%d-%m-%Y %H:%M:%S')
-incidentDetail['timestamp'] = incidentDetail['timestamp'].map(lambda x: x.strftime('%Y-%m-%dT%H:%M:%S')+'.000+0100')
-incidentDetail = incidentDetail.reset_index(drop=True)
-if sample: #sample params for log file
-    fileName = 'BPIC14IncidentDetail_sample.csv'
-else:
-    fileName = 'BPIC14IncidentDetail.csv'
+### data prep
+# each table is read, normalized and written by its own function, so that the tables can be prepared in parallel
+# in sample mode, the sample IDs of all tables are drawn before by DrawSamples in the main process
+
+def LoadChange(inputpath):
+    change = prepare_utils.readLog(inputpath+f'Detail_Change.csv', change_schema, keep_default_na=True, sep=';')
+    prepare_utils.printMemoryUsage('BPIC14Change', change)
+
+    change.rename(columns={'Service Component WBS (aff)':'ServiceComponentAff',#sample by
+                           'CI Name (aff)':'CINameAff',
+                           'CI Type (aff)':'CITypeAff',
+                           'CI Subtype (aff)':'CISubTypeAff',
+                           'Change ID':'ChangeID',
+                           'Change Type':'Activity', # activity name
+                           'Risk Assessment':'RiskAssessment',
+                           'Emergency Change':'EmergencyChange',
+                           'CAB-approval needed':'CABApprovalNeeded',
+                           'Planned Start':'PlannedStart',
+                           'Planned End':'PlannedEnd',
+                           'Scheduled Downtime Start':'ScheduledDowntimeStart',
+                           'Scheduled Downtime End':'ScheduledDowntimeEnd',
+                           'Actual Start':'start', # start timestamp of the activity
+                           'Actual End':'timestamp', # complete timestamp of the activity
+                           'Requested End Date':'RequestedEndDate',
+                           'Change record Open Time':'ChangeRecordOpenTime',#only 2 timestamps with no null values
+                           'Change record Close Time':'ChangeRecordCloseTime',#only 2 timestamps with no null values
+                           'Originated from':'OriginatedFrom',
+                           '# Related Interactions':'NoRelatedInteractions',
+                           '# Related Incidents':'NoRelatedIncidents'
+                           }, inplace=True)
+    return change
+
+
+def PrepareChange(inputpath, outputpath, sample, sampleIds=None):
+    change = LoadChange(inputpath)
+
+    if sample:
+        change = change[change['ServiceComponentAff'].isin(sampleIds)]
+
+    change = prepare_utils.deriveColumns(change, change_derivations)
+
+    change = prepare_utils.normalizeTimestamps(change, ['start','timestamp'], '%d-%m-%Y %H:%M', 'm', ':00.000+0100')
+
+    change = change.reset_index(drop=True)
+
+    if sample: #sample params for log file
+        fileName = 'BPIC14Change_sample.csv'
+    else:
+        fileName = 'BPIC14Change.csv'
+ 
+    change.to_csv(outputpath+fileName, index=True, index_label="idx",na_rep="Unknown")
+
+
+def LoadIncident(inputpath):
+    incident = prepare_utils.readLog(inputpath+f'Detail_Incident.csv', incident_schema, keep_default_na=True, sep=';')
+    prepare_utils.printMemoryUsage('BPIC14Incident', incident)
+
+    incident.drop(incident.iloc[:, 28:78], inplace=True, axis=1) #drop all empty columns
+    incident = incident.dropna(thresh=19) #drops all 'nan-only' rows
+
+    incident.rename(columns={'Service Component WBS (aff)':'ServiceComponentAff',#sample by
+                             'CI Name (aff)':'CINameAff',
+                             'CI Type (aff)':'CITypeAff',
+                             'CI Subtype (aff)':'CISubTypeAff',
+                             'Incident ID':'IncidentID',
+                             'KM number':'KMNo',
+                             'Alert Status':'AlertStatus',
+                             '# Reassignments':'NoReassignments',
+                             'Open Time':'start', #only 2 timestamps with no null values
+                             'Reopen Time':'ReopenTime',
+                             'Resolved Time':'ResolvedTime',
+                             'Close Time':'timestamp', #only 2 timestamps with no null values
+                             'Handle Time (Hours)':'HandleTime',
+                             'Closure Code':'ClosureCode',
+                             '# Related Interactions':'NoRelatedInteractions',
+                             'Related Interaction':'RelatedInteraction',
+                             '# Related Incidents':'NoRelatedIncidents',
+                             '# Related Changes':'NoRelatedChanges',
+                             'Related Change':'RelatedChange',
+                             'CI Name (CBy)':'CINameCBy',
+                             'CI Type (CBy)':'CITypeCBy',
+                             'CI Subtype (CBy)':'CISubTypeCBy',
+                             'ServiceComp WBS (CBy)':'ServiceComponentCBy'}, inplace=True)
+    return incident
+
+
+def PrepareIncident(inputpath, outputpath, sample, sampleIds=None):
+    incident = LoadIncident(inputpath)
+
+    if sample:
+        incident = incident[incident['ServiceComponentAff'].isin(sampleIds)]
+
+    incident = prepare_utils.deriveColumns(incident, incident_derivations)
+    incident = prepare_utils.normalizeTimestamps(incident, ['start','timestamp'], '%d/%m/%Y %H:%M:%S', 's', '.000+0100')
+    incident = incident.reset_index(drop=True)
+    if sample: #sample params for log file
+        fileName = 'BPIC14Incident_sample.csv'
+    else:
+        fileName = 'BPIC14Incident.csv'
+
+    incident.to_csv(outputpath+fileName, index=True, index_label="idx",na_rep="Unknown")
+
+
+def LoadIncidentDetail(inputpath):
+    incidentDetail = prepare_utils.readLog(inputpath+f'Detail_Incident_Activity.csv', incident_detail_schema, keep_default_na=True, sep=';')
+    prepare_utils.printMemoryUsage('BPIC14IncidentDetail', incidentDetail)
+
+    incidentDetail.rename(columns={'Incident ID':'IncidentID',#sample by
+                                   'DateStamp':'timestamp', #timestamp
+                                   'IncidentActivity_Number':'IncidentActivityNumber',
+                                   'IncidentActivity_Type':'Activity',
+                                   'Assignment Group':'AssignmentGroup',
+                                   'KM number':'KMNo',
+                                   'Interaction ID':'InteractionID'}, inplace=True)
+    return incidentDetail
+
+
+def PrepareIncidentDetail(inputpath, outputpath, sample, sampleIds=None):
+    incidentDetail = LoadIncidentDetail(inputpath)
+
+    if sample:
+        incidentDetail = incidentDetail[incidentDetail['IncidentID'].isin(sampleIds)]
+
+    incidentDetail = prepare_utils.normalizeTimestamps(incidentDetail, ['timestamp'], '%d-%m-%Y %H:%M:%S', 's', '.000+0100')
+    incidentDetail = incidentDetail.reset_index(drop=True)
+    if sample: #sample params for log file
+        fileName = 'BPIC14IncidentDetail_sample.csv'
+    else:
+        fileName = 'BPIC14IncidentDetail.csv'
   
-incidentDetail.to_csv(path_to_neo4j_import_directory+fileName, index=True, index_label="idx",na_rep="Unknown")
-
-
-for i in interaction.index:
-    interaction.at[i ,'Activity'] = str(interaction.at[i ,'Category'])+": "+str(interaction.at[i ,'ClosureCode'])
-
-interaction['start'] = interaction['start'].astype('datetime64[ns]')
-interaction['start'] = interaction['start'].map(lambda x: x.strftime('%Y-%m-%dT%H:%M:%S')+'.000+0100')
-interaction['timestamp'] = interaction['timestamp'].astype('datetime64[ns]')
-interaction['timestamp'] = interaction['timestamp'].map(lambda x: x.strftime('%Y-%m-%dT%H:%M:%S')+'.000+0100')
-interaction = interaction.reset_index(drop=True)
-interaction = interaction.replace(['#MULTIVALUE','#N/B'], 'Unknown')
-if sample: #sample params for log file
-    fileName = 'BPIC14Interaction_sample.csv'
-else:
-    fileName = 'BPIC14Interaction.csv'
-
-interaction.to_csv(path_to_neo4j_import_directory+fileName, index=True, index_label="idx",na_rep="Unknown")
-
-
-end = time.time()
-print("Prepared data for import in: "+str((end - start))+" seconds.") 
+    incidentDetail.to_csv(outputpath+fileName, index=True, index_label="idx",na_rep="Unknown")
+
+
+def LoadInteraction(inputpath):
+    interaction = prepare_utils.readLog(inputpath+f'Detail_Interaction.csv', interaction_schema, keep_default_na=True, sep=';')
+    prepare_utils.printMemoryUsage('BPIC14Interaction', interaction)
+
+    interaction.rename(columns={'Service Comp WBS (aff)':'ServiceComponentAff',#sample by
+                                'CI Name (aff)':'CINameAff',
+                                'CI Type (aff)':'CITypeAff',
+                                'CI Subtype (aff)':'CISubTypeAff',
+                                'Interaction ID':'InteractionID',
+                                'KM number':'KMNo',
+                                'Open Time (First Touch)':'start', #start timestamp
+                                'Close Time':'timestamp', #end timestamp
+                                'Closure Code':'ClosureCode',
+                                'First Call Resolution':'FirstCallResolution',
+                                'Handle Time (secs)':'HandleTime',
+                                'Related Incident':'RelatedIncident',
+                                'Category':'Category'}, inplace=True)
+    return interaction
+
+
+def PrepareInteraction(inputpath, outputpath, sample, sampleIds=None):
+    interaction = LoadInteraction(inputpath)
+
+    if sample:
+        interaction = interaction[interaction['ServiceComponentAff'].isin(sampleIds)]
+
+    interaction = prepare_utils.deriveColumns(interaction, interaction_derivations)
+    interaction = prepare_utils.normalizeTimestamps(interaction, ['start','timestamp'], None, 's', '.000+0100')
+    interaction = interaction.reset_index(drop=True)
+    if sample: #sample params for log file
+        fileName = 'BPIC14Interaction_sample.csv'
+    else:
+        fileName = 'BPIC14Interaction.csv'
+
+    interaction.to_csv(outputpath+fileName, index=True, index_label="idx",na_rep="Unknown")
+
+
+def DrawSamples(inputpath):
+    # sample IDs of the tables (Change, Incident, IncidentDetail, Interaction), drawn one after the other from one random
+    # generator seeded with 1, as the sequential preparation did, so that the samples do not depend on the parallel preparation
+    # (the tables are loaded once more for this, in sample mode only)
+    rng = random.Random(1)
+    return [rng.sample(LoadChange(inputpath).ServiceComponentAff.unique().tolist(),20),
+            rng.sample(LoadIncident(inputpath).ServiceComponentAff.unique().tolist(),20),
+            rng.sample(LoadIncidentDetail(inputpath).IncidentID.unique().tolist(),20),
+            rng.sample(LoadInteraction(inputpath).ServiceComponentAff.unique().tolist(),10)]
+
+
+def PrepareTables(inputpath, outputpath, sample, jobs):
+    sampleIds = DrawSamples(inputpath) if sample else [None, None, None, None]
+    tasks = [['Change', PrepareChange, (inputpath, outputpath, sample, sampleIds[0])],
+             ['Incident', PrepareIncident, (inputpath, outputpath, sample, sampleIds[1])],
+             ['IncidentDetail', PrepareIncidentDetail, (inputpath, outputpath, sample, sampleIds[2])],
+             ['Interaction', PrepareInteraction, (inputpath, outputpath, sample, sampleIds[3])]]
+    prepare_utils.runParallel(tasks, jobs)
+
+
+if __name__ == '__main__': # worker processes import this module, only the main process runs the preparation
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=jobs, help='number of tables prepared in parallel')
+    args = parser.parse_args()
+
+    start = time.time()
+    if use_cache:
+        suffix = '_sample' if sample else ''
+        inputFiles = [inputpath+'Detail_Change.csv', inputpath+'Detail_Incident.csv', inputpath+'Detail_Incident_Activity.csv', inputpath+'Detail_Interaction.csv', __file__, prepare_utils.__file__]
+        outputFiles = [path_to_neo4j_import_directory+f'BPIC14{table}{suffix}.csv' for table in ['Change','Incident','IncidentDetail','Interaction']]
+        prepare_utils.cachedPrepare(path_to_neo4j_import_directory+f'BPIC14{suffix}.manifest.json', inputFiles, {'sample': sample}, outputFiles,
+                                    PrepareTables, inputpath, path_to_neo4j_import_directory, sample, args.jobs)
+    else:
+        PrepareTables(inputpath, path_to_neo4j_import_directory, sample, args.jobs)
+    end = time.time()
+    print("Prepared data for import in: "+str((end - start))+" seconds.") 
+    prepare_utils.printReport('BPIC14', start)
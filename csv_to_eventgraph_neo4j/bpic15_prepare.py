@@ -1,61 +1,93 @@
 #municipalities, building permit applications
-import pandas as pd
-import time, os, csv
+import time, csv, argparse
+import prepare_utils
 
 ## config
 sample = False
+use_cache = True # skip the preparation if input data, scripts and configuration did not change since the last run, see manifest file in the output directory
+jobs = 5 # number of municipality logs prepared in parallel worker processes, can be overridden with --jobs
 inputpath = '.\\BPIC15\\'
 path_to_neo4j_import_directory = 'C:\\Temp\\Import\\' # where prepared files will be stored
 
+# column types of the raw municipality logs, see prepare_utils.readLog
+# activity codes and names, phases and procedures repeat over many events and are loaded as categories,
+# resources are numeric identifiers and are left to pandas, the identifiers of related objects are integers with missing values
+log_schema = {'event': 'category',
+              'activityNameEN': 'category',
+              'activityNameNL': 'category',
+              'action_code': 'category',
+              'case_type': 'category',
+              'caseStatus': 'category',
+              'caseProcedure': 'category',
+              'last_phase': 'category',
+              'parts': 'category',
+              'startTime': ['datetime', '%Y/%m/%d %H:%M:%S.%f'],
+              'completeTime': ['datetime', '%Y/%m/%d %H:%M:%S.%f'],
+              'IDofConceptCase': 'Int64',
+              'Responsible_actor': 'Int64',
+              'landRegisterID': 'Int64'}
 
 
+def GetSampleIds(i):
+    # sample cases of municipality i
+    sampleIDs = []
+    sampleIDs.append([9691153, 9294701, 3084709, 4375473, 3837125, 4397208, 5843747, 3606967, 11773351, 8051084, 8021700, 2847199, 8958665, 2794023, 2899336, 8816378, 5288872, 5106291, 10997930, 6985928])
+    sampleIDs.append([20284125, 23142529, 3585731, 21038392, 19995133, 3874234, 22139866, 4623044, 3948666, 3702964, 20930456, 20063170, 3808540, 20025552, 20888077, 21986652, 20235405, 19940265, 4395219, 20742337])
+    sampleIDs.append([3055383, 6616348, 3963963, 5245298, 5007761, 6015049, 3824284, 5489846, 3691884, 3965191, 7313344, 3871869, 5718151, 3721360, 5585560, 5702384, 5562464, 5961864, 3829589, 4350022])
+    sampleIDs.append([10516319, 9279433, 4235583, 5932529, 8577457, 6873521, 7084443, 4968228, 5421204, 4578191, 8352642, 4800472, 11167513, 9665535, 7345969, 9095800, 7533366, 5673981, 5902757, 11164523])
+    sampleIDs.append([10873742, 4171558, 4495115, 10837828, 3634775, 8126523, 3589696, 10286510, 7888926, 4532439, 6365048, 8460573, 8315159, 6793246, 6791482, 8612436, 4927985, 4637475, 4592223, 8114679])
+    return sampleIDs[i-1]
 
-def CreateBPI15(path,sample=False):
-    
-    if (sample):
-        sampleIDs = []
-        sampleIDs.append([9691153, 9294701, 3084709, 4375473, 3837125, 4397208, 5843747, 3606967, 11773351, 8051084, 8021700, 2847199, 8958665, 2794023, 2899336, 8816378, 5288872, 5106291, 10997930, 6985928])
-        sampleIDs.append([20284125, 23142529, 3585731, 21038392, 19995133, 3874234, 22139866, 4623044, 3948666, 3702964, 20930456, 20063170, 3808540, 20025552, 20888077, 21986652, 20235405, 19940265, 4395219, 20742337])
-        sampleIDs.append([3055383, 6616348, 3963963, 5245298, 5007761, 6015049, 3824284, 5489846, 3691884, 3965191, 7313344, 3871869, 5718151, 3721360, 5585560, 5702384, 5562464, 5961864, 3829589, 4350022])
-        sampleIDs.append([10516319, 9279433, 4235583, 5932529, 8577457, 6873521, 7084443, 4968228, 5421204, 4578191, 8352642, 4800472, 11167513, 9665535, 7345969, 9095800, 7533366, 5673981, 5902757, 11164523])
-        sampleIDs.append([10873742, 4171558, 4495115, 10837828, 3634775, 8126523, 3589696, 10286510, 7888926, 4532439, 6365048, 8460573, 8315159, 6793246, 6791482, 8612436, 4927985, 4637475, 4592223, 8114679])
-    
-    for i in range(1,6):
-        fileName = f'BPIC15_{i}.csv'
-        log = pd.read_csv(inputpath+fileName, keep_default_na=True)
-        
-        if i == 2:
-            log = log.drop(log[['action_code','activityNameNL','case_type']], axis=1)
-        else:
-            log = log.drop(log[['action_code','endDatePlanned','activityNameNL','case_type']], axis=1)
-
-        log.rename(columns={'case':'cID',
-                                   'event':'Activity',
-                                   'org:resource':'resource',
-                                   'startTime':'start',
-                                   'completeTime':'timestamp'}, inplace=True)
-    
+def PrepareBPI15File(i, inputpath, path, sample=False):
+    fileName = f'BPIC15_{i}.csv'
+    log = prepare_utils.readLog(inputpath+fileName, log_schema, keep_default_na=True)
+    prepare_utils.printMemoryUsage(fileName[0:-4], log)
     
+    if i == 2:
+        log = log.drop(log[['action_code','activityNameNL','case_type']], axis=1)
+    else:
+        log = log.drop(log[['action_code','endDatePlanned','activityNameNL','case_type']], axis=1)
+
+    log.rename(columns={'case':'cID',
+                               'event':'Activity',
+                               'org:resource':'resource',
+                               'startTime':'start',
+                               'completeTime':'timestamp'}, inplace=True)
+
+
+
+    if (sample):  
+        log = log[log['cID'].isin(GetSampleIds(i))]
     
-        if (sample):  
-            log = log[log['cID'].isin(sampleIDs[i-1])]
-        
-        log['IDofConceptCase'] = log.IDofConceptCase.astype('Int64', errors='ignore')
-        log['Responsible_actor'] = log.Responsible_actor.astype('Int64', errors='ignore')
-        log['landRegisterID'] = log.landRegisterID.astype('Int64', errors='ignore')
-        log['start'] = pd.to_datetime(log['start'], format='%Y/%m/%d %H:%M:%S.%f')
-        log['start'] = log['start'].map(lambda x: x.strftime('%Y-%m-%dT%H:%M:%S%z'))
-        log['timestamp'] = pd.to_datetime(log['timestamp'], format='%Y/%m/%d %H:%M:%S.%f')
-        log['timestamp'] = log['timestamp'].map(lambda x: x.strftime('%Y-%m-%dT%H:%M:%S%z'))
+    log = prepare_utils.normalizeTimestamps(log, ['start','timestamp'], '%Y/%m/%d %H:%M:%S.%f', 's', '')
+   
+    if (sample):
+        log.to_csv(path+fileName[0:-4]+'_sample.csv', index=True, index_label="idx",na_rep="Unknown")
+    else:
         log.to_csv(path+fileName, index=True, index_label="idx",na_rep="Unknown")
-       
-        if (sample):
-            log.to_csv(path+fileName[0:-4]+'_sample.csv', index=True, index_label="idx",na_rep="Unknown")
-        else:
-            log.to_csv(path+fileName, index=True, index_label="idx",na_rep="Unknown")
+
+def CreateBPI15(inputpath, path, sample=False, jobs=1):
+    # the five municipality logs are independent: prepare each in its own worker process
+    tasks = []
+    for i in range(1,6):
+        tasks.append([f'BPIC15_{i}', PrepareBPI15File, (i, inputpath, path, sample)])
+    prepare_utils.runParallel(tasks, jobs)
             
-    
-start = time.time()
-CreateBPI15(path_to_neo4j_import_directory,sample)
-end = time.time()
-print("Prepared data for import in: "+str((end - start))+" seconds.") 
+
+if __name__ == '__main__': # worker processes import this module, only the main process runs the preparation
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=jobs, help='number of municipality logs prepared in parallel')
+    args = parser.parse_args()
+
+    start = time.time()
+    if use_cache:
+        suffix = '_sample' if sample else ''
+        inputFiles = [inputpath+f'BPIC15_{i}.csv' for i in range(1,6)] + [__file__, prepare_utils.__file__]
+        outputFiles = [path_to_neo4j_import_directory+f'BPIC15_{i}{suffix}.csv' for i in range(1,6)]
+        prepare_utils.cachedPrepare(path_to_neo4j_import_directory+f'BPIC15{suffix}.manifest.json', inputFiles, {'sample': sample}, outputFiles,
+                                    CreateBPI15, inputpath, path_to_neo4j_import_directory, sample, args.jobs)
+    else:
+        CreateBPI15(inputpath, path_to_neo4j_import_directory, sample, args.jobs)
+    end = time.time()
+    print("Prepared data for import in: "+str((end - start))+" seconds.") 
+    prepare_utils.printReport('BPIC15', start)
@@ -8,22 +8,61 @@ Created on Mon Jun 17 16:51:36 2019
 #website click data, labour services process
 import pandas as pd
 import time, os, csv
+import prepare_utils
 
 
 #config
 sample=False
+use_cache = True # skip the preparation if input data, scripts and configuration did not change since the last run, see manifest file in the output directory
 inputpath = '.\\BPIC16\\'
 path_to_neo4j_import_directory = 'C:\\Temp\\Import\\' # where prepared files will be stored
 
+# column types of the raw logs, see prepare_utils.readLog
+# page names, themes and event types repeat over many events and are loaded as categories, customer and session identifiers are integers
+clicks_schema = {'AgeCategory': 'category',
+                 'Gender': 'category',
+                 'TIMESTAMP': ['datetime', '%Y-%m-%d %H:%M:%S.%f'],
+                 'VHOST': 'category',
+                 'URL_FILE': 'category',
+                 'PAGE_NAME': 'category',
+                 'REF_URL_category': 'category',
+                 'page_action_detail': 'category',
+                 'tip': 'category',
+                 'service_detail': 'category',
+                 'xps_info': 'category',
+                 'page_action_detail_EN': 'category',
+                 'service_detail_EN': 'category',
+                 'tip_EN': 'category'}
+complaints_schema = {'ContactDate': ['datetime', '%Y-%m-%d'],
+                     'ComplaintTopic_EN': 'category',
+                     'ComplaintSubtheme_EN': 'category',
+                     'ComplaintTheme': 'category',
+                     'ComplaintSubtheme': 'category',
+                     'ComplaintTopic': 'category'}
+questions_schema = {'ContactDate': ['datetime', '%Y-%m-%d'],
+                    'ContactTimeStart': ['datetime', '%H:%M:%S.%f'],
+                    'ContactTimeEnd': ['datetime', '%H:%M:%S.%f'],
+                    'QuestionTopic_EN': 'category',
+                    'QuestionSubtheme_EN': 'category',
+                    'QuestionTheme': 'category',
+                    'QuestionSubtheme': 'category',
+                    'QuestionTopic': 'category'}
+messages_schema = {'EventDateTime': ['datetime', '%Y-%m-%d %H:%M:%S.%f'],
+                   'EventType': 'category'}
+
 
 ################## data prep ##################  
     
 def CreateBPI16(inputpath, outputpath, fileName, sample):
     
-    clicksLog = pd.read_csv(os.path.realpath(inputpath+'BPI2016_Clicks_Logged_In.csv'), keep_default_na=True, sep=';',encoding='latin1')
-    complaints = pd.read_csv(os.path.realpath(inputpath+'BPI2016_Complaints.csv'), keep_default_na=True, sep=';',encoding='latin1')
-    questions = pd.read_csv(os.path.realpath(inputpath+'BPI2016_Questions.csv'), keep_default_na=True, sep=';',encoding='latin1')
-    messages = pd.read_csv(os.path.realpath(inputpath+'BPI2016_Werkmap_Messages.csv'), keep_default_na=True, sep=';',encoding='latin1')
+    clicksLog = prepare_utils.readLog(os.path.realpath(inputpath+'BPI2016_Clicks_Logged_In.csv'), clicks_schema, keep_default_na=True, sep=';',encoding='latin1')
+    prepare_utils.printMemoryUsage('BPIC16Clicks', clicksLog)
+    complaints = prepare_utils.readLog(os.path.realpath(inputpath+'BPI2016_Complaints.csv'), complaints_schema, keep_default_na=True, sep=';',encoding='latin1')
+    prepare_utils.printMemoryUsage('BPIC16Complaints', complaints)
+    questions = prepare_utils.readLog(os.path.realpath(inputpath+'BPI2016_Questions.csv'), questions_schema, keep_default_na=True, sep=';',encoding='latin1')
+    prepare_utils.printMemoryUsage('BPIC16Questions', questions)
+    messages = prepare_utils.readLog(os.path.realpath(inputpath+'BPI2016_Werkmap_Messages.csv'), messages_schema, keep_default_na=True, sep=';',encoding='latin1')
+    prepare_utils.printMemoryUsage('BPIC16Messages', messages)
     
     if (sample): 
         sampleIds = [2026796, 2223803, 2023026, 114939, 2011721, 2022933, 919259, 2079086, 466152, 2057965, 1039204, 395673, 1710155, 2081135, 1723340, 1893155, 1042998, 435939, 1735039, 2045407]
@@ -32,20 +71,13 @@ def CreateBPI16(inputpath, outputpath, fileName, sample):
         
     csvLog = complaints
     fileNameTmp = fileName[0:-4]+'Complaints.csv' 
-    sampleList = [] #create a list (of lists) for the sample data containing a list of events for each of the selected cases
-    for case in sampleIds:
-        for index, row in csvLog[csvLog.CustomerID == case].iterrows(): #second iteration through the cases for adding data
-            rowList = list(row) #add the event data to rowList
-            sampleList.append(rowList) #add the extended, single row to the sample dataset
-    
-    header =  list(csvLog) #save the updated header data
-    logSamples = pd.DataFrame(sampleList,columns=header) #create pandas dataframe and add the samples  
-    logSamples.fillna(0)
-    logSamples['ContactDate'] = pd.to_datetime(logSamples['ContactDate'], format='%Y-%m-%d')
-    logSamples['ContactDate'] = logSamples['ContactDate'].map(lambda x: x.strftime('%Y-%m-%dT%H:%M:%S.%f')[0:-3]+'+0100')
+    stepStart = prepare_utils.startReport()
+    logSamples = prepare_utils.selectCases(csvLog, 'CustomerID', sampleIds) #all events of the selected cases, grouped per case
+    logSamples = prepare_utils.normalizeTimestamps(logSamples, ['ContactDate'], '%Y-%m-%d')
     logSamples = logSamples.rename(columns={'ContactDate': 'timestamp','ComplaintTheme': 'Activity'})
 
     logSamples.to_csv(outputpath+fileNameTmp, index=True, index_label="idx",na_rep="Unknown")
+    prepare_utils.printReport('Complaints', stepStart)
     logSamples['idx'] = logSamples.index
 
 
@@ -53,26 +85,17 @@ def CreateBPI16(inputpath, outputpath, fileName, sample):
     
     csvLog = questions
     fileNameTmp = fileName[0:-4]+'Questions.csv'
-    sampleList = [] #create a list (of lists) for the sample data containing a list of events for each of the selected cases
-    for case in sampleIds:
-        for index, row in csvLog[csvLog.CustomerID == case].iterrows(): #second iteration through the cases for adding data
-            rowList = list(row) #add the event data to rowList
-            sampleList.append(rowList) #add the extended, single row to the sample dataset
-    
-    header =  list(csvLog) #save the updated header data
-    logSamples = pd.DataFrame(sampleList,columns=header) #create pandas dataframe and add the samples  
-    logSamples.fillna(0)
-    logSamples['ContactDate'] = pd.to_datetime(logSamples['ContactDate'], format='%Y-%m-%d')
-    logSamples['ContactDate'] = logSamples['ContactDate'].map(lambda x: x.strftime('%Y-%m-%d'))
-    logSamples['ContactTimeStart'] = pd.to_datetime(logSamples['ContactTimeStart'], format='%H:%M:%S.%f')
-    logSamples['ContactTimeStart'] = logSamples['ContactTimeStart'].map(lambda x: x.strftime('%H:%M:%S.%f')[0:-3])
+    stepStart = prepare_utils.startReport()
+    logSamples = prepare_utils.selectCases(csvLog, 'CustomerID', sampleIds) #all events of the selected cases, grouped per case
+    logSamples = prepare_utils.normalizeTimestamps(logSamples, ['ContactDate'], '%Y-%m-%d', 'D', '')
+    logSamples['ContactTimeStart'] = prepare_utils.renderTimes(pd.to_datetime(logSamples['ContactTimeStart'], format='%H:%M:%S.%f'))
     logSamples['start'] = logSamples['ContactDate']+"T"+  logSamples['ContactTimeStart'] +'+0100'
-    logSamples['ContactTimeEnd'] = pd.to_datetime(logSamples['ContactTimeEnd'], format='%H:%M:%S.%f')
-    logSamples['ContactTimeEnd'] = logSamples['ContactTimeEnd'].map(lambda x: x.strftime('%H:%M:%S.%f')[0:-3])
+    logSamples['ContactTimeEnd'] = prepare_utils.renderTimes(pd.to_datetime(logSamples['ContactTimeEnd'], format='%H:%M:%S.%f'))
     logSamples['end'] = logSamples['ContactDate']+"T"+  logSamples['ContactTimeEnd'] +'+0100'
     logSamples = logSamples.rename(columns={'end': 'timestamp','QuestionTheme': 'Activity'})
 
     logSamples.to_csv(outputpath+fileNameTmp, index=True, index_label="idx",na_rep="Unknown")
+    prepare_utils.printReport('Questions', stepStart)
     logSamples['idx'] = logSamples.index
 
     
@@ -82,23 +105,16 @@ def CreateBPI16(inputpath, outputpath, fileName, sample):
     
     csvLog = messages
     fileNameTmp = fileName[0:-4]+'Messages.csv'
-    sampleList = [] #create a list (of lists) for the sample data containing a list of events for each of the selected cases
-    for case in sampleIds:
-        for index, row in csvLog[csvLog.CustomerID == case].iterrows(): #second iteration through the cases for adding data
-            rowList = list(row) #add the event data to rowList
-            sampleList.append(rowList) #add the extended, single row to the sample dataset
-    
-    header =  list(csvLog) #save the updated header data
-    logSamples = pd.DataFrame(sampleList,columns=header) #create pandas dataframe and add the samples  
-    logSamples.fillna(0)
-    logSamples['EventDateTime'] = pd.to_datetime(logSamples['EventDateTime'], format='%Y-%m-%d %H:%M:%S.%f')
-    logSamples['EventDateTime'] = logSamples['EventDateTime'].map(lambda x: x.strftime('%Y-%m-%dT%H:%M:%S.%f')[0:-3]+'+0100')
+    stepStart = prepare_utils.startReport()
+    logSamples = prepare_utils.selectCases(csvLog, 'CustomerID', sampleIds) #all events of the selected cases, grouped per case
+    logSamples = prepare_utils.normalizeTimestamps(logSamples, ['EventDateTime'], '%Y-%m-%d %H:%M:%S.%f')
     logSamples = logSamples.rename(columns={'EventDateTime': 'timestamp','EventType': 'Activity'})
     # logSamples['idx'] = range(1, len(logSamples) + 1)
     
     # logSamples['MessageID'] = logSamples['idx'].astype(str) #add prefix to entity ids
     
     logSamples.to_csv(outputpath+fileNameTmp, index=True, index_label="idx")
+    prepare_utils.printReport('Messages', stepStart)
     
     messages = logSamples
  
@@ -106,22 +122,15 @@ def CreateBPI16(inputpath, outputpath, fileName, sample):
     
     csvLog = clicksLog
     fileNameTmp = fileName[0:-4]+'Clicks.csv'
-    sampleList = [] #create a list (of lists) for the sample data containing a list of events for each of the selected cases
-    for case in sampleIds:
-        for index, row in csvLog[csvLog.CustomerID == case].iterrows(): #second iteration through the cases for adding data
-            rowList = list(row) #add the event data to rowList
-            sampleList.append(rowList) #add the extended, single row to the sample dataset
-    
-    header =  list(csvLog) #save the updated header data
-    logSamples = pd.DataFrame(sampleList,columns=header) #create pandas dataframe and add the samples  
-    logSamples.fillna(0)
-    logSamples['TIMESTAMP'] = pd.to_datetime(logSamples['TIMESTAMP'], format='%Y-%m-%d %H:%M:%S.%f')
-    logSamples['TIMESTAMP'] = logSamples['TIMESTAMP'].map(lambda x: x.strftime('%Y-%m-%dT%H:%M:%S.%f')[0:-3]+'+0100')
+    stepStart = prepare_utils.startReport()
+    logSamples = prepare_utils.selectCases(csvLog, 'CustomerID', sampleIds) #all events of the selected cases, grouped per case
+    logSamples = prepare_utils.normalizeTimestamps(logSamples, ['TIMESTAMP'], '%Y-%m-%d %H:%M:%S.%f')
     logSamples = logSamples.rename(columns={'TIMESTAMP': 'timestamp','PAGE_NAME': 'Activity'})
     logSamples = logSamples.drop(logSamples.columns[[range(-1,-10,-1)]], axis=1)
     
 
     logSamples.to_csv(outputpath+fileNameTmp, index=True, index_label="idx")
+    prepare_utils.printReport('Clicks', stepStart)
     logSamples['idx'] = logSamples.index
 
     
@@ -137,6 +146,13 @@ else:
     fileName = 'BPIC16full.csv'
 
 start = time.time()
-clicksLog, complaints, questions, messages = CreateBPI16(inputpath,path_to_neo4j_import_directory,fileName,sample)
+if use_cache:
+    inputFiles = [inputpath+'BPI2016_Clicks_Logged_In.csv', inputpath+'BPI2016_Complaints.csv', inputpath+'BPI2016_Questions.csv', inputpath+'BPI2016_Werkmap_Messages.csv', __file__, prepare_utils.__file__]
+    outputFiles = [path_to_neo4j_import_directory+fileName[0:-4]+log+'.csv' for log in ['Complaints','Questions','Messages','Clicks']]
+    prepare_utils.cachedPrepare(path_to_neo4j_import_directory+fileName[0:-4]+'.manifest.json', inputFiles, {'sample': sample}, outputFiles,
+                                CreateBPI16, inputpath, path_to_neo4j_import_directory, fileName, sample)
+else:
+    clicksLog, complaints, questions, messages = CreateBPI16(inputpath,path_to_neo4j_import_directory,fileName,sample)
 end = time.time()
-print("Prepared data for import in: "+str((end - start))+" seconds.") 
\ No newline at end of file
+print("Prepared data for import in: "+str((end - start))+" seconds.") 
+prepare_utils.printReport('BPIC16', start)
@@ -1,14 +1,31 @@
 #loan application
 
 import pandas as pd
-import time, os, csv
+import time, os, csv, filecmp
+import prepare_utils
 
 #config
 
 sample = False
+use_cache = True # skip the preparation if input data, scripts and configuration did not change since the last run, see manifest file in the output directory
+compare_rowwise = False # also run the original row-wise preparation, compare timings and check that both outputs are identical
 inputpath = '.\\BPIC17\\'
 path_to_neo4j_import_directory = 'C:\\Temp\\Import\\'
 
+# column types of the raw log, see prepare_utils.readLog
+# activity, lifecycle, resource and case/offer identifiers repeat over many events and are loaded as categories
+log_schema = {'Action': 'category',
+              'org:resource': 'category',
+              'event': 'category',
+              'EventOrigin': 'category',
+              'EventID': 'str',
+              'lifecycle:transition': 'category',
+              'time': ['datetime', '%Y/%m/%d %H:%M:%S.%f'],
+              'case': 'category',
+              'OfferID': 'category',
+              'LoanGoal': 'category',
+              'ApplicationType': 'category'}
+
 def LoadLog(localFile):
     datasetList = []
     headerCSV = []
@@ -26,12 +43,14 @@ def LoadLog(localFile):
     
     return headerCSV, log
 
-def CreateBPI17(inputpath, path_to_neo4j_import_directory, fileName, sample):
-    csvLog = pd.read_csv(os.path.realpath(inputpath+'BPI_Challenge_2017.csv'), keep_default_na=True) #load full log from csv                  
-    csvLog.drop_duplicates(keep='first', inplace=True) #remove duplicates from the dataset
+def LoadBPI17(inputpath):
+    csvLog = prepare_utils.readLog(os.path.realpath(inputpath+'BPI_Challenge_2017.csv'), log_schema, keep_default_na=True) #load full log from csv
+    prepare_utils.printMemoryUsage('BPIC17', csvLog)
+    csvLog = prepare_utils.dropDuplicates(csvLog) #remove duplicates from the dataset
     csvLog = csvLog.reset_index(drop=True) #renew the index to close gaps of removed duplicates 
-    
-    
+    return csvLog
+
+def GetSampleIds(sample):
     if (sample == True): 
         sampleIds = ['Application_2045572635', 
              'Application_2014483796', 
@@ -55,7 +74,9 @@ def CreateBPI17(inputpath, path_to_neo4j_import_directory, fileName, sample):
              'Application_1631297810']
     else:
         sampleIds = [] #csvLog.case.unique().tolist() # create a list of all cases in the dataset
-    
+    return sampleIds
+
+def RenameBPI17(csvLog):
     # rename CSV columns to standard value
     # Activity
     # timestamp
@@ -63,6 +84,42 @@ def CreateBPI17(inputpath, path_to_neo4j_import_directory, fileName, sample):
     # lifecycle for life-cycle transtiion
     csvLog = csvLog.rename(columns={'event': 'Activity','time':'timestamp','org:resource':'resource','lifecycle:transition':'lifecycle'})
     csvLog['EventIDraw'] = csvLog['EventID']
+    return csvLog
+
+def CreateBPI17(inputpath, path_to_neo4j_import_directory, fileName, sample):
+    # columnar preparation: all steps operate on entire columns instead of iterating over rows
+    csvLog = RenameBPI17(LoadBPI17(inputpath))
+    sampleIds = GetSampleIds(sample)
+
+    # fix missing entity identifier: "O_Create Offer" belongs to an offer but has no offer ID,
+    # it is always directly followed by "O_Created" [verified with Disco] which carries the offer ID
+    # shift the columns up by one row so that row i holds the values of its successor row i+1
+    nextActivity = csvLog['Activity'].shift(-1)
+    nextOfferID = csvLog['OfferID'].shift(-1)
+    createOffer = (csvLog['Activity'] == "O_Create Offer") & (nextActivity == 'O_Created')
+    csvLog.loc[createOffer, 'OfferID'] = nextOfferID[createOffer] #assign the offerID of the next event (O_Created) to this activity
+
+    # keep all records of the sample cases (or the entire dataset), renew the index as the row-wise rebuild did
+    if sampleIds != []:
+        csvLog = csvLog[csvLog['case'].isin(sampleIds)]
+    logSamples = csvLog.reset_index(drop=True)
+    del csvLog # release the loaded log, otherwise sorting in place copies the columns shared with it
+
+    # timestamps are parsed while loading, categories of ApplicationId are sorted like the identifiers themselves
+    logSamples.sort_values(['case','timestamp'], inplace=True)
+    logSamples['timestamp'] = prepare_utils.renderTimestamps(logSamples['timestamp'])
+    
+    logSamples.to_csv(path_to_neo4j_import_directory+fileName, index=True, index_label="idx",na_rep="Unknown")
+
+def CreateBPI17_rowwise(inputpath, path_to_neo4j_import_directory, fileName, sample):
+    # original row-by-row preparation, kept for validating and benchmarking CreateBPI17
+    # loads the log as before the dtype schemas (without prepare_utils.readLog and dropDuplicates), so that the comparison
+    # also checks the loading
+    csvLog = pd.read_csv(os.path.realpath(inputpath+'BPI_Challenge_2017.csv'), keep_default_na=True) #load full log from csv
+    csvLog.drop_duplicates(keep='first', inplace=True) #remove duplicates from the dataset
+    csvLog = csvLog.reset_index(drop=True) #renew the index to close gaps of removed duplicates
+    csvLog = RenameBPI17(csvLog)
+    sampleIds = GetSampleIds(sample)
 
     sampleList = [] #create a list (of lists) for the sample data containing a list of events for each of the selected cases
     # fix missing entity identifier for one record: check all records in the list of sample cases (or the entire dataset)
@@ -95,6 +152,22 @@ else:
     
 
 start = time.time()
-CreateBPI17(inputpath, path_to_neo4j_import_directory, fileName, sample)
+if use_cache and not compare_rowwise: # the comparison measures the actual preparation
+    inputFiles = [inputpath+'BPI_Challenge_2017.csv', __file__, prepare_utils.__file__]
+    prepare_utils.cachedPrepare(path_to_neo4j_import_directory+fileName[0:-4]+'.manifest.json', inputFiles, {'sample': sample}, [path_to_neo4j_import_directory+fileName],
+                                CreateBPI17, inputpath, path_to_neo4j_import_directory, fileName, sample)
+else:
+    CreateBPI17(inputpath, path_to_neo4j_import_directory, fileName, sample)
 end = time.time()
 print("Prepared data for import in: "+str((end - start))+" seconds.") 
+prepare_utils.printReport('BPIC17', start)
+
+if(compare_rowwise):
+    fileNameRowwise = fileName[0:-4]+'_rowwise.csv'
+    startRowwise = time.time()
+    CreateBPI17_rowwise(inputpath, path_to_neo4j_import_directory, fileNameRowwise, sample)
+    endRowwise = time.time()
+    print("Prepared data (row-wise) in: "+str((endRowwise - startRowwise))+" seconds.")
+    print("Speedup of columnar preparation: "+str((endRowwise - startRowwise)/(end - start)))
+    identical = filecmp.cmp(path_to_neo4j_import_directory+fileName, path_to_neo4j_import_directory+fileNameRowwise, shallow=False)
+    print("Outputs identical: "+str(identical))
@@ -1,30 +1,69 @@
 import pandas as pd
 import time, csv, os
+import prepare_utils
 
 ### config
 
 sample=False
+use_cache = True # skip the preparation if input data, scripts and configuration did not change since the last run, see manifest file in the output directory
+streaming=False # read, normalize and write the log in chunks of bounded memory instead of loading it entirely
+memory_budget_mb=512 # memory to be used per chunk in streaming mode
 inputpath = '.\\BPIC19\\'
 path_to_neo4j_import_directory = 'C:\\Temp\\Import\\' # where prepared files will be stored
 
-
-
-def CreateBPI19(inputpath, path_to_neo4j_import_directory, fileName, bSample):
-    datasetList = []
-    headerCSV = []
-    i = 0
-    print('Loading source ' + str(time.time()))
-    with open(os.path.realpath(inputpath+'BPI_Challenge_2019.csv')) as f:
-        reader = csv.reader(f)
-        for row in reader:
-            if (i==0):
-                headerCSV = list(row)
-                i +=1
-            else:
-               datasetList.append(row)
-    print('Renaming columns ' + str(time.time()))        
-    csvLog = pd.DataFrame(datasetList,columns=headerCSV)
-       
+# column types of the raw log, see prepare_utils.readLog
+# all values are kept as in the source file (no missing values), case attributes, activities and resources
+# repeat over many events and are loaded as categories
+log_schema = {'case Spend area text': 'category',
+              'case Company': 'category',
+              'case Document Type': 'category',
+              'case Sub spend area text': 'category',
+              'case Purch. Doc. Category name': 'category',
+              'case Vendor': 'category',
+              'case Item Type': 'category',
+              'case Item Category': 'category',
+              'case Spend classification text': 'category',
+              'case Source': 'category',
+              'case Name': 'category',
+              'case GR-Based Inv. Verif.': 'category',
+              'case Item': 'category',
+              'case concept:name': 'category',
+              'case Goods Receipt': 'category',
+              'case Purchasing Document': 'category',
+              'event User': 'category',
+              'event org:resource': 'category',
+              'event concept:name': 'category',
+              'event Cumulative net worth (EUR)': 'str',
+              'event time:timestamp': ['datetime', '%d-%m-%Y %H:%M:%S.%f'],
+              'eventID ': 'str'}
+
+
+
+def GetSampleIds():
+    #PO is defined as case (instead of PO line item)
+    sampleIds = ['4508062571',
+     '4507010217',
+     '4507000321',
+     '4507040910',  
+     '4507021063',
+     '4507024440',
+     '4507001109',
+     '4507020425',
+     '4507014406',
+     '4507018608',
+     '4508066411',
+     '4508053414',
+     '4507010940',
+     '4507022053',
+     '4507016146',
+     '4508044395',
+     '4508072550',
+     '4507002104',
+     '4507020767',
+     '4508057849']
+    return sampleIds
+
+def NormalizeBPI19(csvLog):
     csvLog.drop(columns=['event User','case Source'], inplace=True) #redundant
     
     csvLog.rename(columns={'case concept:name':'cID',
@@ -47,53 +86,56 @@ def CreateBPI19(inputpath, path_to_neo4j_import_directory, fileName, bSample):
                            'event concept:name':'Activity',
                            'event Cumulative net worth (EUR)':'eCumNetWorth',
                            'event time:timestamp':'timestamp'}, inplace=True)
-    print('Changing DateTime format '+ str(time.time()))
-    csvLog['timestamp'] = pd.to_datetime(csvLog['timestamp'], format='%d-%m-%Y %H:%M:%S.%f')
-    csvLog['timestamp'] = csvLog['timestamp'].map(lambda x: x.strftime('%Y-%m-%dT%H:%M:%S.%f')[0:-3]+'+0100')
+    csvLog = prepare_utils.normalizeTimestamps(csvLog, ['timestamp'], '%d-%m-%Y %H:%M:%S.%f')
+    return csvLog
 
+def CreateBPI19(inputpath, path_to_neo4j_import_directory, fileName, bSample):
+    print('Loading source ' + str(time.time()))
+    csvLog = prepare_utils.readLog(os.path.realpath(inputpath+'BPI_Challenge_2019.csv'), log_schema, keep_default_na=False, na_filter=False)
+    prepare_utils.printMemoryUsage('BPIC19', csvLog)
+    print('Renaming columns and changing DateTime format ' + str(time.time()))        
+    csvLog = NormalizeBPI19(csvLog)
 
     if (bSample == True): 
-        sampleIds = ['4508062571',
-         '4507010217',
-         '4507000321',
-         '4507040910',  
-         '4507021063',
-         '4507024440',
-         '4507001109',
-         '4507020425',
-         '4507014406',
-         '4507018608',
-         '4508066411',
-         '4508053414',
-         '4507010940',
-         '4507022053',
-         '4507016146',
-         '4508044395',
-         '4508072550',
-         '4507002104',
-         '4507020767',
-         '4508057849']
-        
-        dfSize = len(csvLog.index)
-        #PO is defined as case (instead of PO line item)
-        sampleList = [] #create a list (of lists) for the sample data containing a list of events for each of the selected cases
-        i = 0
-        for case in sampleIds:
-            for index, row in csvLog[csvLog.cPOID == case].iterrows():
-                i += 1
-                rowList = list(row) #add the event data to rowList
-                sampleList.append(rowList) #add the extended, single row to the sample dataset
-            if (i%100 == 0):
-                print(i+' of '+dfSize+' written...')
-        
-        header =  list(csvLog) #save the updated header data
-        logSamples = pd.DataFrame(sampleList,columns=header) #create pandas dataframe and add the samples 
+        logSamples = prepare_utils.selectCases(csvLog, 'cPOID', GetSampleIds()) #all events of the selected POs, grouped per PO
         logSamples.to_csv(path_to_neo4j_import_directory+fileName, index=True, index_label="idx",na_rep="Unknown")
          
     else:
         csvLog.to_csv(path_to_neo4j_import_directory+fileName, index=True, index_label="idx",na_rep="Unknown")
 
-
+def CreateBPI19Streaming(inputpath, path_to_neo4j_import_directory, fileName, bSample, memoryBudgetMB):
+    # read, normalize and write the log in chunks so that the memory used is bounded by memoryBudgetMB
+    # instead of by the size of the log; the output is the same as written by CreateBPI19
+    sourceFile = os.path.realpath(inputpath+'BPI_Challenge_2019.csv')
+    # all values are read with the types of the schema, as in CreateBPI19
+    readOptions = {'dtype':prepare_utils.getReadTypes(log_schema), 'keep_default_na':False, 'na_filter':False}
+
+    # derive the number of rows per chunk from the memory taken by a probe of the log as text,
+    # a chunk is held about 3 times while being normalized and written (typed values, rendered timestamps, csv buffer)
+    probe = pd.read_csv(sourceFile, nrows=10000, dtype=str, keep_default_na=False, na_filter=False)
+    bytesPerRow = probe.memory_usage(index=True, deep=True).sum() / max(len(probe), 1)
+    chunkSize = max(1000, int(memoryBudgetMB * 2**20 / (3 * bytesPerRow)))
+    print(f'Streaming source in chunks of {chunkSize} rows')
+
+    sampleIds = GetSampleIds()
+    sampleChunks = [] # events of the sample POs are few, they are collected and written at the end
+    nextIdx = 0 # continuous idx numbering across all chunks
+    outputMode = 'w'
+    for chunk in pd.read_csv(sourceFile, chunksize=chunkSize, **readOptions):
+        chunk = NormalizeBPI19(prepare_utils.applySchema(chunk, log_schema))
+        if (bSample == True):
+            sampleChunks.append(chunk[chunk['cPOID'].isin(sampleIds)])
+            continue
+
+        chunk.index = pd.RangeIndex(nextIdx, nextIdx+len(chunk))
+        chunk.to_csv(path_to_neo4j_import_directory+fileName, mode=outputMode, header=(outputMode == 'w'), index=True, index_label="idx",na_rep="Unknown")
+        nextIdx += len(chunk)
+        outputMode = 'a'
+        print(f'{nextIdx} events written... {time.time()}')
+
+    if (bSample == True):
+        logSamples = prepare_utils.selectCases(pd.concat(sampleChunks), 'cPOID', sampleIds) #all events of the selected POs, grouped per PO
+        logSamples.to_csv(path_to_neo4j_import_directory+fileName, index=True, index_label="idx",na_rep="Unknown")
 
 
 if(sample):
@@ -104,10 +146,21 @@ else:
     perfFileName = 'BPIC19fullPerformance.csv'
 
 
+if(streaming):
+    prepareFunction, prepareArgs = CreateBPI19Streaming, (inputpath, path_to_neo4j_import_directory,fileName,sample,memory_budget_mb)
+else:
+    prepareFunction, prepareArgs = CreateBPI19, (inputpath, path_to_neo4j_import_directory,fileName,sample)
+
 start = time.time()
-CreateBPI19(inputpath, path_to_neo4j_import_directory,fileName,sample)
+if use_cache: # streaming and in-memory preparation write the same output
+    inputFiles = [inputpath+'BPI_Challenge_2019.csv', __file__, prepare_utils.__file__]
+    prepare_utils.cachedPrepare(path_to_neo4j_import_directory+fileName[0:-4]+'.manifest.json', inputFiles, {'sample': sample}, [path_to_neo4j_import_directory+fileName],
+                                prepareFunction, *prepareArgs)
+else:
+    prepareFunction(*prepareArgs)
 end = time.time()
 print("Prepared data for import in: "+str((end - start))+" seconds.") 
+prepare_utils.printReport('BPIC19', start)
 
 
 
@@ -0,0 +1,265 @@
+import numpy as np
+import pandas as pd
+import time, tracemalloc, os, sys, json, hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+try:
+    import resource # peak resident set size of the process, not available on Windows
+except ImportError:
+    resource = None
+
+# shared building blocks of the bpicXX_prepare.py scripts
+# all functions operate on entire columns of an event table instead of calling Python code per event
+
+
+################## typed loading ##################
+
+# a dataset schema maps the columns of a raw log (names as in the source file) to the type they are loaded as
+#    'category'           - low-cardinality text (activity, lifecycle, resource, ...), each distinct value is stored once
+#    'str'                - text kept as is, e.g., event identifiers
+#    'Int64'              - integer identifiers with missing values (stays float if the column is not integral)
+#    ['datetime', format] - timestamps, parsed while loading with the format of the source data
+# columns not in the schema get the type inferred by pandas, columns of the schema missing in the file are ignored
+
+def getReadTypes(schema):
+    # dtype argument of pd.read_csv for the columns that are typed by the parser itself
+    return {col: dtype for col, dtype in schema.items() if isinstance(dtype, str) and dtype != 'Int64'}
+
+def applySchema(log, schema):
+    # type the columns that are converted after parsing, one column at a time
+    for col, dtype in schema.items():
+        if col not in log.columns:
+            continue
+        if dtype == 'category': # order the categories by value, so that sorting by the column sorts by its values
+            log[col] = log[col].cat.reorder_categories(log[col].cat.categories.sort_values())
+        elif dtype == 'Int64':
+            log[col] = log[col].astype('Int64', errors='ignore')
+        elif not isinstance(dtype, str) and not pd.api.types.is_datetime64_any_dtype(log[col]):
+            log[col] = pd.to_datetime(log[col], format=dtype[1])
+    return log
+
+def readLog(fileName, schema, **options):
+    # read a raw log with the column types of its dataset schema; options are passed to pd.read_csv
+    # timestamps are parsed by the parser itself, without keeping the text of the whole column (values that do not
+    # match the format are left to applySchema, which raises as before)
+    columns = pd.read_csv(fileName, nrows=0, **options).columns
+    dates = {col: dtype[1] for col, dtype in schema.items() if not isinstance(dtype, str) and col in columns}
+    log = pd.read_csv(fileName, dtype=getReadTypes(schema), parse_dates=list(dates), date_format=dates, **options)
+    return applySchema(log, schema)
+
+def dropDuplicates(log, blockSize=100000):
+    # log without duplicate rows, keeping the first, as log.drop_duplicates(keep='first') but without factorizing all columns
+    # at once: rows are compared by a 64-bit hash of their values, only the rows whose hash repeats are compared by value
+    # the rows are hashed in blocks, so that the intermediate arrays of text columns take little memory
+    hashes = np.empty(len(log), dtype=np.uint64)
+    for blockStart in range(0, len(log), blockSize):
+        hashes[blockStart:blockStart+blockSize] = pd.util.hash_pandas_object(log.iloc[blockStart:blockStart+blockSize], index=False).to_numpy()
+    candidates = pd.Series(hashes).duplicated(keep=False).to_numpy()
+    if not candidates.any():
+        return log
+    duplicates = log[candidates].duplicated(keep='first')
+    return log.drop(duplicates.index[duplicates])
+
+def printMemoryUsage(name, log):
+    # print the memory taken by a loaded log, including the values of text columns
+    print(f"{name}: {len(log)} rows, {log.memory_usage(index=True, deep=True).sum() / 2**20:.1f} MB in memory")
+
+
+################## timestamps ##################
+
+def renderTimestamps(timestamps, unit='ms', suffix='+0100', blockSize=100000):
+    # render a datetime column as ISO 8601 strings in one vectorized call
+    #    unit 'ms' -> 2016-01-01T10:51:15.304 (as strftime('%Y-%m-%dT%H:%M:%S.%f')[0:-3])
+    #    unit 's'  -> 2016-01-01T10:51:15     (as strftime('%Y-%m-%dT%H:%M:%S'))
+    #    unit 'm'  -> 2016-01-01T10:51        (as strftime('%Y-%m-%dT%H:%M'))
+    #    unit 'D'  -> 2016-01-01              (as strftime('%Y-%m-%d'))
+    # digits below the unit are truncated, the suffix (e.g. the timezone offset) is appended to every value
+    # missing timestamps stay missing, so to_csv writes them with its na_rep
+    # values are rendered in blocks, so that the fixed-width intermediate strings take little memory
+    values = pd.to_datetime(timestamps).to_numpy(dtype='datetime64[ns]').astype(f'datetime64[{unit}]')
+    rendered = np.empty(len(values), dtype=object)
+    for blockStart in range(0, len(values), blockSize):
+        block = values[blockStart:blockStart+blockSize]
+        rendered[blockStart:blockStart+blockSize] = np.char.add(np.datetime_as_string(block, unit=unit), suffix)
+    rendered[np.isnat(values)] = np.nan
+    return pd.Series(rendered, index=timestamps.index)
+
+def renderTimes(timestamps, unit='ms'):
+    # render only the time of day of a datetime column, e.g. 10:51:15.304
+    return renderTimestamps(timestamps, unit, '').str[11:]
+
+def normalizeTimestamps(log, columns, format=None, unit='ms', suffix='+0100'):
+    # parse the given timestamp columns (e.g. 'start', 'timestamp', 'end') of an event table
+    # with the format of the source data and replace them by their ISO 8601 rendering
+    # without format, each value is parsed on its own as astype('datetime64[ns]') does (pd.to_datetime would
+    # infer one format from the first value and read ambiguous day/month values differently)
+    for col in columns:
+        values = pd.to_datetime(log[col], format=format) if format is not None else log[col].astype('datetime64[ns]')
+        log[col] = renderTimestamps(values, unit, suffix)
+    return log
+
+
+################## derived attributes ##################
+
+# a derivation rule computes one column from other columns of the event table, each rule is a list
+#    1 name of the derived column (None for 'replace' on all columns)
+#    2 kind of rule
+#        'fill'    - fill missing values of the column with the values of the source column given in 3
+#        'concat'  - concatenate the string values of the source columns given in 3, separated by the string given in 4
+#        'replace' - replace all values given in 3 by the value given in 4
+# e.g. ['start', 'fill', 'ChangeRecordOpenTime'] or ['Activity', 'concat', ['Category','ClosureCode'], ': ']
+
+def deriveColumns(log, rules):
+    # evaluate the derivation rules in the given order, each over the entire column
+    for rule in rules:
+        target, kind = rule[0], rule[1]
+        if kind == 'fill':
+            log[target] = log[target].fillna(log[rule[2]])
+        elif kind == 'concat':
+            separator = rule[3] if len(rule) > 3 else ''
+            # each value as str() renders it, also missing values ('nan'), as the row-wise derivation did
+            values = log[rule[2][0]].astype(object).map(str)
+            for col in rule[2][1:]:
+                values = values + separator + log[col].astype(object).map(str)
+            log[target] = values
+        elif kind == 'replace':
+            for col in (log.columns if target is None else [target]):
+                values = log[col]
+                if isinstance(values.dtype, pd.CategoricalDtype): # the replacement may merge or add categories
+                    log[col] = values.astype(object).replace(rule[2], rule[3]).astype('category')
+                else:
+                    log[col] = values.replace(rule[2], rule[3])
+        else:
+            raise ValueError(f"unknown derivation rule '{kind}' for column '{target}'")
+    return log
+
+################## sampling ##################
+
+def selectCases(log, caseColumn, caseIds):
+    # select all events of the given cases with a single join on the case identifier
+    # the result is grouped by case in the order of caseIds and keeps the original order of events within a case,
+    # i.e., the same rows in the same order as collecting log[log[caseColumn] == case] for each case in caseIds
+    caseOrder = pd.DataFrame({caseColumn: caseIds, '_caseOrder': np.arange(len(caseIds))})
+    selected = log.merge(caseOrder, on=caseColumn, how='inner', sort=False)
+    selected = selected.sort_values('_caseOrder', kind='mergesort') # stable sort keeps the order within a case
+    return selected.drop(columns='_caseOrder').reset_index(drop=True)
+
+
+################## reporting ##################
+
+def startReport():
+    # start measuring time and peak memory allocated by a preparation step, until the report of the step (formatReport)
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    return time.time()
+
+def getPeakRSS():
+    # peak resident set size of this process so far in MB (None if not available)
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10 # bytes on macOS, KB on Linux
+
+def formatReport(name, stepStart):
+    # duration, peak memory allocated since the matching startReport() (if tracing), and peak RSS of the process
+    # tracing stops with the report, as it slows down the preparation: the steps between two reported steps run untraced
+    # and the start of a report over an entire dataset is taken with time.time()
+    report = f"{name} prepared in {time.time() - stepStart:.2f} seconds"
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report = report + f", peak memory {peak / 2**20:.1f} MB"
+    peakRSS = getPeakRSS()
+    if peakRSS is not None:
+        report = report + f", process peak RSS {peakRSS:.1f} MB"
+    return report
+
+def printReport(name, stepStart):
+    print(formatReport(name, stepStart))
+
+
+################## parallel preparation ##################
+
+def reportedCall(name, function, args):
+    # run one preparation step and return its report (duration and memory)
+    stepStart = time.time()
+    function(*args)
+    return formatReport(name, stepStart)
+
+def runParallel(tasks, jobs):
+    # run independent preparation steps, given as [name, function, args], in up to 'jobs' worker processes
+    # each function reads its own input and writes its own output file; prints the duration and memory of each step
+    # (the peak RSS is the one of the worker process, which may have prepared other steps before)
+    # the functions must be defined at module level and the calling script must guard its main code
+    # with if __name__ == '__main__', as worker processes import the script
+    if jobs <= 1:
+        for name, function, args in tasks:
+            print(reportedCall(name, function, args))
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(reportedCall, name, function, args) for name, function, args in tasks]
+        for future in as_completed(futures):
+            print(future.result())
+
+
+################## prepare cache ##################
+
+# a prepare run is identified by a key: the hash of all input files (raw data and prepare scripts)
+# and of the effective configuration (sample flag, sample IDs, output format, ...)
+# the manifest written next to the prepared files records the key and the state of each output file,
+# a later run with the same key and unchanged outputs does not prepare the data again
+
+def hashFile(fileName, blockSize=2**20):
+    fileHash = hashlib.sha256()
+    with open(fileName, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            fileHash.update(block)
+    return fileHash.hexdigest()
+
+def hashConfig(config):
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def getOutputState(fileName):
+    # cheap fingerprint of a prepared file to detect changes after preparation
+    stat = os.stat(fileName)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def readManifest(manifestFile):
+    if not os.path.exists(manifestFile):
+        return None
+    with open(manifestFile) as f:
+        return json.load(f)
+
+def checkManifest(manifestFile, outputFiles, key=None):
+    # True if all outputFiles were written by the prepare run recorded in manifestFile (with the given key)
+    # and were not changed since
+    manifest = readManifest(manifestFile)
+    if manifest is None or (key is not None and manifest['key'] != key):
+        return False
+    for fileName in outputFiles:
+        outputName = os.path.basename(fileName) # outputs are stored in the directory of the manifest
+        if outputName not in manifest['outputs'] or not os.path.exists(fileName):
+            return False
+        if getOutputState(fileName) != manifest['outputs'][outputName]:
+            return False
+    return True
+
+def cachedPrepare(manifestFile, inputFiles, config, outputFiles, prepareFunction, *args):
+    # run prepareFunction(*args) unless the outputFiles are up to date with the inputFiles and config
+    inputHashes = {fileName: hashFile(fileName) for fileName in inputFiles}
+    key = hashConfig({'inputs': inputHashes, 'config': config})
+    if checkManifest(manifestFile, outputFiles, key):
+        print(f"Prepared data is up to date with inputs and configuration, see {manifestFile}")
+        return False
+
+    prepareFunction(*args)
+
+    manifest = {'key': key,
+                'inputs': inputHashes,
+                'config': config,
+                'outputs': {os.path.basename(fileName): getOutputState(fileName) for fileName in outputFiles},
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    with open(manifestFile, 'w') as f:
+        json.dump(manifest, f, indent=2, default=str)
+    return True